@@ -0,0 +1,73 @@
+"""
+Per tick cost of recording a match with training/match_recording.py, as RLGymExampleBot.record_tick does it, over
+enough ticks that chunks are compressed and written in the background meanwhile. Exits with status 1 if the median
+cost is over the budget.
+
+    python -m benchmarks.bench_match_recording --ticks 50000 --budget-us 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.fixtures import make_packet
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rlbot_configs"))
+
+from packet_decoder import PacketDecoder, state_dtype  # noqa: E402
+from training.match_recording import MatchRecorder, read_recording  # noqa: E402
+
+
+def measure(team_size, ticks, directory, obs_size=119):
+    """
+    Returns the seconds each record call took, the recorder and the seconds of game time recorded. Recording runs
+    much faster than a match, so after every chunk the background thread gets the time to write it, like it would
+    during the minute a chunk takes to fill in a match.
+    """
+    rng = np.random.default_rng(0)
+    decoder = PacketDecoder(34)
+    packets = [make_packet(rng, team_size, tick / 15) for tick in range(64)]
+    obs = rng.standard_normal(obs_size).astype(np.float32)
+    action = rng.integers(-1, 2, 8).astype(np.float64)
+    recorder = MatchRecorder(os.path.join(directory, f"{team_size}v{team_size}.rec"),
+                             state_dtype(decoder.num_boosts, 8, np.float32), obs_size)
+
+    durations = np.empty(ticks)
+    for tick in range(ticks):
+        decoder.decode(packets[tick % len(packets)])
+        start = time.perf_counter()
+        recorder.record((decoder.time, 0., decoder.round_active, decoder.n_cars, decoder.blue_score,
+                         decoder.orange_score), decoder.state_values, obs, action)
+        durations[tick] = time.perf_counter() - start
+        if (tick + 1) % recorder.chunk_rows == 0:
+            time.sleep(0.05)
+    recorder.close()
+    # The bot decides 15 times per second of game time
+    return durations, recorder, ticks / 15
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_match_recording")
+    parser.add_argument("--ticks", type=int, default=50_000, help="decision ticks recorded per team size")
+    parser.add_argument("--budget-us", type=float, default=5., help="allowed median microseconds per tick")
+    args = parser.parse_args()
+
+    over_budget = False
+    with tempfile.TemporaryDirectory() as directory:
+        for team_size in (1, 2, 3):
+            durations, recorder, seconds = measure(team_size, args.ticks, directory)
+            us = durations * 1e6
+            _, rows = read_recording(recorder.path)
+            assert len(rows) == recorder.recorded
+            size = os.path.getsize(recorder.path)
+            print(f"{team_size}v{team_size}: median {np.median(us):6.2f} us/tick, p99 {np.percentile(us, 99):6.2f} us, "
+                  f"max {us.max():8.2f} us, {recorder.dropped} dropped, {size / seconds * 60 / 2 ** 20:5.2f} MB per "
+                  f"minute of game time ({size / rows.nbytes:.0%} of the raw rows)")
+            over_budget |= np.median(us) > args.budget_us
+
+    if over_budget:
+        print(f"Recording takes more than the budget of {args.budget_us} us per tick")
+        sys.exit(1)
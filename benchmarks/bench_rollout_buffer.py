@@ -0,0 +1,88 @@
+"""
+Peak resident memory of PPO with SB3's RolloutBuffer and with DiskRolloutBuffer (training/rollout_buffer.py), training
+on the simulator with the same seeds. Every buffer runs in a fresh process, and the final policy parameters are
+compared with those trained with SB3's buffer. Exits with status 1 if a process failed.
+
+    python -m benchmarks.bench_rollout_buffer --n-steps 200000
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BUFFERS = ("default", "disk_float32", "disk_float16")
+
+
+def _resident_bytes():
+    # Current and peak resident set size
+    with open("/proc/self/status") as f:
+        status = dict(line.split(":", 1) for line in f)
+    return int(status["VmRSS"].split()[0]) * 1024, int(status["VmHWM"].split()[0]) * 1024
+
+
+def _train(buffer, n_steps, n_matches, rollouts, directory, results):
+    import torch
+    from stable_baselines3 import PPO
+    from stable_baselines3.common.vec_env import VecMonitor
+
+    from training.hyperparameter_sweep import make_match
+    from training.rollout_buffer import DiskRolloutBuffer
+    from training.sim_vec_env import SimulatedVecEnv
+    from training.state_setter import TrainingStateSetter
+
+    torch.set_num_threads(1)
+    simulation = SimulatedVecEnv(lambda: make_match(8, TrainingStateSetter(seed=0)), n_matches)
+    env = VecMonitor(simulation)
+    model = PPO("MlpPolicy", env, n_steps=n_steps, batch_size=n_steps * env.num_envs // 10, n_epochs=2, seed=0,
+                device="cpu")
+    if buffer != "default":
+        model.rollout_buffer = DiskRolloutBuffer.from_model(
+            model, directory=directory, obs_dtype=np.float16 if buffer == "disk_float16" else np.float32)
+    baseline, _ = _resident_bytes()
+
+    start = time.perf_counter()
+    model.learn(n_steps * env.num_envs * rollouts)
+    _, peak = _resident_bytes()
+    parameters = torch.cat([p.detach().flatten() for p in model.policy.parameters()]).numpy()
+    results[buffer] = dict(baseline=baseline, peak=peak, seconds=time.perf_counter() - start, parameters=parameters,
+                           ep_rew_mean=float(np.mean([e["r"] for e in model.ep_info_buffer])) if model.ep_info_buffer
+                           else float("nan"), nan_rewards=simulation.nan_rewards)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_rollout_buffer")
+    parser.add_argument("--n-steps", type=int, default=100_000, help="steps per env and rollout")
+    parser.add_argument("--matches", type=int, default=1, help="simulated 1v1 matches, 2 envs each")
+    parser.add_argument("--rollouts", type=int, default=2)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager, tempfile.TemporaryDirectory() as directory:
+        results = manager.dict()
+        exit_codes = {}
+        for buffer in BUFFERS:
+            process = context.Process(target=_train, args=(buffer, args.n_steps, args.matches, args.rollouts,
+                                                            directory, results))
+            process.start()
+            process.join()
+            exit_codes[buffer] = process.exitcode
+        results = dict(results)
+
+    mb = 2 ** 20
+    reference = results["default"]["parameters"] if "default" in results else None
+    print(f"{args.rollouts} rollouts of {args.n_steps} steps x {2 * args.matches} envs")
+    for buffer in BUFFERS:
+        if buffer not in results:
+            print(f"{buffer:14s} failed with exit code {exit_codes[buffer]}, see its traceback above")
+            continue
+        r = results[buffer]
+        difference = "n/a" if reference is None else f"{np.abs(r['parameters'] - reference).max():.2e}"
+        print(f"{buffer:14s} peak RSS {r['peak'] / mb:8.1f} MB ({(r['peak'] - r['baseline']) / mb:+8.1f} MB during "
+              f"training), {r['seconds']:6.1f} s, ep_rew_mean {r['ep_rew_mean']:8.3f}, "
+              f"{r['nan_rewards']} NaN rewards replaced, max parameter difference {difference}")
+    if len(results) < len(BUFFERS):
+        sys.exit(1)
@@ -0,0 +1,78 @@
+import time
+import numpy as np
+from rlgym.envs import Match
+from rlgym.utils.action_parsers import DiscreteAction
+from rlgym.utils.terminal_conditions.common_conditions import TimeoutCondition, NoTouchTimeoutCondition, GoalScoredCondition
+
+from training.rewards import OswaldRewardFunction, PlayerToBallRewardFunction, HitSpeedRewardFunction, AirdribbleRewardFunction, BallToGoalRewardFunction, PlayerVelocityReward
+from training.batched_rewards import BatchedCombinedReward
+from training.state_setter import TrainingStateSetter
+from training.observations import OswaldObservations
+from training.simulator import SimulatedArenas, SimulatedMatches
+
+
+def get_match(team_size=1):
+    # Same configuration as main.py
+    return Match(
+        team_size=team_size,
+        tick_skip=8,
+        reward_function=BatchedCombinedReward(
+            (
+                PlayerToBallRewardFunction(),
+                HitSpeedRewardFunction(reward_weight=5),
+                AirdribbleRewardFunction(reward_weight=3),
+                BallToGoalRewardFunction(reward_weight=5),
+                PlayerVelocityReward(),
+                OswaldRewardFunction(goal_weight=10, concede_weight=-10, touch_weight=1, shot_weight=5,
+                                     save_weight=5, boost_pickup_weight=0.1),
+            ),
+            (1, 1, 1, 1, 0.005, 1)),
+        spawn_opponents=True,
+        terminal_conditions=[TimeoutCondition(10000), NoTouchTimeoutCondition(2500), GoalScoredCondition()],
+        obs_builder=OswaldObservations(batched=True),
+        state_setter=TrainingStateSetter(),
+        action_parser=DiscreteAction()
+    )
+
+
+def arena_steps_per_second(n_arenas, team_size=1, steps=20, seed=0):
+    """
+    Physics only, every arena is stepped by 8 ticks with random controls.
+    """
+    rng = np.random.default_rng(seed)
+    match = get_match(team_size)
+    simulation = SimulatedMatches([match])
+    arenas = SimulatedArenas(n_arenas, simulation.arenas.car_ids, simulation.arenas.teams)
+    for i in range(n_arenas):
+        arenas.reset_arena(i, match.get_reset_state())
+
+    controls = DiscreteAction().parse_actions(rng.integers(0, 3, (n_arenas * arenas.n_cars, 8)), None)
+    start = time.perf_counter()
+    for _ in range(steps):
+        arenas.step(controls, 8)
+    return n_arenas * steps / (time.perf_counter() - start)
+
+
+def match_steps_per_second(n_matches, team_size=1, steps=50, seed=0):
+    """
+    Full RLGym steps, including state parsing, observations, rewards and terminal conditions.
+    """
+    rng = np.random.default_rng(seed)
+    simulation = SimulatedMatches([get_match(team_size) for _ in range(n_matches)])
+    for i in range(n_matches):
+        simulation.reset(i)
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        actions = [rng.integers(0, 3, (n_agents, 8)) for n_agents in simulation.n_agents_per_match]
+        for i, (_, _, done, _) in enumerate(simulation.step(actions)):
+            if done:
+                simulation.reset(i)
+    return n_matches * steps / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    for n_arenas in (1, 64, 1024, 4096):
+        print(f"{n_arenas:5d} arenas: {arena_steps_per_second(n_arenas):10.0f} physics steps/s")
+    for team_size in (1, 3):
+        print(f"{team_size}v{team_size} matches: {match_steps_per_second(16, team_size):10.0f} match steps/s")
@@ -0,0 +1,114 @@
+"""
+Compares the step overhead of SubprocVecEnv, which pickles every step's results through pipes like
+SB3MultipleInstanceEnv, with SharedMemoryVecEnv. The envs return constant observations of the size OswaldObservations
+builds, so only the transport is measured.
+"""
+import time
+
+import gym
+import numpy as np
+from gym import spaces
+from stable_baselines3.common.vec_env import SubprocVecEnv, VecEnv
+
+from training.shm_vec_env import SharedMemoryVecEnv
+
+# OswaldObservations sizes
+OBS_SIZES = {1: 119, 3: 267}
+
+
+def _spaces(obs_size):
+    return spaces.Box(-np.inf, np.inf, (obs_size,), dtype=np.float32), spaces.MultiDiscrete([3] * 5 + [2] * 3)
+
+
+class ConstantMatchEnv(gym.Env):
+    """
+    One match for SubprocVecEnv, the observations of its agents are stacked like SB3MultipleInstanceEnv's matches.
+    """
+
+    def __init__(self, n_agents, obs_size):
+        self.observation_space, self.action_space = _spaces(obs_size)
+        self.obs = np.ones((n_agents, obs_size), dtype=np.float32)
+        self.rewards = np.zeros(n_agents)
+
+    def reset(self):
+        return self.obs
+
+    def step(self, actions):
+        return self.obs, self.rewards, False, {}
+
+
+class ConstantVecEnv(VecEnv):
+    """
+    One match for SharedMemoryVecEnv, every agent is an env.
+    """
+
+    def __init__(self, n_agents, obs_size):
+        super().__init__(n_agents, *_spaces(obs_size))
+        self.obs = np.ones((n_agents, obs_size), dtype=np.float32)
+        self.rewards = np.zeros(n_agents)
+        self.dones = np.zeros(n_agents, dtype=bool)
+        self.infos = [{} for _ in range(n_agents)]
+
+    def reset(self):
+        return self.obs
+
+    def step_async(self, actions):
+        pass
+
+    def step_wait(self):
+        return self.obs, self.rewards, self.dones, self.infos
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        return [None] * self.num_envs
+
+    def set_attr(self, attr_name, value, indices=None):
+        pass
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [None] * self.num_envs
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False] * self.num_envs
+
+    def seed(self, seed=None):
+        return [None] * self.num_envs
+
+
+def make_pipe_env(n_matches, team_size):
+    return SubprocVecEnv([lambda: ConstantMatchEnv(2 * team_size, OBS_SIZES[team_size])] * n_matches,
+                         start_method="spawn")
+
+
+def make_shared_memory_env(n_matches, team_size):
+    obs_space, action_space = _spaces(OBS_SIZES[team_size])
+    return SharedMemoryVecEnv([lambda: ConstantVecEnv(2 * team_size, OBS_SIZES[team_size])] * n_matches,
+                              [2 * team_size] * n_matches, obs_space, action_space)
+
+
+def microseconds_per_step(env, action_shape, steps=2000):
+    actions = np.zeros(action_shape, dtype=np.int64)
+    env.reset()
+    for _ in range(100):
+        env.step(actions)
+    start = time.perf_counter()
+    for _ in range(steps):
+        env.step(actions)
+    return (time.perf_counter() - start) / steps * 1e6
+
+
+if __name__ == "__main__":
+    for team_size in (1, 3):
+        for n_matches in (1, 4, 8):
+            n_agents = 2 * team_size
+            results = []
+            # SubprocVecEnv's actions are per match, SharedMemoryVecEnv's per agent
+            for make_env, action_shape in ((make_pipe_env, (n_matches, n_agents, 8)),
+                                           (make_shared_memory_env, (n_matches * n_agents, 8))):
+                env = make_env(n_matches, team_size)
+                results.append(microseconds_per_step(env, action_shape))
+                env.close()
+            print(f"{team_size}v{team_size} x {n_matches} matches: pipes {results[0]:8.1f} us/step, "
+                  f"shared memory {results[1]:8.1f} us/step ({results[0] / results[1]:.2f}x)")
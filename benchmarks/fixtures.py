@@ -0,0 +1,111 @@
+import numpy as np
+from rlgym.utils.gamestates import GameState, PlayerData, PhysicsObject
+from rlgym.utils.common_values import BLUE_TEAM, ORANGE_TEAM
+
+# Orange side observations are mirrored through the x and y axes
+INVERT = np.array([-1, -1, 1])
+
+
+def _random_quaternion(rng: np.random.Generator):
+    quaternion = rng.normal(size=4)
+    return quaternion / np.linalg.norm(quaternion)
+
+
+def _inverted_quaternion(quaternion: np.ndarray):
+    # Rotation by pi around the z axis, (w, x, y, z) order
+    w, x, y, z = quaternion
+    return np.array([-z, -y, x, w])
+
+
+def make_player(rng: np.random.Generator, car_id: int, team_num: int) -> PlayerData:
+    player = PlayerData()
+    player.car_id = car_id
+    player.team_num = team_num
+    player.match_goals, player.match_saves, player.match_shots, player.match_demolishes, player.boost_pickups = \
+        (int(v) for v in rng.integers(0, 4, 5))
+    player.is_demoed, player.on_ground, player.ball_touched, player.has_jump, player.has_flip = \
+        (bool(v) for v in rng.integers(0, 2, 5))
+    player.boost_amount = float(rng.uniform())
+
+    position = rng.uniform(-3000, 3000, 3)
+    position[2] = abs(position[2]) / 3
+    linear_velocity = rng.uniform(-1500, 1500, 3)
+    angular_velocity = rng.uniform(-5, 5, 3)
+    quaternion = _random_quaternion(rng)
+    player.car_data = PhysicsObject(position, quaternion, linear_velocity, angular_velocity)
+    player.inverted_car_data = PhysicsObject(position * INVERT, _inverted_quaternion(quaternion),
+                                             linear_velocity * INVERT, angular_velocity * INVERT)
+    return player
+
+
+def make_state(rng: np.random.Generator, team_size=1, spawn_opponents=True) -> GameState:
+    """
+    Builds a random GameState with the same ids and layout as an RLGym match, without a running game.
+    """
+    state = GameState()
+    state.blue_score = int(rng.integers(0, 3))
+    state.orange_score = int(rng.integers(0, 3))
+    state.boost_pads[:] = rng.integers(0, 2, GameState.BOOST_PADS_LENGTH)
+    state.inverted_boost_pads[:] = state.boost_pads[::-1]
+
+    position = rng.uniform(-3000, 3000, 3)
+    position[2] = abs(position[2]) / 3
+    linear_velocity = rng.uniform(-2000, 2000, 3)
+    angular_velocity = rng.uniform(-5, 5, 3)
+    state.ball = PhysicsObject(position=position, linear_velocity=linear_velocity, angular_velocity=angular_velocity)
+    state.inverted_ball = PhysicsObject(position=position * INVERT, linear_velocity=linear_velocity * INVERT,
+                                        angular_velocity=angular_velocity * INVERT)
+
+    # Same spectator ids as rlgym's StateWrapper
+    for i in range(team_size):
+        state.players.append(make_player(rng, 1 + i, BLUE_TEAM))
+    if spawn_opponents:
+        for i in range(team_size):
+            state.players.append(make_player(rng, 5 + i, ORANGE_TEAM))
+    return state
+
+
+def _set_physics(physics, rng: np.random.Generator, z_scale=1 / 3):
+    x, y, z = rng.uniform(-3000, 3000, 3)
+    physics.location.x, physics.location.y, physics.location.z = x, y, abs(z) * z_scale
+    physics.velocity.x, physics.velocity.y, physics.velocity.z = rng.uniform(-1500, 1500, 3)
+    physics.angular_velocity.x, physics.angular_velocity.y, physics.angular_velocity.z = rng.uniform(-5, 5, 3)
+    physics.rotation.pitch, physics.rotation.yaw, physics.rotation.roll = rng.uniform(-np.pi / 2, np.pi / 2, 3)
+
+
+def make_field_info(num_boosts=GameState.BOOST_PADS_LENGTH):
+    """
+    Builds the FieldInfoPacket rlgym_compat's GameState needs, requires rlbot.
+    """
+    from rlbot.utils.structures.game_data_struct import FieldInfoPacket
+
+    field_info = FieldInfoPacket()
+    field_info.num_boosts = num_boosts
+    return field_info
+
+
+def make_packet(rng: np.random.Generator, team_size=1, seconds_elapsed=0.):
+    """
+    Builds a random GameTickPacket with the blue cars first, like RLBot does for a team_size v team_size match.
+    Requires rlbot.
+    """
+    from rlbot.utils.structures.game_data_struct import GameTickPacket
+
+    packet = GameTickPacket()
+    packet.game_info.seconds_elapsed = seconds_elapsed
+    packet.teams[0].score, packet.teams[1].score = (int(v) for v in rng.integers(0, 3, 2))
+
+    packet.num_boost = GameState.BOOST_PADS_LENGTH
+    for i, active in enumerate(rng.integers(0, 2, GameState.BOOST_PADS_LENGTH)):
+        packet.game_boosts[i].is_active = bool(active)
+
+    _set_physics(packet.game_ball.physics, rng)
+
+    packet.num_cars = 2 * team_size
+    for i in range(packet.num_cars):
+        car = packet.game_cars[i]
+        _set_physics(car.physics, rng)
+        car.team = BLUE_TEAM if i < team_size else ORANGE_TEAM
+        car.boost = int(rng.integers(0, 101))
+        car.has_wheel_contact, car.jumped, car.double_jumped = (bool(v) for v in rng.integers(0, 2, 3))
+    return packet
@@ -0,0 +1,374 @@
+"""
+Benchmark suite for the training and bot code, runs on synthetic fixtures so it needs no running game.
+
+    python -m benchmarks.suite run                      # writes benchmarks/results/latest.json
+    python -m benchmarks.suite run -k rewards           # only benchmarks whose name contains "rewards"
+    python -m benchmarks.suite run --save-baseline      # also stores the results as the baseline
+    python -m benchmarks.suite compare --threshold 0.1  # flags benchmarks more than 10% slower than the baseline
+"""
+import argparse
+import datetime
+import functools
+import json
+import pathlib
+import platform
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+from rlgym.utils.reward_functions import CombinedReward
+from rlgym.utils.state_setters import StateWrapper
+
+from benchmarks.fixtures import make_state, make_packet, make_field_info
+from training.rewards import OswaldRewardFunction, PlayerToBallRewardFunction, HitSpeedRewardFunction, \
+    AirdribbleRewardFunction, BallToGoalRewardFunction, PlayerVelocityReward
+from training.batched_rewards import BatchedCombinedReward
+from training.state_setter import TrainingStateSetter
+from training.observations import OswaldObservations
+from training.profiling import Profiler
+
+BENCHMARK_DIRECTORY = pathlib.Path(__file__).parent.resolve()
+RLBOT_DIRECTORY = BENCHMARK_DIRECTORY.parent / "rlbot_configs"
+RESULTS_PATH = BENCHMARK_DIRECTORY / "results" / "latest.json"
+BASELINE_PATH = BENCHMARK_DIRECTORY / "baselines" / "baseline.json"
+
+# Bundled model with the same observation size as OswaldObservations in 1v1
+BENCHMARK_MODEL = "ball_touch"
+
+TEAM_SIZES = (1, 2, 3)
+
+# name -> setup function returning (function to time, items handled per call)
+BENCHMARKS = {}
+
+
+def benchmark(name, **kwargs):
+    def register(setup):
+        BENCHMARKS[name] = functools.partial(setup, **kwargs)
+        return setup
+    return register
+
+
+def make_rewards():
+    # Same rewards and weights as main.py
+    reward_functions = (
+        PlayerToBallRewardFunction(),
+        HitSpeedRewardFunction(reward_weight=5),
+        AirdribbleRewardFunction(reward_weight=3),
+        BallToGoalRewardFunction(reward_weight=5),
+        PlayerVelocityReward(),
+        OswaldRewardFunction(goal_weight=10, concede_weight=-10, touch_weight=1, shot_weight=5, save_weight=5,
+                             boost_pickup_weight=0.1),
+    )
+    return reward_functions, (1, 1, 1, 1, 0.005, 1)
+
+
+def _build_obs(team_size, **obs_kwargs):
+    state = make_state(np.random.default_rng(0), team_size)
+    obs_builder = OswaldObservations(**obs_kwargs)
+    obs_builder.reset(state)
+    player = state.players[0]
+    previous_action = np.zeros(8)
+    return lambda: obs_builder.build_obs(player, state, previous_action), 1
+
+
+def _build_obs_batch(team_size, **obs_kwargs):
+    state = make_state(np.random.default_rng(0), team_size)
+    obs_builder = OswaldObservations(batched=True, **obs_kwargs)
+    obs_builder.reset(state)
+    return lambda: obs_builder.build_obs_batch(state), len(state.players)
+
+
+def _reward(reward_function, team_size):
+    state = make_state(np.random.default_rng(0), team_size)
+    reward_function.reset(state)
+    previous_action = np.zeros(8)
+
+    def step():
+        reward_function.pre_step(state)
+        for player in state.players:
+            reward_function.get_reward(player, state, previous_action)
+    return step, len(state.players)
+
+
+for _team_size in TEAM_SIZES:
+    _shape = f"{_team_size}v{_team_size}"
+    benchmark(f"observations/build_obs/{_shape}", team_size=_team_size)(_build_obs)
+    benchmark(f"observations/build_obs_preallocated/{_shape}", team_size=_team_size, preallocate=True)(_build_obs)
+    benchmark(f"observations/build_obs_batch/{_shape}", team_size=_team_size)(_build_obs_batch)
+    benchmark(f"observations/build_obs_fixed_slots/{_shape}", team_size=_team_size, preallocate=True,
+              max_team_size=3)(_build_obs)
+    benchmark(f"observations/build_obs_batch_fixed_slots/{_shape}", team_size=_team_size,
+              max_team_size=3)(_build_obs_batch)
+
+
+# Cost of the timers of training/profiling.py, compare with observations/build_obs_batch/1v1
+@benchmark("profiling/build_obs_batch_timed/1v1")
+def _build_obs_batch_timed():
+    state = make_state(np.random.default_rng(0), 1)
+    obs_builder = OswaldObservations(batched=True)
+    obs_builder.reset(state)
+    Profiler().instrument(obs_builder, "build_obs_batch", "observations/build_obs_batch")
+    return lambda: obs_builder.build_obs_batch(state), len(state.players)
+
+
+@benchmark("profiling/record")
+def _profiler_record():
+    profiler = Profiler()
+    return lambda: profiler.record("timer", 1e-4), 1
+
+
+for _index, _reward_function in enumerate(make_rewards()[0]):
+    @benchmark(f"rewards/{type(_reward_function).__name__}/1v1", index=_index)
+    def _single_reward(index):
+        return _reward(make_rewards()[0][index], team_size=1)
+
+
+for _team_size in TEAM_SIZES:
+    @benchmark(f"rewards/CombinedReward/{_team_size}v{_team_size}", team_size=_team_size)
+    def _combined_reward(team_size):
+        return _reward(CombinedReward(*make_rewards()), team_size)
+
+    @benchmark(f"rewards/BatchedCombinedReward/{_team_size}v{_team_size}", team_size=_team_size)
+    def _batched_combined_reward(team_size):
+        return _reward(BatchedCombinedReward(*make_rewards()), team_size)
+
+    @benchmark(f"rewards/BatchedCombinedReward_telemetry/{_team_size}v{_team_size}", team_size=_team_size)
+    def _batched_combined_reward_telemetry(team_size):
+        return _reward(BatchedCombinedReward(*make_rewards(), telemetry_capacity=4096), team_size)
+
+
+for _team_size in TEAM_SIZES:
+    @benchmark(f"state_setter/reset/{_team_size}v{_team_size}", team_size=_team_size)
+    def _state_setter_reset(team_size):
+        state_setter = TrainingStateSetter(seed=0)
+        state_wrapper = StateWrapper(blue_count=team_size, orange_count=team_size)
+        return lambda: state_setter.reset(state_wrapper), 1
+
+
+def _load_agent(use_numpy_policy=False):
+    """
+    Builds rlbot_configs/agent.py's Agent around the bundled benchmark model on the CPU, Agent() itself needs the
+    model name filled in and CUDA.
+    """
+    if str(RLBOT_DIRECTORY) not in sys.path:
+        sys.path.append(str(RLBOT_DIRECTORY))
+    from agent import Agent
+    from rlgym.utils.action_parsers.discrete_act import DiscreteAction
+    from training.export_policy import load_checkpoint, export_policy
+    from training.numpy_policy import NumpyPolicy
+
+    agent = Agent.__new__(Agent)
+    agent.actor = load_checkpoint(RLBOT_DIRECTORY / f"{BENCHMARK_MODEL}.zip")
+    if use_numpy_policy:
+        with tempfile.TemporaryDirectory() as directory:
+            export_policy(agent.actor, f"{directory}/{BENCHMARK_MODEL}.npz")
+            agent.actor = NumpyPolicy(f"{directory}/{BENCHMARK_MODEL}.npz")
+    agent.parser = DiscreteAction()
+    return agent
+
+
+@benchmark("agent/act_numpy_policy/1v1", use_numpy_policy=True)
+@benchmark("agent/act/1v1")
+def _agent_act(use_numpy_policy=False):
+    agent = _load_agent(use_numpy_policy)
+    state = make_state(np.random.default_rng(0), 1)
+    obs_builder = OswaldObservations()
+    obs_builder.reset(state)
+    obs = obs_builder.build_obs(state.players[0], state, np.zeros(8))
+    return lambda: agent.act(obs), 1
+
+
+@benchmark("league/opponent_actions_batched/64", batched=True)
+@benchmark("league/opponent_actions/64")
+def _opponent_actions(batched=False, n_opponents=64):
+    """
+    Actions of one snapshot for 64 opponent cars, in one batched forward pass or one pass per car.
+    """
+    policy = _load_agent(use_numpy_policy=True).actor
+    obs = np.random.default_rng(0).normal(size=(n_opponents, policy.observation_size)).astype(np.float32)
+    if batched:
+        return lambda: policy.predict_batch(obs), n_opponents
+    return lambda: [policy.predict(o) for o in obs], n_opponents
+
+
+def _make_bot(agent, use_packet_decoder=True, pipelined=False, record_matches=False):
+    import bot
+
+    bot.Agent = lambda: agent
+    rlgym_bot = bot.RLGymExampleBot("benchmark", 0, 0)
+    rlgym_bot.pipelined = pipelined
+    rlgym_bot.use_packet_decoder = use_packet_decoder
+    rlgym_bot.record_matches = record_matches
+    if record_matches:
+        rlgym_bot.recording_directory = pathlib.Path(tempfile.mkdtemp(prefix="benchmark-recordings-"))
+    rlgym_bot.get_field_info = make_field_info
+    rlgym_bot.initialize_agent()
+    return rlgym_bot
+
+
+@benchmark("bot/get_output_recording/1v1", team_size=1, record_matches=True)
+@benchmark("bot/get_output_pipelined/1v1", team_size=1, pipelined=True)
+@benchmark("bot/get_output/3v3", team_size=3)
+@benchmark("bot/get_output/1v1", team_size=1)
+def _bot_get_output(team_size, pipelined=False, record_matches=False):
+    """
+    One tick_skip cycle of RLGymExampleBot.get_output, the result is the average latency per game tick. In pipelined
+    mode this is only the time spent on the tick thread.
+    """
+    rlgym_bot = _make_bot(_load_agent(), pipelined=pipelined, record_matches=record_matches)
+
+    rng = np.random.default_rng(0)
+    packets = [make_packet(rng, team_size, tick / 120) for tick in range(rlgym_bot.tick_skip)]
+
+    def cycle():
+        # Rewind the clock so every call sees one tick elapsed, like a game running at 120 ticks per second
+        rlgym_bot.prev_time = -1 / 120
+        for packet in packets:
+            rlgym_bot.get_output(packet)
+    return cycle, len(packets)
+
+
+for _team_size in TEAM_SIZES:
+    @benchmark(f"bot/build_obs_compat_game_state/{_team_size}v{_team_size}", team_size=_team_size,
+               use_packet_decoder=False)
+    @benchmark(f"bot/build_obs/{_team_size}v{_team_size}", team_size=_team_size)
+    def _bot_build_obs(team_size, use_packet_decoder=True):
+        """
+        Decoding a packet and building the bot's observation, with packet_decoder.py or rlgym_compat's GameState.
+        """
+        rlgym_bot = _make_bot(_load_agent(), use_packet_decoder)
+        packet = make_packet(np.random.default_rng(0), team_size)
+        previous_action = np.zeros(8)
+        return lambda: rlgym_bot.build_obs(rlgym_bot.game_state, packet, rlgym_bot.tick_skip, previous_action), 1
+
+
+for _team_size in (1, 3):
+    @benchmark(f"bot/record_tick/{_team_size}v{_team_size}", team_size=_team_size)
+    def _bot_record_tick(team_size):
+        """
+        Recording one decision tick with training/match_recording.py, including the chunks written in the background.
+        """
+        rlgym_bot = _make_bot(_load_agent(), record_matches=True)
+        packet = make_packet(np.random.default_rng(0), team_size)
+        obs = rlgym_bot.build_obs(rlgym_bot.game_state, packet, rlgym_bot.tick_skip, np.zeros(8))
+        action = rlgym_bot.agent.act(obs)
+        return lambda: rlgym_bot.record_tick(rlgym_bot.game_state, obs, action, 0.), 1
+
+
+def time_benchmark(function, items=1, repeat=5, min_seconds=0.2):
+    """
+    Returns microseconds per call and per item, taking the median over repeat runs of at least min_seconds each.
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_seconds:
+        number *= 2
+    us_per_call = np.array(timer.repeat(repeat, number)) / number * 1e6
+    return {
+        "us_per_call": float(np.median(us_per_call)),
+        "us_per_item": float(np.median(us_per_call)) / items,
+        "min_us": float(us_per_call.min()),
+        "max_us": float(us_per_call.max()),
+        "items": items,
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def run(pattern="", repeat=5, min_seconds=0.2):
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if pattern not in name:
+            continue
+        try:
+            function, items = setup()
+        except (ImportError, FileNotFoundError) as e:
+            # Bot and agent benchmarks need rlbot and the bundled models
+            results[name] = {"skipped": f"{type(e).__name__}: {e}"}
+        else:
+            results[name] = time_benchmark(function, items, repeat, min_seconds)
+        print(f"{name:55s} {_format_result(results[name])}", flush=True)
+
+    return {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def _format_result(result):
+    if "skipped" in result:
+        return f"skipped ({result['skipped']})"
+    return f"{result['us_per_call']:10.2f} us/call {result['us_per_item']:10.2f} us/item"
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Returns the names of benchmarks whose time per call grew by more than threshold (0.1 = 10%) over the baseline.
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None or "skipped" in reference or "skipped" in result:
+            print(f"{name:55s} no baseline" if reference is None else f"{name:55s} skipped")
+            continue
+
+        change = result["us_per_call"] / reference["us_per_call"] - 1
+        flag = "REGRESSION" if change > threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:55s} {reference['us_per_call']:10.2f} -> {result['us_per_call']:10.2f} us/call "
+              f"{change:+7.1%} {flag}")
+
+    if baseline["meta"]["platform"] != current["meta"]["platform"]:
+        print(f"Baseline was recorded on {baseline['meta']['platform']}, timings may not be comparable")
+    return regressions
+
+
+def _write_json(path, data):
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, indent=2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run_parser.add_argument("-k", "--pattern", default="", help="only run benchmarks whose name contains this")
+    run_parser.add_argument("-o", "--output", default=RESULTS_PATH)
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--min-seconds", type=float, default=0.2, help="minimum duration of each repeat")
+    run_parser.add_argument("--save-baseline", action="store_true", help=f"also write the results to {BASELINE_PATH}")
+
+    compare_parser = commands.add_parser("compare", help="compare results against the baseline")
+    compare_parser.add_argument("results", nargs="?", default=RESULTS_PATH)
+    compare_parser.add_argument("--baseline", default=BASELINE_PATH)
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown, 0.1 = 10%%")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        results = run(args.pattern, args.repeat, args.min_seconds)
+        _write_json(args.output, results)
+        if args.save_baseline:
+            _write_json(BASELINE_PATH, results)
+        return 0
+
+    baseline = json.loads(pathlib.Path(args.baseline).read_text())
+    current = json.loads(pathlib.Path(args.results).read_text())
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,31 @@
+import os
+
 import numpy as np
 from rlgym.envs import Match
 from rlgym.utils.action_parsers import DiscreteAction
 from rlgym.utils.terminal_conditions.common_conditions import TimeoutCondition, NoTouchTimeoutCondition, GoalScoredCondition
-from rlgym.utils.reward_functions.combined_reward import CombinedReward
 
-from rlgym_tools.sb3_utils import SB3MultipleInstanceEnv
+from rlgym.gym import Gym
+from rlgym_tools.sb3_utils import SB3MultipleInstanceEnv, SB3SingleInstanceEnv
 
 from stable_baselines3 import PPO
 from stable_baselines3.common.vec_env import VecMonitor, VecNormalize, VecCheckNan
-from stable_baselines3.common.callbacks import EvalCallback, CheckpointCallback
 
 from training.rewards import OswaldRewardFunction, PlayerToBallRewardFunction, HitSpeedRewardFunction, AirdribbleRewardFunction, BallToGoalRewardFunction, PlayerVelocityReward
+from training.batched_rewards import BatchedCombinedReward
 from training.state_setter import TrainingStateSetter
+from training.scenarios import ScenarioOutcomeCondition, DEFAULT_WEIGHTS, RECORDED_SCENARIO
 from training.observations import OswaldObservations
+from training.sim_vec_env import SimulatedVecEnv
+from training.trajectory_recorder import TrajectoryRecorder
+from training.checkpoints import CheckpointManager, BackgroundCheckpointCallback, resolve_checkpoint
+from training.evaluation import EvaluationPool, AsyncEvalCallback
+from training.launcher import InstancePool, InstanceStatsCallback, ramp_up, max_instances
+from training.shm_vec_env import SharedMemoryVecEnv
+from training.profiling import ProfilingCallback, instrument_match
+from training.reward_telemetry import RewardComponentsInfo, RewardTelemetryCallback
+from training.opponent_league import OpponentLeague, LeagueVecEnv, LeagueCallback
+from training.rollout_buffer import DiskRolloutBuffer
 
 
 if __name__ == "__main__":
@@ -26,26 +39,69 @@ if __name__ == "__main__":
     STEPS = 1_000_000 ## how many training steps per epoch of training
     agents_per_match = 1 # 1v1 Bot
 
-    # For running multiple instances
-    num_instances = 1
+    # For running multiple instances. None adds instances one at a time while they still speed up training, up to
+    # what the machine's cores and memory allow, see training/launcher.py
+    num_instances = None
+
+    # Train against the NumPy stand-in for Rocket League in training/simulator.py instead of launching the game
+    use_simulator = False
+
+    # Pass observations, rewards and dones from the instances through shared memory instead of pickling them, see
+    # training/shm_vec_env.py
+    shared_memory_transport = True
+
+    # Record every step (observation, action, reward components and game state) under trajectories/, see
+    # training/trajectory_recorder.py. The oldest shards are deleted past max_bytes.
+    record_trajectories = False
+
+    # Time observation building, rewards, env steps and PPO's update and log them under profile/ in tensorboard, see
+    # training/profiling.py. Sampled stacks of the learner are written to logs/<logging_directory_name>.stacks
+    profile = False
+
+    # Play the orange cars with frozen snapshots of past policies instead of the policy being trained, see
+    # training/opponent_league.py. A snapshot of the model joins the league every league_snapshot_freq steps.
+    use_opponent_league = True
+    league_snapshot_freq = 500_000
     batch_size = 100_000
 
+    # Keep the observations and actions of the STEPS-long rollouts in memory-mapped files under rollouts/ instead of
+    # RAM, see training/rollout_buffer.py. Training is unchanged, np.float16 observations halve the files.
+    disk_rollout_buffer = False
+    rollout_obs_dtype = np.float32
+
+    # State library built from the bot's match recordings with python -m training.match_recording states, see
+    # training/match_recording.py. With one, recorded_scenario_weight of the resets (relative to 1 for the other
+    # scenarios together) spawn one of its states
+    state_library = None
+    recorded_scenario_weight = 0.25
+
     model_path = "models5"
 
-    # Exit save directly to the rlbot_configs directory and current models directory
+    # Checkpoints are written in the background into models/<model_path>, keeping the 5 newest, the best evaluated
+    # and every 10th. The "latest" pointer file there names the newest one.
+    checkpoints = CheckpointManager(f"models/{model_path}", keep_last=5, keep_every=10)
+
+    # Exit save into the current models directory, then copy it to the rlbot_configs directory and point its
+    # "latest" pointer at it so the agent loads it
     def exit_save(model):
-        exit_model_path = "rlbot_configs/exit_save"
-        model.save(f"{exit_model_path}")
-        model.save(f"models/{model_path}/exit_save")
-    
-        
+        checkpoints.save(model, name="exit_save")
+        checkpoints.publish("rlbot_configs")
 
     # Instantiate rewards, observations, state setters, and action parser
-    def get_match():
-        return Match(
+    def get_match(state_setter=None):
+        # Spawn scenarios are chosen by weight, adaptive=True moves episodes to the scenarios the agent fails most.
+        # ScenarioOutcomeCondition reports the outcome of every episode back to the state setter's curriculum.
+        if state_setter is None:
+            if state_library is None:
+                state_setter = TrainingStateSetter(adaptive=False)
+            else:
+                state_setter = TrainingStateSetter(
+                    adaptive=False, state_library=state_library,
+                    scenario_weights=dict(DEFAULT_WEIGHTS, **{RECORDED_SCENARIO: recorded_scenario_weight}))
+        match = Match(
             team_size=1,
             tick_skip=frame_skip,
-            reward_function= CombinedReward(
+            reward_function= BatchedCombinedReward(
                 (
                     PlayerToBallRewardFunction(),
                     HitSpeedRewardFunction(reward_weight=5),
@@ -61,15 +117,61 @@ if __name__ == "__main__":
                         boost_pickup_weight=0.1
                         ),
                 ),
-            (1, 1, 1, 1, 0.005, 1)),
+            (1, 1, 1, 1, 0.005, 1),
+            # Reward components of every episode are logged under reward_components/, see training/reward_telemetry.py
+            telemetry_capacity=4096,
+            # TrajectoryRecorder reads the components from the states in the infos
+            components_in_state=record_trajectories),
             spawn_opponents=True,
-            terminal_conditions=[TimeoutCondition(10000), NoTouchTimeoutCondition(2500), GoalScoredCondition()],
-            obs_builder=OswaldObservations(),  
-            state_setter=TrainingStateSetter(),
+            terminal_conditions=[TimeoutCondition(10000), NoTouchTimeoutCondition(2500), GoalScoredCondition(),
+                                 ScenarioOutcomeCondition(state_setter)],
+            obs_builder=OswaldObservations(batched=True),
+            state_setter=state_setter,
             action_parser=DiscreteAction()
         )
-
-    env = SB3MultipleInstanceEnv(get_match, num_instances) # Starts Rocket League instance and waits before opening next one
+        return instrument_match(match) if profile else match
+
+    # Env of an evaluation worker, it runs in the worker's process so the worker can set the scenario of its match
+    def make_eval_env(match):
+        if use_simulator:
+            return SimulatedVecEnv([match])
+        return SB3SingleInstanceEnv(Gym(match, pipe_id=os.getpid(), use_injector=True))
+
+    # One instance of the game (or simulator), crashed instances are relaunched by InstancePool
+    def make_instance():
+        if not shared_memory_transport:
+            if use_simulator:
+                return RewardComponentsInfo(SimulatedVecEnv(get_match, 1))
+            return RewardComponentsInfo(SB3MultipleInstanceEnv(get_match, 1)) # Starts Rocket League instance and waits before opening next one
+
+        # The instance runs in a worker process that writes its observations, rewards and dones to shared memory.
+        # SharedMemoryVecEnv also waits until the instance has started before returning, and raises if it can't.
+        if use_simulator:
+            make_env = lambda: RewardComponentsInfo(SimulatedVecEnv(get_match, 1))
+        else:
+            make_env = lambda: RewardComponentsInfo(
+                SB3SingleInstanceEnv(Gym(get_match(), pipe_id=os.getpid(), use_injector=True)))
+        match = get_match()
+        return SharedMemoryVecEnv([make_env], [match.agents], match.observation_space, match.action_space,
+                                  send_infos=record_trajectories)
+
+    if num_instances is None:
+        limit = max_instances(memory_per_instance=2**28) if use_simulator else max_instances()
+        instances, _ = ramp_up(make_instance, limit)
+    else:
+        instances = InstancePool(make_instance, num_instances)
+    num_instances = len(instances.instances)
+    env = instances
+    if record_trajectories:
+        env = TrajectoryRecorder(env, f"trajectories/{logging_directory_name}", max_bytes=50 * 2**30)
+    if use_opponent_league:
+        league = OpponentLeague(f"models/{model_path}/league", env.observation_space.shape[0])
+        for shipped in ("ball_touch", "speed_flip"):
+            try:
+                league.add_checkpoint(f"rlbot_configs/{shipped}.zip", pinned=True)
+            except ValueError as e:
+                print(f"Not adding {shipped} to the league: {e}")
+        env = LeagueVecEnv(env, league, team_size=agents_per_match)
     env = VecCheckNan(env) # Checks for nans in tensor
     env = VecNormalize(env, norm_obs=False, gamma=gamma)  # Normalize rewards
     env = VecMonitor(env) # Logs mean reward and ep_len to Tensorboard
@@ -91,12 +193,13 @@ if __name__ == "__main__":
         device="cuda" 
     )
     
-    # Model to be loaded. 
-    model_to_load = "rl_model_30045336_steps"
+    # Model to be loaded, the newest checkpoint of models/<model_path> by default
+    model_to_load = f"models/{model_path}"
 
     try:
+        model_to_load = resolve_checkpoint(model_to_load)
         model = PPO.load(
-            f"models/models4/{model_to_load}.zip",
+            model_to_load,
             env,
             device='cuda',
             custom_objects={"n_envs": env.num_envs}
@@ -110,27 +213,38 @@ if __name__ == "__main__":
             net_arch=[dict(pi=[512, 512, 512], vf=[400, 400, 400])],
         )
 
-    # Evaluation callback to periodically check reward
-    eval_callback = EvalCallback(env, best_model_save_path="./best_model/",
-                            log_path="./logs/", eval_freq=max(100_000 // num_instances, 1),
-                            deterministic=True, render=False)
+    if disk_rollout_buffer:
+        model.rollout_buffer = DiskRolloutBuffer.from_model(model, directory="rollouts", obs_dtype=rollout_obs_dtype)
+
+    # Evaluation callback to periodically check reward. Policy snapshots are evaluated by a separate process on its
+    # own env, 10 seeded episodes of every scenario, and written to logs/<logging_directory_name>_eval
+    eval_pool = EvaluationPool(make_eval_env, get_match, f"logs/{logging_directory_name}_eval", n_workers=1,
+                               episodes_per_scenario=10)
+    eval_callback = AsyncEvalCallback(eval_pool, eval_freq=max(100_000 // num_instances, 1))
     
-    # Checkpoint callback to periodically save the model
-    checkpoint_callback = CheckpointCallback(
-    save_freq=100_000,
-    save_path="models/models4/",
-    name_prefix="rl_model",
-    save_replay_buffer=True,
-    save_vecnormalize=False,
-    )
+    # Checkpoint callback to periodically save the model without waiting for the file to be written
+    checkpoint_callback = BackgroundCheckpointCallback(checkpoints, save_freq=100_000, eval_callback=eval_callback)
+
+    callbacks = [eval_callback, checkpoint_callback, InstanceStatsCallback(instances), RewardTelemetryCallback()]
+    if use_opponent_league:
+        # The league needs an opponent before the first reset, and the current model is a sensible one
+        league.add_model(model, f"snapshot_{model.num_timesteps}")
+        callbacks.append(LeagueCallback(league, add_freq=max(league_snapshot_freq // num_instances, 1)))
+    if profile:
+        callbacks.append(ProfilingCallback(stack_path=f"logs/{logging_directory_name}.stacks"))
 
     # Training loop
     try:
         for i in range(1000):
-            model.learn(total_timesteps=10_000_000, reset_num_timesteps=False, tb_log_name=f"{logging_directory_name}", callback=[eval_callback, checkpoint_callback], progress_bar=True)
+            model.learn(total_timesteps=10_000_000, reset_num_timesteps=False, tb_log_name=f"{logging_directory_name}", callback=callbacks, progress_bar=True)
     except:
         print("exiting training")
 
     print("Saving model")
     exit_save(model)
-    print("Save complete")
\ No newline at end of file
+    checkpoints.close()
+    if use_opponent_league:
+        league.save()
+    eval_pool.close()
+    print("Save complete")
+    env.close() # Also writes the last shards of the trajectory recorder
\ No newline at end of file
@@ -0,0 +1,103 @@
+import threading
+import time
+import traceback
+
+
+class ActionPipeline:
+    """
+    Computes actions on a background thread so the RLBot tick thread never waits for inference.
+
+    Requests and results are handed over through single slots: submit() overwrites a request the worker hasn't
+    started yet, and latest() returns the newest finished action without blocking. Each slot is replaced by one
+    attribute assignment, so neither side takes a lock. A request whose compute_action raises is counted as failed and
+    its traceback printed, the worker goes on with the next request and latest() keeps the last good action.
+    """
+
+    def __init__(self, compute_action):
+        # compute_action(packet, ticks_elapsed) runs on the worker thread and returns the action array
+        self.compute_action = compute_action
+
+        self._request = (0, None, 0, 0.)
+        self._request_ready = threading.Event()
+        self._result = (0, None)
+        self._closed = False
+        self.submitted = 0
+        # Submit time of the request compute_action is working on, for measuring latency from within it
+        self.request_time = 0.
+
+        # Per match instrumentation, see reset_stats
+        self.stale_deadlines = 0
+        self.dropped_requests = 0
+        self.completed = 0
+        self.failed = 0
+        self.worst_latency = 0.
+
+        self._thread = threading.Thread(target=self._run, name="action-pipeline", daemon=True)
+        self._thread.start()
+
+    def submit(self, packet, ticks_elapsed):
+        """
+        Hands a copy of the packet to the worker, RLBot reuses the packet object for the next tick.
+        """
+        self.submitted += 1
+        self._request = (self.submitted, type(packet).from_buffer_copy(packet), ticks_elapsed, time.perf_counter())
+        self._request_ready.set()
+
+    def latest(self):
+        """
+        Returns (request number, action) of the newest finished action, the action is None before the first one.
+        """
+        return self._result
+
+    def check_deadline(self):
+        """
+        Called when the action of the latest request is due. Counts a stale deadline if it isn't finished yet.
+        """
+        if self._result[0] < self.submitted:
+            self.stale_deadlines += 1
+
+    def reset_stats(self):
+        self.stale_deadlines = 0
+        self.dropped_requests = 0
+        self.completed = 0
+        self.failed = 0
+        self.worst_latency = 0.
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "stale_deadlines": self.stale_deadlines,
+            "dropped_requests": self.dropped_requests,
+            "worst_latency_ms": self.worst_latency * 1000,
+        }
+
+    def close(self, timeout=1.):
+        self._closed = True
+        self._request_ready.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        last_request = 0
+        while not self._closed:
+            self._request_ready.wait()
+            self._request_ready.clear()
+
+            # Only the tick thread writes the slot, so a request that arrives after clear() sets the event again
+            request_number, packet, ticks_elapsed, submit_time = self._request
+            if request_number == last_request:
+                continue
+            self.dropped_requests += request_number - last_request - 1
+            last_request = request_number
+
+            self.request_time = submit_time
+            try:
+                action = self.compute_action(packet, ticks_elapsed)
+            except Exception:
+                self.failed += 1
+                traceback.print_exc()
+                continue
+            self._result = (request_number, action)
+            self.completed += 1
+            self.worst_latency = max(self.worst_latency, time.perf_counter() - submit_time)
@@ -1,10 +1,18 @@
-from stable_baselines3 import PPO
 import pathlib
 from rlgym.utils.action_parsers.discrete_act import DiscreteAction
+from training.numpy_policy import NumpyPolicy
+from training.weight_cache import load_cached_policy
+
+
+def resolve_model(directory, pointer="latest"):
+    # Pointer file written by training/checkpoints.py, its only line is the model's file name. Read here so the
+    # NumPy policy doesn't need torch imported.
+    with open(directory / pointer) as f:
+        return directory / f.read().strip()
 
 
 class Agent:
-    def __init__(self):
+    def __init__(self, use_numpy_policy=True, model_to_load=None):
         _path = pathlib.Path(__file__).parent.resolve()
         custom_objects = {
             "lr_schedule": 0.00005,
@@ -13,11 +21,31 @@ class Agent:
             "device": "cuda"
         }
 
-        model_to_load = '[insert_model]'
-        
-        self.actor = PPO.load(str(_path) + '/' + model_to_load + '.zip', device='cuda', custom_objects=custom_objects)
+        # Name of the model without .zip, by default the one the "latest" pointer in this directory names
+        if model_to_load is None:
+            model_path = resolve_model(_path)
+        else:
+            model_path = _path / (model_to_load + '.zip')
+
+        if use_numpy_policy:
+            # Runs on the CPU without torch. The weights are exported once per checkpoint into weight_cache/ and
+            # memory-mapped from there, so every bot of a match shares them. Without the .zip, the policy exported
+            # with python -m training.export_policy is loaded instead.
+            if model_path.exists():
+                self.actor = load_cached_policy(model_path, _path / "weight_cache")
+            else:
+                self.actor = NumpyPolicy(str(model_path.with_suffix('.npz')))
+        else:
+            from stable_baselines3 import PPO
+            self.actor = PPO.load(str(model_path), device='cuda', custom_objects=custom_objects)
         self.parser = DiscreteAction()
 
+    @property
+    def observation_size(self):
+        if hasattr(self.actor, "observation_size"):
+            return self.actor.observation_size
+        return self.actor.observation_space.shape[0]
+
 
     def act(self, state):
         action = self.actor.predict(state, deterministic=True)
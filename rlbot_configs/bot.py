@@ -1,44 +1,186 @@
-from rlbot.agents.base_agent import BaseAgent, SimpleControllerState
+from rlbot.agents.base_agent import BaseAgent, SimpleControllerState, BOT_CONFIG_AGENT_HEADER
+from rlbot.parsing.custom_config import ConfigHeader, ConfigObject
 from rlbot.utils.structures.game_data_struct import GameTickPacket
 
+import pathlib
+import time
 import numpy as np
 from agent import Agent
-from training.observations import OswaldObservations
+from action_pipeline import ActionPipeline
+from packet_decoder import PacketDecoder, state_dtype
+from training.match_recording import MatchRecorder
+from training.observations import OswaldObservations, fixed_slot_team_size
 from rlgym_compat import GameState
 
 class RLGymExampleBot(BaseAgent):
     def __init__(self, name, team, index):
         super().__init__(name, team, index)
 
-        self.obs_builder = OswaldObservations()
         self.agent = Agent()
+        # Models trained with OswaldObservations(max_team_size=...) see up to max_team_size - 1 allies and
+        # max_team_size enemies, others were trained in 1v1 and only see the opponent closest to the ball
+        self.max_team_size = fixed_slot_team_size(self.agent.observation_size)
+        self.obs_builder = OswaldObservations(preallocate=True, max_team_size=self.max_team_size)
         self.tick_skip = 8
-        self.game_state: GameState = None
+        # Decode packets straight into NumPy arrays and build the observation from them (packet_decoder.py) instead
+        # of rlgym_compat's GameState and the obs builder, same observation for less CPU time per tick
+        self.use_packet_decoder = True
+        self.game_state = None
         self.controls = None
         self.action = None
         self.ticks = 0
         self.prev_time = 0
         self.observed = False
         self.acted = False
-        self.expected_teammates = 0
-        self.expected_opponents = 1
+        if self.max_team_size is None:
+            self.expected_teammates = 0
+            self.expected_opponents = 1
+        else:
+            self.expected_teammates = self.max_team_size - 1
+            self.expected_opponents = self.max_team_size
         self.current_obs = None
+        # Teams of the packet's cars and the allies and opponents that split them into, see select_cars
+        self.car_partition = (None, None, None)
+
+        # Build observations and run the policy on a background thread, get_output then returns the latest controls
+        # without waiting on inference. Set with pipelined in the [Bot Parameters] of bot.cfg, see load_config
+        self.pipelined = False
+        self.pipeline: ActionPipeline = None
+        self.pipeline_game_state = None
+        self.pipeline_action = None
+        self.applied_request = 0
+        self.match_ended = False
+
+        # Record every decision tick (game time, action latency, decoded state of the first recorded_cars cars,
+        # observation and action) into recordings/, see training/match_recording.py. Needs the packet decoder. Set
+        # with record_matches in the [Bot Parameters] of bot.cfg, see load_config
+        self.record_matches = False
+        self.recording_directory = pathlib.Path(__file__).parent / "recordings"
+        self.recorded_cars = 8
+        self.recorder: MatchRecorder = None
+        self.observed_time = 0.
         print(f'{self.name} Ready - Index:', index)
 
 
+    @staticmethod
+    def create_agent_configurations(config: ConfigObject):
+        params = config.get_header(BOT_CONFIG_AGENT_HEADER)
+        params.add_value("pipelined", bool, default=False,
+                         description="Compute actions on a background thread, see action_pipeline.py")
+        params.add_value("record_matches", bool, default=False,
+                         description="Record every decision tick into recordings/, see training/match_recording.py")
+
+    def load_config(self, config_header: ConfigHeader):
+        # Called by RLBot after the constructor and before initialize_agent
+        self.pipelined = config_header.getboolean("pipelined")
+        self.record_matches = config_header.getboolean("record_matches")
+
     def initialize_agent(self):
         # Initialize the rlgym GameState object now that the game is active and the info is available
-        self.game_state = GameState(self.get_field_info())
+        self.game_state = self.make_game_state()
         self.ticks = self.tick_skip  # So we take an action the first tick
         self.prev_time = 0
         self.controls = SimpleControllerState()
         self.action = np.zeros(8)
         self.tick_multi = 120
 
+        if self.pipelined:
+            # The worker decodes into its own GameState, the tick thread never touches it
+            self.pipeline_game_state = self.make_game_state()
+            self.pipeline_action = np.zeros(8)
+            self.applied_request = 0
+            self.pipeline = ActionPipeline(self.compute_action)
+
+        if self.record_matches:
+            self.recorder = self.make_recorder()
+
+    def make_game_state(self):
+        field_info = self.get_field_info()
+        if self.use_packet_decoder:
+            return PacketDecoder(field_info.num_boosts, self.max_team_size)
+        return GameState(field_info)
+
+    def make_recorder(self):
+        if not self.use_packet_decoder:
+            raise ValueError("Recording matches needs use_packet_decoder")
+        self.recording_directory.mkdir(parents=True, exist_ok=True)
+        path = self.recording_directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{self.index}.rec"
+        metadata = {"name": self.name, "team": self.team, "index": self.index, "tick_skip": self.tick_skip,
+                    "pipelined": self.pipelined}
+        return MatchRecorder(path, state_dtype(self.game_state.num_boosts, self.recorded_cars, np.float32),
+                             self.agent.observation_size, metadata=metadata)
+
+    def record_tick(self, decoder, obs, action, observed_time):
+        self.recorder.record((decoder.time, time.perf_counter() - observed_time, decoder.round_active,
+                              decoder.n_cars, decoder.blue_score, decoder.orange_score),
+                             decoder.state_values, obs, action)
+
+    def retire(self):
+        if self.pipeline is not None:
+            self.report_pipeline_stats()
+            self.pipeline.close()
+        if self.recorder is not None:
+            self.recorder.close()
+            print(f'{self.name} recorded {self.recorder.recorded} ticks ({self.recorder.dropped} dropped) to',
+                  self.recorder.path)
+
+    def report_pipeline_stats(self):
+        print(f'{self.name} action pipeline:', self.pipeline.stats())
+        self.pipeline.reset_stats()
 
     def reshape_state(self, gamestate, player, opponents, allies):
-        closest_op = min(opponents, key=lambda p: np.linalg.norm(self.game_state.ball.position - p.car_data.position))
-        self.game_state.players = [player, closest_op]
+        # Keeps the allies and opponents closest to the ball that the observation has room for
+        def closest(players, n):
+            return sorted(players, key=lambda p: np.linalg.norm(gamestate.ball.position - p.car_data.position))[:n]
+        gamestate.players = [player] + closest(allies, self.expected_teammates) + \
+            closest(opponents, self.expected_opponents)
+
+    def observation_fits(self, n_opponents, n_allies):
+        if self.max_team_size is None:
+            return n_opponents == self.expected_opponents and n_allies == self.expected_teammates
+        # Empty slots are padded
+        return n_opponents <= self.expected_opponents and n_allies <= self.expected_teammates
+
+    def select_cars(self, decoder):
+        # reshape_state on the decoder's arrays, returns the indices of the allies and opponents to observe
+        teams = decoder.teams[:decoder.n_cars]
+        key, allies, opponents = self.car_partition
+        if key != teams.tobytes():
+            cars = np.arange(decoder.n_cars)
+            opponents = cars[teams != self.team]
+            allies = cars[(teams == self.team) & (cars != self.index)]
+            self.car_partition = (teams.tobytes(), allies, opponents)
+        if not self.observation_fits(len(opponents), len(allies)):
+            def closest(indices, n):
+                if n == 0 or len(indices) <= 1:
+                    return indices[:n]
+                return indices[np.argsort(decoder.distances_to_ball(indices), kind="stable")[:n]]
+            allies, opponents = closest(allies, self.expected_teammates), closest(opponents, self.expected_opponents)
+        return allies, opponents
+
+    def build_obs(self, game_state, packet, ticks_elapsed, previous_action):
+        game_state.decode(packet, ticks_elapsed)
+
+        if self.use_packet_decoder:
+            allies, opponents = self.select_cars(game_state)
+            return game_state.build_obs(self.index, allies, opponents, previous_action)
+
+        player = game_state.players[self.index]
+        opponents = [p for p in game_state.players if p.team_num != self.team]
+        allies = [p for p in game_state.players if p.team_num == self.team and p.car_id != self.index]
+
+        if not self.observation_fits(len(opponents), len(allies)):
+            self.reshape_state(game_state, player, opponents, allies)
+
+        return self.obs_builder.build_obs(player, game_state, previous_action)
+
+    def compute_action(self, packet, ticks_elapsed):
+        # Runs on the pipeline's worker thread
+        obs = self.build_obs(self.pipeline_game_state, packet, ticks_elapsed, self.pipeline_action)
+        self.pipeline_action = self.agent.act(obs)
+        if self.recorder is not None:
+            self.record_tick(self.pipeline_game_state, obs, self.pipeline_action, self.pipeline.request_time)
+        return self.pipeline_action
 
     def get_output(self, packet: GameTickPacket) -> SimpleControllerState:
         cur_time = packet.game_info.seconds_elapsed
@@ -47,17 +189,17 @@ class RLGymExampleBot(BaseAgent):
         ticks_elapsed = self.ticks * self.tick_multi
         self.ticks += delta
 
-        if not self.observed:
-            self.game_state.decode(packet, ticks_elapsed)
-                
-            player = self.game_state.players[self.index]
-            opponents = [p for p in self.game_state.players if p.team_num != self.team]
-            allies = [p for p in self.game_state.players if p.team_num == self.team and p.car_id != self.index]
+        match_ended = packet.game_info.is_match_ended
+        if match_ended and not self.match_ended:
+            self.end_match()
+        self.match_ended = match_ended
 
-            if len(opponents) != self.expected_opponents or len(allies) != self.expected_teammates:
-                self.reshape_state(self.game_state, player, opponents, allies)
+        if self.pipeline is not None:
+            self.pipelined_step(packet, ticks_elapsed)
 
-            self.current_obs = self.obs_builder.build_obs(player, self.game_state, self.action)
+        elif not self.observed:
+            self.observed_time = time.perf_counter()
+            self.current_obs = self.build_obs(self.game_state, packet, ticks_elapsed, self.action)
             self.observed = True
 
         elif ticks_elapsed >= self.tick_skip-2:
@@ -65,14 +207,37 @@ class RLGymExampleBot(BaseAgent):
                 self.action = self.agent.act(self.current_obs)
                 self.update_controls(self.action)
                 self.acted = True
+                if self.recorder is not None:
+                    self.record_tick(self.game_state, self.current_obs, self.action, self.observed_time)
 
         if ticks_elapsed >= self.tick_skip-1:
+            if self.pipeline is not None:
+                # The action requested at the start of this cycle is due now
+                self.pipeline.check_deadline()
             self.ticks = 0
             self.observed = False
             self.acted = False
 
         return self.controls
 
+    def end_match(self):
+        if self.pipeline is not None:
+            self.report_pipeline_stats()
+        if self.recorder is not None and self.pipeline is None:
+            # In pipelined mode the worker records ticks, the recording is only flushed when the bot retires
+            self.recorder.flush()
+
+    def pipelined_step(self, packet, ticks_elapsed):
+        if not self.observed:
+            self.pipeline.submit(packet, ticks_elapsed)
+            self.observed = True
+
+        request, action = self.pipeline.latest()
+        if request > self.applied_request:
+            self.action = action
+            self.update_controls(action)
+            self.applied_request = request
+
 
     def update_controls(self, action):
         self.controls.throttle = action[0]
@@ -0,0 +1,250 @@
+import ctypes
+import math
+
+import numpy as np
+from rlbot.utils.structures.game_data_struct import GameTickPacket, PlayerInfo, BoostPadState, TeamInfo, Physics
+from rlgym.utils import common_values
+
+from training.observations import OswaldObservations, fixed_slot_indices, fixed_slot_size
+
+# Orange players see the field mirrored through the x and y axes, and rotated by pi around the z axis
+INVERT = np.array([-1., -1., 1.])
+INVERT_PYR = np.array([0., math.pi, 0.])
+
+
+def _offset(structure, *fields):
+    offset = 0
+    # Offset of a nested field, e.g. _offset(GameTickPacket, "game_ball", "physics")
+    for field in fields:
+        offset += getattr(structure, field).offset
+        structure = dict((name, kind) for name, kind, *_ in structure._fields_)[field]
+    return offset
+
+
+# Physics is 12 floats: location, rotation (pitch, yaw, roll), velocity and angular velocity
+PHYSICS_DTYPE = np.dtype(("<f4", (4, 3)))
+assert ctypes.sizeof(Physics) == PHYSICS_DTYPE.itemsize
+
+# The fields of the packet the bot reads, at their offsets in RLBot's ctypes structures, so a packet can be copied
+# into one of these records with a single memmove
+CAR_DTYPE = np.dtype({
+    "names": ["physics", "is_demolished", "has_wheel_contact", "jumped", "double_jumped", "team", "boost"],
+    "formats": [PHYSICS_DTYPE, "?", "?", "?", "?", "<i4", "<i4"],
+    "offsets": [_offset(PlayerInfo, name) for name in
+                ("physics", "is_demolished", "has_wheel_contact", "jumped", "double_jumped", "team", "boost")],
+    "itemsize": ctypes.sizeof(PlayerInfo),
+})
+BOOST_DTYPE = np.dtype({"names": ["is_active"], "formats": ["?"], "offsets": [_offset(BoostPadState, "is_active")],
+                        "itemsize": ctypes.sizeof(BoostPadState)})
+TEAM_DTYPE = np.dtype({"names": ["score"], "formats": ["<i4"], "offsets": [_offset(TeamInfo, "score")],
+                       "itemsize": ctypes.sizeof(TeamInfo)})
+PACKET_DTYPE = np.dtype({
+    "names": ["game_cars", "num_cars", "game_boosts", "num_boost", "ball_physics", "teams", "seconds_elapsed",
+              "is_round_active"],
+    "formats": [(CAR_DTYPE, len(GameTickPacket().game_cars)), "<i4", (BOOST_DTYPE, len(GameTickPacket().game_boosts)),
+                "<i4", PHYSICS_DTYPE, (TEAM_DTYPE, len(GameTickPacket().teams)), "<f4", "?"],
+    "offsets": [_offset(GameTickPacket, "game_cars"), _offset(GameTickPacket, "num_cars"),
+                _offset(GameTickPacket, "game_boosts"), _offset(GameTickPacket, "num_boost"),
+                _offset(GameTickPacket, "game_ball", "physics"), _offset(GameTickPacket, "teams"),
+                _offset(GameTickPacket, "game_info", "seconds_elapsed"),
+                _offset(GameTickPacket, "game_info", "is_round_active")],
+    "itemsize": ctypes.sizeof(GameTickPacket),
+})
+
+
+def state_dtype(num_boosts, n_cars, dtype=np.float64):
+    """
+    Layout of PacketDecoder.state, every field a dtype value so the whole state is also a flat array of them. The
+    state of the first n cars is a prefix of the state of more cars, which is what match recordings store.
+    """
+    car_dtype = np.dtype([("physics", dtype, (4, 3)), ("flags", dtype, 4), ("team", dtype)])
+    return np.dtype([("ball", dtype, (3, 3)), ("boost_pads", dtype, num_boosts), ("cars", car_dtype, n_cars)])
+
+
+# Values an observation is computed from, see PacketDecoder._get_obs_map: zero, one, the ball (position, linear
+# velocity, angular velocity), the backs of the attacked and defended goals, the previous action, the boost pads,
+# then per car the values of its block of the observation that don't depend on the ball: position, forward, up,
+# linear velocity, angular velocity and flags
+ONE = 1
+BALL_START = 2
+GOALS_START = BALL_START + 9
+ACTIONS_START = GOALS_START + 6
+CAR_VALUES = 19
+
+
+class PacketDecoder:
+    """
+    Decodes GameTickPackets into NumPy arrays and builds OswaldObservations' observation of one car from them,
+    replacing rlgym_compat's GameState.decode followed by build_obs. No PlayerData or PhysicsObject is created: the
+    packet is copied into a structured array in one memmove, the orange point of view is the same arrays with sign
+    flips, and every value of the observation is a difference of two gathered values, with index maps computed once
+    per number of allies and enemies.
+
+    The observation is identical to build_obs with preallocate=True on the decoded GameState, including the
+    orientation of inverted cars (rlgym_compat adds pi to the yaw) and the on_ground grace period of 6 ticks.
+    """
+
+    def __init__(self, num_boosts=34, max_team_size=None):
+        self.num_boosts = num_boosts
+        self.max_team_size = max_team_size
+        self.packet = np.zeros((), dtype=PACKET_DTYPE)
+        max_cars = PACKET_DTYPE["game_cars"].shape[0]
+
+        # Views of the packet's fields, taken once since every packet is copied into the same record
+        self._address = self.packet.ctypes.data
+        cars = self.packet["game_cars"]
+        self._num_cars = self.packet["num_cars"]
+        self._num_boost = self.packet["num_boost"]
+        self._scores = self.packet["teams"]["score"]
+        self._boosts_active = self.packet["game_boosts"]["is_active"]
+        self._ball_physics = self.packet["ball_physics"]
+        self._car_physics = cars["physics"]
+        self._car_teams = cars["team"]
+        self._car_boost = cars["boost"]
+        self._wheel_contact = cars["has_wheel_contact"]
+        self._double_jumped = cars["double_jumped"]
+        self._demolished = cars["is_demolished"]
+
+        # Decoded game, cars indexed like packet.game_cars. The arrays are views of one record, state, which
+        # state_values (or its prefix for fewer cars) copies in one go
+        self.n_cars = 0
+        self.blue_score = 0
+        self.orange_score = 0
+        self.state = np.zeros((), dtype=state_dtype(num_boosts, max_cars))
+        self.state_values = self.state.reshape(1).view(np.float64)
+        self.ball = self.state["ball"]  # position, linear velocity, angular velocity
+        self.physics = self.state["cars"]["physics"]  # position, pitch yaw roll, linear velocity, angular velocity
+        self.teams = self.state["cars"]["team"]
+        self.flags = self.state["cars"]["flags"]  # boost amount, on ground, has flip, is demoed
+        self.boost_pads = self.state["boost_pads"]
+        self._on_ground_ticks = np.zeros(max_cars)
+
+        self._obs_maps = {}
+
+    def decode(self, packet: GameTickPacket, ticks_elapsed=1):
+        ctypes.memmove(self._address, ctypes.addressof(packet), PACKET_DTYPE.itemsize)
+        n = self.n_cars = int(self._num_cars)
+        self.blue_score, self.orange_score = int(self._scores[0]), int(self._scores[1])
+
+        n_boosts = min(int(self._num_boost), self.num_boosts)
+        self.boost_pads[:n_boosts] = self._boosts_active[:n_boosts]
+
+        # Location, velocity and angular velocity, the ball's rotation isn't observed
+        self.ball[0] = self._ball_physics[0]
+        self.ball[1:] = self._ball_physics[2:]
+
+        self.physics[:n] = self._car_physics[:n]
+        self.teams[:n] = self._car_teams[:n]
+
+        # Same as rlgym_compat: a car counts as on the ground for 6 ticks after it lost wheel contact
+        contact = self._wheel_contact[:n]
+        on_ground_ticks = self._on_ground_ticks[:n]
+        on_ground_ticks += ticks_elapsed
+        on_ground_ticks[contact] = 0
+        flags = self.flags[:n]
+        np.divide(self._car_boost[:n], 100, out=flags[:, 0])
+        flags[:, 1] = contact | (on_ground_ticks <= 6)
+        flags[:, 2] = ~self._double_jumped[:n]
+        flags[:, 3] = self._demolished[:n]
+
+    @property
+    def time(self):
+        # Game time of the last decoded packet, only read by match recordings so decode doesn't convert it
+        return float(self.packet["seconds_elapsed"])
+
+    @property
+    def round_active(self):
+        return bool(self.packet["is_round_active"])
+
+    def distances_to_ball(self, cars):
+        return np.sqrt(((self.physics[cars, 0] - self.ball[0]) ** 2).sum(axis=1))
+
+    def _get_obs_map(self, n_actions, n_allies, n_enemies):
+        """
+        (plus, minus, scale, values, out): the observation is (values[plus] - values[minus]) / scale, build_obs fills
+        in values and casts the result into out. Empty slots and presence values of fixed-slot observations are part
+        of the map.
+        """
+        key = (n_actions, n_allies, n_enemies)
+        obs_map = self._obs_maps.get(key)
+        if obs_map is not None:
+            return obs_map
+
+        n_cars = 1 + n_allies + n_enemies
+        cars_start = ACTIONS_START + n_actions + self.num_boosts
+        values = np.zeros(cars_start + n_cars * CAR_VALUES)
+        values[ONE] = 1
+        values[GOALS_START:GOALS_START + 3] = common_values.ORANGE_GOAL_BACK
+        values[GOALS_START + 3:GOALS_START + 6] = common_values.BLUE_GOAL_BACK
+
+        def vector(start):
+            return list(range(start, start + 3))
+
+        # Variable layout, in the order of OswaldObservations
+        plus = list(range(BALL_START, BALL_START + 9)) + list(range(ACTIONS_START, cars_start))
+        minus = [0] * len(plus)
+        scale = list(OswaldObservations.BALL_SCALE) + [1] * (n_actions + self.num_boosts)
+        for car in range(n_cars):
+            car_start = cars_start + car * CAR_VALUES
+            position, linear_velocity = vector(car_start), vector(car_start + 9)
+            plus += vector(BALL_START) + vector(BALL_START + 3) + vector(GOALS_START) + vector(GOALS_START + 3) + \
+                list(range(car_start, car_start + CAR_VALUES))
+            minus += position + linear_velocity + position + position + [0] * CAR_VALUES
+            scale += list(OswaldObservations.CAR_SCALE)
+            if car > 0:
+                # Relative to the player
+                plus += position + linear_velocity
+                minus += vector(cars_start) + vector(cars_start + 9)
+                scale += [OswaldObservations.POS_STD] * 6
+        plus, minus, scale = np.array(plus), np.array(minus), np.array(scale, dtype=np.float64)
+
+        if self.max_team_size is not None:
+            size = fixed_slot_size(self.max_team_size, self.num_boosts, n_actions)
+            indices = fixed_slot_indices(self.max_team_size, self.num_boosts, n_allies, n_enemies, n_actions)
+            fixed_plus, fixed_minus, fixed_scale = np.zeros(size, dtype=int), np.zeros(size, dtype=int), np.ones(size)
+            fixed_plus[indices], fixed_minus[indices], fixed_scale[indices] = plus, minus, scale
+            masks_start = size - (2 * self.max_team_size - 1)
+            enemy_masks_start = masks_start + self.max_team_size - 1
+            fixed_plus[masks_start:masks_start + n_allies] = ONE
+            fixed_plus[enemy_masks_start:enemy_masks_start + n_enemies] = ONE
+            plus, minus, scale = fixed_plus, fixed_minus, fixed_scale
+
+        obs_map = self._obs_maps[key] = (plus, minus, scale, values, np.empty(len(plus), dtype=np.float32))
+        return obs_map
+
+    def build_obs(self, index: int, allies, enemies, previous_action: np.ndarray) -> np.ndarray:
+        """
+        Observation of car index with the cars allies and enemies (indices into packet.game_cars, in that order), as
+        OswaldObservations builds it for a state whose players are those cars. The returned array is reused by the
+        next call with the same numbers of allies and enemies.
+        """
+        n_actions = len(previous_action)
+        plus, minus, scale, values, out = self._get_obs_map(n_actions, len(allies), len(enemies))
+        cars = np.concatenate(([index], allies, enemies)).astype(np.int64)
+        orange = self.teams[index] == common_values.ORANGE_TEAM
+        sign = INVERT if orange else 1.
+
+        values[BALL_START:GOALS_START] = (self.ball * sign).ravel()
+        values[ACTIONS_START:ACTIONS_START + n_actions] = previous_action
+        cars_start = ACTIONS_START + n_actions + self.num_boosts
+        values[ACTIONS_START + n_actions:cars_start] = self.boost_pads[::-1] if orange else self.boost_pads
+
+        physics = self.physics[cars]
+        car_values = values[cars_start:].reshape(len(cars), CAR_VALUES)
+        car_values[:, 0:3] = physics[:, 0] * sign
+        car_values[:, 9:15] = (physics[:, 2:4] * sign).reshape(len(cars), 6)
+        car_values[:, 15:19] = self.flags[cars]
+
+        # rlgym_compat's PhysicsObject._euler_to_rotation, forward and up columns
+        euler = physics[:, 1] + INVERT_PYR if orange else physics[:, 1]
+        cp, cy, cr = np.cos(euler).T
+        sp, sy, sr = np.sin(euler).T
+        car_values[:, 3] = cp * cy
+        car_values[:, 4] = cp * sy
+        car_values[:, 5] = sp
+        car_values[:, 6] = -cr * cy * sp - sr * sy
+        car_values[:, 7] = -cr * sy * sp + sr * cy
+        car_values[:, 8] = cp * cr
+
+        np.copyto(out, (values[plus] - values[minus]) / scale, casting="same_kind")
+        return out
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from rlgym.utils.common_values import ORANGE_GOAL_BACK
+from rlgym.utils.reward_functions import CombinedReward
+
+from benchmarks.fixtures import make_state
+from benchmarks.suite import make_rewards
+from training.batched_rewards import BatchedCombinedReward
+
+
+def make_episode(seed, team_size, steps=6):
+    rng = np.random.default_rng(seed)
+    states = [make_state(rng, team_size) for _ in range(steps)]
+    # A car standing still makes PlayerToBallRewardFunction NaN
+    states[1].players[0].car_data.linear_velocity[:] = 0
+    # The ball next to the orange goal and moving into it, for BallToGoalRewardFunction
+    states[2].ball.position[:] = np.array(ORANGE_GOAL_BACK) - (0, 5, 0)
+    states[2].ball.linear_velocity[:] = (0, 1000, 0)
+    # Goals, touches and boost keep changing between the states, for the stateful reward functions
+    return states
+
+
+@pytest.mark.parametrize("team_size", [1, 2, 3])
+def test_rewards_match_combined_reward(team_size):
+    for seed in range(10):
+        states = make_episode(seed, team_size)
+        reference, batched = CombinedReward(*make_rewards()), BatchedCombinedReward(*make_rewards())
+        reference.reset(states[0])
+        batched.reset(states[0])
+
+        for state in states:
+            reference.pre_step(state)
+            batched.pre_step(state)
+            expected = [reference.get_reward(player, state, np.zeros(8)) for player in state.players]
+            rewards = [batched.get_reward(player, state, np.zeros(8)) for player in state.players]
+            np.testing.assert_allclose(rewards, expected, rtol=1e-9, atol=1e-9)
+
+
+def test_states_are_left_untouched_by_default():
+    state = make_state(np.random.default_rng(0))
+    reward = BatchedCombinedReward(*make_rewards())
+    reward.reset(state)
+    reward.get_final_reward(state.players[0], state, np.zeros(8))
+    assert not hasattr(state, "reward_components") and not hasattr(state, "reward_episode")
+
+    reward = BatchedCombinedReward(*make_rewards(), telemetry_capacity=16, components_in_state=True)
+    reward.reset(state)
+    reward.get_final_reward(state.players[0], state, np.zeros(8))
+    assert state.reward_components.shape == (2, len(reward.reward_functions))
+    assert state.reward_episode is not None
@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+from torch.utils.tensorboard import SummaryWriter
+
+from training.log_index import INDEX_FILE, LogIndex, main
+
+
+def write_scalars(directory, steps):
+    writer = SummaryWriter(str(directory))
+    for step in steps:
+        writer.add_scalar("rollout/ep_rew_mean", step / 10, step)
+    writer.close()
+
+
+def test_unfinished_update_is_read_again(tmp_path):
+    write_scalars(tmp_path / "PPO_1", range(5))
+    index = LogIndex(tmp_path)
+    assert index.update() == 5
+
+    # An update that appended to the tag file but died before writing index.json
+    write_scalars(tmp_path / "PPO_1", range(5, 8))
+    name = LogIndex(tmp_path).index["runs"]["PPO_1"]["tags"]["rollout/ep_rew_mean"]
+    with open(tmp_path / ".index" / "PPO_1" / name, "ab") as f:
+        f.write(b"\0" * 30)
+
+    index = LogIndex(tmp_path)
+    assert len(index.scalars("PPO_1", "rollout/ep_rew_mean")) == 5
+    assert index.update() == 3
+    steps, values = index.series("PPO_1", "rollout/ep_rew_mean")
+    assert steps.tolist() == list(range(8))
+    np.testing.assert_allclose(values, np.arange(8) / 10, rtol=1e-6)
+
+
+def test_tags_of_empty_tag(tmp_path, capsys):
+    write_scalars(tmp_path / "PPO_1", range(3))
+    LogIndex(tmp_path).update()
+    index_path = tmp_path / ".index" / INDEX_FILE
+    with open(index_path) as f:
+        index = json.load(f)
+    index["runs"]["PPO_1"]["sizes"]["rollout/ep_rew_mean"] = 0
+    with open(index_path, "w") as f:
+        json.dump(index, f)
+
+    main(["--logs", str(tmp_path), "--no-update", "tags", "PPO_1"])
+    assert "rollout/ep_rew_mean" in capsys.readouterr().out
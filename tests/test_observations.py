@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from benchmarks.fixtures import make_state
+from training.observations import OswaldObservations, variable_layout
+
+
+def reference_obs(state, previous_actions):
+    builder = OswaldObservations()
+    return np.array([builder.build_obs(player, state, previous_actions[i]) for i, player in enumerate(state.players)])
+
+
+@pytest.mark.parametrize("team_size,spawn_opponents", [(1, True), (2, True), (3, True), (3, False)])
+def test_batch_matches_build_obs(team_size, spawn_opponents):
+    rng = np.random.default_rng(team_size)
+    builder = OswaldObservations(batched=True)
+    builder.reset(make_state(rng, team_size, spawn_opponents))
+    for _ in range(5):
+        state = make_state(rng, team_size, spawn_opponents)
+        previous_actions = rng.uniform(-1, 1, (len(state.players), 8))
+        expected = reference_obs(state, previous_actions)
+        np.testing.assert_allclose(builder.build_obs_batch(state, previous_actions), expected, rtol=0, atol=1e-12)
+
+        builder.pre_step(state)
+        rows = [builder.build_obs(player, state, previous_actions[i]) for i, player in enumerate(state.players)]
+        np.testing.assert_allclose(rows, expected, rtol=0, atol=1e-12)
+
+
+def test_batch_matches_build_obs_with_uneven_teams():
+    state = make_state(np.random.default_rng(0), 2)
+    state.players.pop()
+    previous_actions = np.zeros((len(state.players), 8))
+    np.testing.assert_allclose(OswaldObservations(batched=True).build_obs_batch(state, previous_actions),
+                               reference_obs(state, previous_actions), rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("mode", [{}, {"preallocate": True}, {"batched": True}])
+def test_fixed_slots_hold_build_obs(mode):
+    rng = np.random.default_rng(1)
+    for team_size in (1, 2, 3):
+        state = make_state(rng, team_size)
+        previous_actions = rng.normal(size=(len(state.players), 8))
+        expected = reference_obs(state, previous_actions)
+        builder = OswaldObservations(max_team_size=3, **mode)
+        builder.reset(state)
+        builder.pre_step(state)
+
+        for i, player in enumerate(state.players):
+            obs = builder.build_obs(player, state, previous_actions[i])
+            assert obs.shape == (272,)
+            np.testing.assert_allclose(variable_layout(obs, 3, team_size - 1, team_size), expected[i], atol=1e-6)
+            # Presence flags of the ally and enemy slots
+            assert obs[-5:].tolist() == [1] * (team_size - 1) + [0] * (3 - team_size) + [1] * team_size + \
+                [0] * (3 - team_size)
+
+
+def test_preallocated_obs_match_build_obs():
+    rng = np.random.default_rng(2)
+    builder = OswaldObservations(preallocate=True)
+    for team_size in (1, 2, 3):
+        state = make_state(rng, team_size)
+        previous_actions = rng.normal(size=(len(state.players), 8))
+        expected = reference_obs(state, previous_actions)
+        builder.reset(state)
+        for i, player in enumerate(state.players):
+            np.testing.assert_allclose(builder.build_obs(player, state, previous_actions[i]), expected[i], atol=1e-12)
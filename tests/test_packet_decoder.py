@@ -0,0 +1,38 @@
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("rlbot")
+compat = pytest.importorskip("rlgym_compat")
+
+from benchmarks.fixtures import make_field_info, make_packet
+from benchmarks.suite import RLBOT_DIRECTORY
+from training.observations import OswaldObservations
+
+if str(RLBOT_DIRECTORY) not in sys.path:
+    sys.path.append(str(RLBOT_DIRECTORY))
+from packet_decoder import PacketDecoder
+
+
+@pytest.mark.parametrize("team_size,max_team_size", [(1, None), (1, 3), (2, 3), (3, 3)])
+def test_obs_match_rlgym_compat(team_size, max_team_size):
+    rng = np.random.default_rng(team_size)
+    state = compat.GameState(make_field_info())
+    decoder = PacketDecoder(34, max_team_size)
+    builder = OswaldObservations(preallocate=True, max_team_size=max_team_size)
+
+    for tick in range(100):
+        packet = make_packet(rng, team_size, tick / 120)
+        # Changing tick counts exercise the on_ground grace period
+        ticks_elapsed = int(rng.integers(1, 10))
+        state.decode(packet, ticks_elapsed)
+        decoder.decode(packet, ticks_elapsed)
+        previous_action = rng.integers(-1, 2, 8).astype(float)
+        assert len(state.players) == 2 * team_size
+
+        for index, player in enumerate(state.players):
+            allies = [i for i, other in enumerate(state.players) if other.team_num == player.team_num and i != index]
+            enemies = [i for i, other in enumerate(state.players) if other.team_num != player.team_num]
+            expected = builder.build_obs(player, state, previous_action)
+            np.testing.assert_array_equal(decoder.build_obs(index, allies, enemies, previous_action), expected)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+import torch
+from gym import spaces
+from stable_baselines3.common.buffers import RolloutBuffer
+
+from training.rollout_buffer import DiskRolloutBuffer
+
+OBSERVATION_SPACE = spaces.Box(-np.inf, np.inf, shape=(6,))
+ACTION_SPACE = spaces.MultiDiscrete([3, 3, 3, 3, 3, 2, 2, 2])
+
+
+def fill(buffer, seed):
+    rng = np.random.default_rng(seed)
+    buffer.reset()
+    for _ in range(buffer.buffer_size):
+        buffer.add(rng.normal(size=(buffer.n_envs, 6)).astype(np.float32),
+                   rng.integers(0, 2, (buffer.n_envs, 8)),
+                   rng.normal(size=buffer.n_envs).astype(np.float32),
+                   rng.uniform(size=buffer.n_envs) < 0.05,
+                   torch.as_tensor(rng.normal(size=buffer.n_envs)),
+                   torch.as_tensor(rng.normal(size=buffer.n_envs)))
+    buffer.compute_returns_and_advantage(torch.as_tensor(rng.normal(size=buffer.n_envs)),
+                                         rng.uniform(size=buffer.n_envs) < 0.5)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 4096])
+def test_matches_rollout_buffer(chunk_size, tmp_path):
+    args = (200, OBSERVATION_SPACE, ACTION_SPACE, "cpu", 0.95, 0.99, 3)
+    reference = RolloutBuffer(*args)
+    buffer = DiskRolloutBuffer(*args, directory=tmp_path, chunk_size=chunk_size)
+    fill(reference, 0)
+    fill(buffer, 0)
+
+    np.testing.assert_array_equal(buffer.advantages, reference.advantages)
+    np.testing.assert_array_equal(buffer.returns, reference.returns)
+
+    # Minibatches are drawn from the same permutation
+    np.random.seed(0)
+    expected = list(reference.get(128))
+    np.random.seed(0)
+    minibatches = list(buffer.get(128))
+    assert len(minibatches) == len(expected)
+    for samples, expected_samples in zip(minibatches, expected):
+        for value, expected_value in zip(samples, expected_samples):
+            assert torch.equal(value, expected_value)
+    buffer.close()
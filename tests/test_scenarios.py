@@ -0,0 +1,62 @@
+import numpy as np
+from rlgym.envs import Match
+from rlgym.utils.action_parsers import DiscreteAction
+from rlgym.utils.reward_functions.common_rewards import ConstantReward
+from rlgym.utils.terminal_conditions.common_conditions import GoalScoredCondition, TimeoutCondition
+
+from training.observations import OswaldObservations
+from training.scenarios import ScenarioOutcomeCondition
+from training.simulator import SimulatedMatches
+from training.state_setter import TrainingStateSetter
+
+
+def make_simulation(scenario):
+    state_setter = TrainingStateSetter(seed=0, scenario_weights={scenario: 1})
+    # GoalScoredCondition ends the episode before ScenarioOutcomeCondition sees the state with the goal, as in main.py
+    match = Match(ConstantReward(), [TimeoutCondition(400), GoalScoredCondition(), ScenarioOutcomeCondition(state_setter)],
+                  OswaldObservations(), DiscreteAction(), state_setter, spawn_opponents=True)
+    return SimulatedMatches([match]), state_setter.curriculum
+
+
+def play_episode(simulation, ball_velocity):
+    """
+    Resets the match, moves the cars out of the way and sends the ball off with ball_velocity until the episode ends.
+    """
+    simulation.reset(0)
+    arenas = simulation.arenas
+    arenas.car_position[0, :, 0] = 3000
+    arenas.ball_position[0, 0] = 0
+    arenas.ball_linear_velocity[0] = ball_velocity
+    actions = np.ones((2, 8))
+    actions[:, 5:] = 0
+    done, info = False, None
+    while not done:
+        [(_, _, done, info)] = simulation.step([actions])
+    return info["result"]
+
+
+def test_goal_ending_the_episode_is_a_success():
+    simulation, curriculum = make_simulation("attack")
+    assert play_episode(simulation, (0, 3000, 0)) == 1
+    # The outcome is recorded when the next episode starts
+    simulation.reset(0)
+    assert curriculum.episodes["attack"] == 1
+    assert curriculum.successes["attack"] == 1
+
+
+def test_conceded_goal_and_timeout_are_failures():
+    simulation, curriculum = make_simulation("attack")
+    assert play_episode(simulation, (0, -3000, 0)) == -1
+    assert play_episode(simulation, (0, 0, 0)) == 0
+    simulation.reset(0)
+    assert curriculum.episodes["attack"] == 2
+    assert curriculum.successes["attack"] == 0
+
+
+def test_defend_fails_when_conceding():
+    simulation, curriculum = make_simulation("defend")
+    assert play_episode(simulation, (0, -3000, 0)) == -1
+    assert play_episode(simulation, (0, 0, 0)) == 0
+    simulation.reset(0)
+    assert curriculum.episodes["defend"] == 2
+    assert curriculum.successes["defend"] == 1
@@ -0,0 +1,19 @@
+import torch
+from stable_baselines3 import PPO
+from stable_baselines3.common.vec_env import VecCheckNan, VecNormalize
+
+from training.hyperparameter_sweep import make_match
+from training.sim_vec_env import SimulatedVecEnv
+from training.state_setter import TrainingStateSetter
+
+
+def test_ppo_trains_on_the_simulator():
+    # main.py's rewards are NaN whenever a simulated car stands still, PPO's first update turned those into NaN logits
+    torch.set_num_threads(1)
+    simulation = SimulatedVecEnv(lambda: make_match(8, TrainingStateSetter(seed=0)), 1)
+    env = VecNormalize(VecCheckNan(simulation, raise_exception=True), norm_obs=False)
+    model = PPO("MlpPolicy", env, n_steps=512, batch_size=256, n_epochs=2, seed=0, device="cpu")
+    model.learn(2048)
+
+    assert simulation.nan_rewards > 0
+    assert all(torch.isfinite(parameter).all() for parameter in model.policy.parameters())
@@ -0,0 +1,33 @@
+import json
+import os
+
+import numpy as np
+
+from training.trajectory_recorder import INDEX_FILE, TrajectoryReader, TrajectoryWriter
+
+
+def write_steps(writer, steps, episode_length=7):
+    n = writer.n_envs
+    for step in range(steps):
+        done = np.full(n, step % episode_length == episode_length - 1)
+        writer.write_step(np.full((n, 4), step), np.zeros((n, 8)), np.full(n, step), done, np.zeros((n, 0)),
+                          np.zeros((n, 5)), np.zeros(n))
+    writer.close()
+
+
+def test_index_only_lists_shards_on_disk(tmp_path):
+    writer = TrajectoryWriter(tmp_path, 2, shard_rows=20, max_bytes=5000)
+    write_steps(writer, 1000)
+
+    shards = {name for name in os.listdir(tmp_path) if name.endswith(".npy")}
+    with open(tmp_path / INDEX_FILE) as f:
+        records = [json.loads(line) for line in f]
+    assert {record.get("shard", record.get("name")) for record in records} == shards
+
+    reader = TrajectoryReader(tmp_path)
+    assert set(reader.shards) == shards
+    assert len(reader) > 0
+    for i in range(len(reader)):
+        episode = reader.episode(i)
+        # Rows of an episode are consecutive steps
+        assert (np.diff(episode["reward"]) == 1).all()
@@ -0,0 +1,232 @@
+import numpy as np
+from rlgym.utils import RewardFunction
+from rlgym.utils.common_values import BLUE_TEAM, ORANGE_GOAL_BACK, BLUE_GOAL_BACK, BALL_MAX_SPEED, \
+    BACK_WALL_Y, BALL_RADIUS
+from rlgym.utils.gamestates import GameState, PlayerData
+
+from training.rewards import OswaldRewardFunction, PlayerToBallRewardFunction, HitSpeedRewardFunction, \
+    AirdribbleRewardFunction, BallToGoalRewardFunction, PlayerVelocityReward
+from training.reward_state import RewardStateStore, EVENT_COLUMNS, BALL_SPEED, player_events
+from training.reward_telemetry import RewardRingBuffer
+
+# Back of the goal each team scores in, indexed by team number (BLUE_TEAM is 0)
+TARGET_GOALS = np.array((ORANGE_GOAL_BACK, BLUE_GOAL_BACK), dtype=float)
+_ONES = np.ones(3)
+# Vector pairs dotted by PlayerArrays._compute_shared
+_LEFT = np.array((0, 1, 2, 3, 0))
+_RIGHT = np.array((0, 1, 2, 3, 3))
+
+
+class PlayerArrays:
+    """
+    Per-player values of a game state stacked into arrays, one row per player. Ball values are repeated on every
+    row so rows from many states can be concatenated and evaluated together. The speeds, the car to ball and ball to
+    goal distances and the ball's velocity towards the goal are computed once here since several kernels need them.
+    """
+
+    def __init__(self, car_position, car_velocity, ball_position, ball_velocity, team, events, car_ids=None):
+        self.car_position = np.asarray(car_position, dtype=float).reshape(-1, 3)
+        self.car_velocity = np.asarray(car_velocity, dtype=float).reshape(-1, 3)
+        n = len(self.car_position)
+        self.ball_position = _rows_of(ball_position, n)
+        self.ball_velocity = _rows_of(ball_velocity, n)
+        self.team = np.asarray(team).reshape(n)
+        self.events = np.asarray(events, dtype=float).reshape(n, len(EVENT_COLUMNS))
+        self.car_ids = np.arange(n) if car_ids is None else np.asarray(car_ids).reshape(n)
+        self._compute_shared()
+
+    def _compute_shared(self):
+        # All dot products in one pass, the squared lengths of the four vectors and the ball velocity with the
+        # direction to the goal
+        vectors = np.array((self.ball_velocity, self.car_velocity, self.ball_position - self.car_position,
+                            TARGET_GOALS[self.team] - self.ball_position))
+        dots = _dot(vectors[_LEFT], vectors[_RIGHT])
+        self.ball_speed, self.car_speed, self.ball_distance, self.goal_distance = np.sqrt(dots[:4])
+        self.ball_towards_goal = dots[4]
+
+    def __len__(self):
+        return len(self.car_position)
+
+    @classmethod
+    def from_state(cls, state: GameState, players=None):
+        if players is None:
+            players = state.players
+        n = len(players)
+
+        # One array built from a list of floats per player, copying value by value costs more than the rewards with
+        # 1v1, and so does iterating over the NumPy vectors
+        ball = state.ball.position.tolist() + state.ball.linear_velocity.tolist()
+        values = np.array([player.car_data.position.tolist() + player.car_data.linear_velocity.tolist() + ball +
+                           [player.team_num, player.car_id, *player_events(player, state)] for player in players],
+                          dtype=float)
+        values = values.reshape(n, 14 + len(EVENT_COLUMNS))
+
+        # The columns already have the shapes __init__ checks for
+        arrays = cls.__new__(cls)
+        arrays.car_position, arrays.car_velocity = values[:, 0:3], values[:, 3:6]
+        arrays.ball_position, arrays.ball_velocity = values[:, 6:9], values[:, 9:12]
+        arrays.team, arrays.car_ids = values[:, 12:14].T.astype(int)
+        arrays.events = values[:, 14:]
+        arrays._compute_shared()
+        return arrays
+
+
+def _rows_of(vectors, n):
+    vectors = np.asarray(vectors, dtype=float)
+    if vectors.shape == (n, 3):
+        return vectors
+    return np.broadcast_to(vectors, (n, 3))
+
+
+def _dot(a, b):
+    # Dot products of the last axis, a product with ones has less overhead than einsum for a few rows
+    return (a * b) @ _ONES
+
+
+def player_to_ball_reward(arrays: PlayerArrays, ball_speed_factor=0.1):
+    # Same formula as PlayerToBallRewardFunction, including its use of the ball's x velocity as "speed"
+    ball_speed = arrays.ball_speed
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ball_direction = arrays.ball_velocity / ball_speed[:, None]
+        car_direction = arrays.car_velocity / arrays.car_speed[:, None]
+        angle = np.arccos(_dot(ball_direction, car_direction))
+
+    # Constant factors are folded, with only 2 players every NumPy call counts
+    reward = (1 - arrays.ball_distance * (1 / (BACK_WALL_Y - BALL_RADIUS))) * \
+             (1 + arrays.ball_velocity[:, 0] * (ball_speed_factor / BALL_MAX_SPEED))
+    turn = angle * (1 / np.pi)
+    reward *= np.where(angle < np.pi / 2, 1 + turn, 1.5 - turn)
+
+    # A ball that isn't moving gets a small constant punishment
+    reward[ball_speed == 0] = -0.1
+    return reward
+
+
+def hit_speed_reward(arrays: PlayerArrays, reward_weight, previous_ball_speed=0.):
+    gain = np.maximum(arrays.ball_speed - previous_ball_speed, 0)
+    return gain * (reward_weight / BALL_MAX_SPEED)
+
+
+def airdribble_reward(arrays: PlayerArrays, reward_weight, min_distance_threshold=10):
+    in_air = np.minimum(arrays.ball_position[:, 2], arrays.car_position[:, 2]) > 0
+    return (in_air & (arrays.ball_distance < min_distance_threshold)) * float(reward_weight)
+
+
+def ball_to_goal_reward(arrays: PlayerArrays, reward_weight, min_distance_threshold=10):
+    scoring = (arrays.ball_towards_goal > 0) & (arrays.goal_distance < min_distance_threshold)
+    return np.where(scoring, float(reward_weight), -0.1)
+
+
+def player_velocity_reward(arrays: PlayerArrays):
+    return arrays.car_speed
+
+
+class BatchedCombinedReward(RewardFunction):
+    """
+    Drop-in replacement for CombinedReward over the reward classes in training/rewards.py. Rewards for every player
+    are computed together in pre_step with one NumPy pass per component, get_reward then only looks up the player's row.
+
+    With telemetry_capacity set, the components of the last telemetry_capacity steps are kept in a RewardRingBuffer
+    and the final state of every episode gets the episode's sums as reward_episode, see training/reward_telemetry.py.
+    With components_in_state set, every state gets its components as reward_components for TrajectoryRecorder. With
+    the defaults the states are left untouched.
+    """
+
+    def __init__(self, reward_functions, reward_weights=None, telemetry_capacity=None, components_in_state=False):
+        super().__init__()
+        self.reward_functions = tuple(reward_functions)
+        self.reward_weights = np.asarray(reward_weights if reward_weights is not None
+                                         else np.ones(len(self.reward_functions)), dtype=float)
+
+        if len(self.reward_functions) != len(self.reward_weights):
+            raise ValueError(
+                ("Reward functions list length ({0}) and reward weights "
+                 "length ({1}) must be equal").format(len(self.reward_functions), len(self.reward_weights))
+            )
+
+        self._kernels = [self._make_kernel(func) for func in self.reward_functions]
+        self.component_names = tuple(type(func).__name__ for func in self.reward_functions)
+
+        # Stateful values for OswaldRewardFunction and HitSpeedRewardFunction, one row per car
+        self.state_store = RewardStateStore()
+
+        self.last_rewards = None
+        self.last_components = None
+        self._last_state = None
+
+        self.components_in_state = components_in_state
+        self.telemetry_capacity = telemetry_capacity
+        self.telemetry = None
+        self._summarized_state = None
+
+    def _make_kernel(self, func):
+        # Kernels take the arrays and their rows in the state store
+        if isinstance(func, OswaldRewardFunction):
+            weights = func.weights
+            return lambda arrays, rows: self._event_reward(arrays, rows, weights)
+        if isinstance(func, PlayerToBallRewardFunction):
+            return lambda arrays, rows: player_to_ball_reward(arrays, func.ball_speed_factor)
+        if isinstance(func, HitSpeedRewardFunction):
+            return lambda arrays, rows: self._hit_speed_reward(arrays, rows, func.reward_weight)
+        if isinstance(func, AirdribbleRewardFunction):
+            return lambda arrays, rows: airdribble_reward(arrays, func.reward_weight, func.min_distance_threshold)
+        if isinstance(func, BallToGoalRewardFunction):
+            return lambda arrays, rows: ball_to_goal_reward(arrays, func.reward_weight, func.min_distance_threshold)
+        if isinstance(func, PlayerVelocityReward):
+            return lambda arrays, rows: player_velocity_reward(arrays)
+        raise ValueError("No batched implementation for reward function {0}".format(type(func).__name__))
+
+    def _rows(self, arrays: PlayerArrays):
+        return np.array([self.state_store.row(car_id) for car_id in arrays.car_ids.tolist()], dtype=np.intp)
+
+    def _event_reward(self, arrays: PlayerArrays, rows, weights):
+        return self.state_store.event_deltas(rows, arrays.events) @ weights
+
+    def _hit_speed_reward(self, arrays: PlayerArrays, rows, reward_weight):
+        previous_ball_speed = self.state_store.values[rows, BALL_SPEED]
+        reward = hit_speed_reward(arrays, reward_weight, previous_ball_speed)
+        self.state_store.values[rows, BALL_SPEED] = arrays.ball_speed
+        return reward
+
+    def reset(self, initial_state: GameState, optional_data=None):
+        self.state_store.reset(initial_state)
+        self.last_rewards = None
+        self.last_components = None
+        self._last_state = None
+
+        if self.telemetry_capacity:
+            shape = (len(initial_state.players), len(self.reward_functions))
+            if self.telemetry is None or self.telemetry.shape != shape:
+                self.telemetry = RewardRingBuffer(self.telemetry_capacity, *shape)
+            self.telemetry.start_episode()
+
+    def evaluate(self, arrays: PlayerArrays):
+        """
+        Returns the weighted reward per row and the (rows, components) matrix of unweighted component rewards.
+        """
+        rows = self._rows(arrays)
+        components = np.array([kernel(arrays, rows) for kernel in self._kernels])
+        return self.reward_weights @ components, components.T
+
+    def pre_step(self, state: GameState):
+        self.last_rewards, self.last_components = self.evaluate(PlayerArrays.from_state(state))
+        self._last_state = state
+        if self.components_in_state:
+            # rlgym returns the state in the step's info dict, so the components reach TrajectoryRecorder with it,
+            # also from SB3MultipleInstanceEnv's worker processes
+            state.reward_components = self.last_components
+        if self.telemetry is not None:
+            self.telemetry.record(self.last_components)
+
+    def get_reward(self, player: PlayerData, state: GameState, previous_action: np.ndarray, optional_data=None):
+        if state is not self._last_state:
+            self.pre_step(state)
+        return float(self.last_rewards[state.players.index(player)])
+
+    def get_final_reward(self, player: PlayerData, state: GameState, previous_action: np.ndarray, optional_data=None):
+        reward = self.get_reward(player, state, previous_action, optional_data)
+        if self.telemetry is not None and state is not self._summarized_state:
+            state.reward_episode = self.telemetry.summary(self.component_names, self.reward_weights)
+            self._summarized_state = state
+        return reward
@@ -0,0 +1,235 @@
+"""
+Saves checkpoints without stalling training: the learner only snapshots the model into memory, a background thread
+compresses it and moves it into place with an atomic rename.
+
+The checkpoint directory holds the .zip checkpoints, checkpoints.json listing them, and the pointer files "latest" and
+"best" whose only line is the name of a checkpoint relative to the directory. PPO.load(resolve_checkpoint(directory))
+loads the newest one.
+"""
+import io
+import json
+import os
+import pathlib
+import queue
+import shutil
+import threading
+import zipfile
+
+from stable_baselines3.common.callbacks import BaseCallback
+
+INDEX_FILE = "checkpoints.json"
+LATEST = "latest"
+BEST = "best"
+
+
+def _replace_atomically(path, write):
+    # Readers only ever see the previous file or the complete new one
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_pointer(directory, pointer, name):
+    _replace_atomically(pathlib.Path(directory) / pointer, lambda f: f.write(name.encode() + b"\n"))
+
+
+def resolve_checkpoint(path, pointer=LATEST):
+    """
+    Returns the checkpoint a pointer file of the directory path names. Any other path is returned unchanged.
+    """
+    path = pathlib.Path(path)
+    if not path.is_dir():
+        return path
+    with open(path / pointer) as f:
+        return path / f.read().strip()
+
+
+def _compress(snapshot, f):
+    # Network weights barely compress, the fastest level gets about as small as the others
+    with zipfile.ZipFile(snapshot) as source, \
+            zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for info in source.infolist():
+            with source.open(info) as member, archive.open(info.filename, "w", force_zip64=True) as out:
+                shutil.copyfileobj(member, out)
+
+
+class CheckpointManager:
+    """
+    Writes checkpoints on a background thread and deletes the ones the retention policy doesn't keep: the keep_last
+    newest, the one with the best eval reward and every keep_every-th. Checkpoints saved with a name of their own
+    (like exit_save) are never deleted.
+
+    save() blocks only while the model is serialized into memory, or when max_pending snapshots are already waiting
+    to be written.
+    """
+
+    def __init__(self, directory, name_prefix="rl_model", keep_last=5, keep_every=10, max_pending=2):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.name_prefix = name_prefix
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+
+        # Written by the writer thread only
+        self.checkpoints = []
+        index_path = self.directory / INDEX_FILE
+        if index_path.exists():
+            with open(index_path) as f:
+                self.checkpoints = json.load(f)
+        self._count = max((c["number"] for c in self.checkpoints if c["number"] is not None), default=0)
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def save(self, model, eval_reward=None, name=None):
+        """
+        Snapshots the model and queues it to be written, returns the checkpoint's file name.
+        """
+        if self._error is not None:
+            raise RuntimeError("Checkpoint writer failed") from self._error
+
+        number = None
+        if name is None:
+            self._count += 1
+            number = self._count
+            name = f"{self.name_prefix}_{model.num_timesteps}_steps"
+        snapshot = io.BytesIO()
+        model.save(snapshot)
+        snapshot.seek(0)
+
+        checkpoint = {"name": name + ".zip", "number": number, "timesteps": model.num_timesteps,
+                      "eval_reward": eval_reward}
+        self._queue.put((self._write, (checkpoint, snapshot)))
+        return checkpoint["name"]
+
+    def record_eval(self, timesteps, eval_reward):
+        """
+        Stores the eval reward of the policy at timesteps with the checkpoint saved at those timesteps, if there is
+        one, for the best-by-eval retention. Applied by the writer thread after the checkpoints queued before.
+        """
+        if self._error is not None:
+            raise RuntimeError("Checkpoint writer failed") from self._error
+        self._queue.put((self._record_eval, (timesteps, eval_reward)))
+
+    def flush(self):
+        """
+        Waits until every queued checkpoint is written.
+        """
+        self._queue.join()
+        if self._error is not None:
+            raise RuntimeError("Checkpoint writer failed") from self._error
+
+    def latest(self):
+        return resolve_checkpoint(self.directory, LATEST)
+
+    def publish(self, directory, pointer=LATEST):
+        """
+        Copies the latest written checkpoint into another directory, e.g. rlbot_configs, and points its pointer at it.
+        """
+        self.flush()
+        checkpoint = self.latest()
+        shutil.copyfile(checkpoint, pathlib.Path(directory) / checkpoint.name)
+        write_pointer(directory, pointer, checkpoint.name)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                if self._error is None:
+                    function, args = item
+                    function(*args)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, checkpoint, snapshot):
+        _replace_atomically(self.directory / checkpoint["name"], lambda f: _compress(snapshot, f))
+        self.checkpoints = [c for c in self.checkpoints if c["name"] != checkpoint["name"]] + [checkpoint]
+        self._apply_retention()
+        self._write_index()
+
+        write_pointer(self.directory, LATEST, checkpoint["name"])
+        self._write_best()
+
+    def _record_eval(self, timesteps, eval_reward):
+        saved = [c for c in self.checkpoints if c["number"] is not None and c["timesteps"] == timesteps]
+        if not saved:
+            return
+        saved[-1]["eval_reward"] = eval_reward
+        self._apply_retention()
+        self._write_index()
+        self._write_best()
+
+    def _write_best(self):
+        best = self._best()
+        if best is not None:
+            write_pointer(self.directory, BEST, best["name"])
+
+    def _best(self):
+        evaluated = [c for c in self.checkpoints if c["eval_reward"] is not None]
+        return max(evaluated, key=lambda c: c["eval_reward"]) if evaluated else None
+
+    def _apply_retention(self):
+        numbered = [c for c in self.checkpoints if c["number"] is not None]
+        keep = {c["name"] for c in numbered[-self.keep_last:]} if self.keep_last > 0 else set()
+        keep.update(c["name"] for c in numbered if self.keep_every and c["number"] % self.keep_every == 0)
+        best = self._best()
+        if best is not None:
+            keep.add(best["name"])
+
+        for checkpoint in numbered:
+            if checkpoint["name"] not in keep:
+                path = self.directory / checkpoint["name"]
+                if path.exists():
+                    os.remove(path)
+        self.checkpoints = [c for c in self.checkpoints if c["number"] is None or c["name"] in keep]
+
+    def _write_index(self):
+        _replace_atomically(self.directory / INDEX_FILE,
+                            lambda f: f.write(json.dumps(self.checkpoints, indent=1).encode()))
+
+
+class BackgroundCheckpointCallback(BaseCallback):
+    """
+    Replaces CheckpointCallback, saves through a CheckpointManager every save_freq calls. A checkpoint is also saved
+    whenever the eval_callback (an AsyncEvalCallback, placed before this callback) submits a snapshot, and the
+    evaluation result is stored with that checkpoint once it finishes, for the best-by-eval retention.
+    """
+
+    def __init__(self, manager: CheckpointManager, save_freq, eval_callback=None, verbose=0):
+        super().__init__(verbose)
+        self.manager = manager
+        self.save_freq = save_freq
+        self.eval_callback = eval_callback
+        self._recorded_result = None
+
+    def _on_step(self) -> bool:
+        # Before saving, so the evaluated checkpoint isn't deleted by the retention first
+        if self.eval_callback is not None:
+            result = self.eval_callback.last_result
+            if result is not None and result is not self._recorded_result:
+                self._recorded_result = result
+                timesteps, mean_reward = result
+                self.manager.record_eval(timesteps, float(mean_reward))
+        save = self.n_calls % self.save_freq == 0
+        if self.eval_callback is not None:
+            # Evaluated snapshots rarely fall on a save_freq step, so they get a checkpoint of their own
+            save |= self.eval_callback.last_submitted == self.num_timesteps
+        if save:
+            name = self.manager.save(self.model)
+            if self.verbose >= 1:
+                print(f"Queued checkpoint {name}")
+        return True
@@ -0,0 +1,254 @@
+"""
+Evaluates policy snapshots in worker processes so the learner never waits for evaluation episodes and the training
+env's episodes and VecNormalize statistics are left alone.
+
+The learner exports the policy network in the format of training/export_policy.py and queues it. Each worker runs
+the fixed, seeded episodes of every scenario of training/scenarios.py with NumpyPolicy on its own env, and a
+collector thread in the learner writes the results to tensorboard.
+"""
+import io
+import multiprocessing
+import threading
+import traceback
+
+import cloudpickle
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+from torch.utils.tensorboard import SummaryWriter
+
+from training.export_policy import export_policy
+from training.numpy_policy import NumpyPolicy
+from training.scenarios import SCENARIOS
+from training.state_setter import TrainingStateSetter
+
+
+def run_episodes(env, policy: NumpyPolicy, n_episodes, obs=None):
+    """
+    Runs n_episodes on a VecEnv of one match, the policy plays every agent. Returns the rewards, lengths and results
+    (blue goals minus orange goals, the info's "result") of the first agent's episodes. The env is reset first unless
+    the observations of a reset are passed.
+    """
+    if obs is None:
+        obs = env.reset()
+    actions = np.zeros((env.num_envs,) + env.action_space.shape, dtype=np.int64)
+    rewards, lengths, results = [], [], []
+    episode_reward, episode_length = 0., 0
+    while len(rewards) < n_episodes:
+        for i in range(env.num_envs):
+            actions[i] = policy.predict(obs[i], deterministic=True)[0]
+        obs, step_rewards, dones, infos = env.step(actions)
+        episode_reward += float(step_rewards[0])
+        episode_length += 1
+        if dones[0]:
+            rewards.append(episode_reward)
+            lengths.append(episode_length)
+            results.append(infos[0].get("result", 0))
+            episode_reward, episode_length = 0., 0
+    return rewards, lengths, results
+
+
+def _worker(payload, tasks, results):
+    # make_env(match) builds the worker's VecEnv, get_match(state_setter) the match evaluated on it
+    try:
+        make_env, get_match = cloudpickle.loads(payload)
+        state_setter = TrainingStateSetter()
+        env = make_env(get_match(state_setter))
+    except Exception:
+        # E.g. Rocket League failed to launch. Reported to the learner, which restarts the worker on its next submit
+        results.put((None, None, RuntimeError(traceback.format_exc())))
+        raise SystemExit(1)
+    curriculum = state_setter.curriculum
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        snapshot, scenario, seed, n_episodes, policy_bytes = task
+        try:
+            state_setter.reseed(seed)
+            curriculum.set_weights({scenario: 1})
+            policy = NumpyPolicy(io.BytesIO(policy_bytes))
+
+            rewards, lengths, outcomes = run_episodes(env, policy, n_episodes)
+            # Episodes end at the first goal, so the result tells which team scored
+            _, success = SCENARIOS[scenario]
+            results.put((snapshot, scenario, {
+                "mean_reward": float(np.mean(rewards)),
+                "std_reward": float(np.std(rewards)),
+                "mean_ep_length": float(np.mean(lengths)),
+                "success_rate": float(np.mean([success(max(result, 0), max(-result, 0)) for result in outcomes])),
+            }))
+        except Exception as e:
+            results.put((snapshot, scenario, e))
+    env.close()
+
+
+class EvaluationPool:
+    """
+    Worker processes evaluating policy snapshots on every scenario with the same seed, so all snapshots are scored on
+    the same spawns. submit() never blocks, a snapshot arriving while max_pending snapshots are still being evaluated
+    is skipped. Results are written to log_dir as tensorboard scalars under eval/, with the timesteps of the snapshot
+    as the step.
+
+    A worker that exited, e.g. because its env failed to start, is restarted by the next submit(), and the snapshots
+    still being evaluated are given up since the worker may have taken their tasks with it. After max_restarts
+    restarts, submit() raises instead.
+    """
+
+    def __init__(self, make_env, get_match, log_dir, n_workers=1, scenarios=None, episodes_per_scenario=10, seed=0,
+                 max_pending=1, max_restarts=3):
+        self.scenarios = tuple(scenarios if scenarios is not None else SCENARIOS)
+        for scenario in self.scenarios:
+            if scenario not in SCENARIOS:
+                raise ValueError("Unknown scenario {0}".format(scenario))
+        self.episodes_per_scenario = episodes_per_scenario
+        self.seed = seed
+        self.max_pending = max_pending
+        self.max_restarts = max_restarts
+
+        self.submitted = 0
+        self.skipped = 0
+        self.completed = 0
+        self.restarts = 0
+        self.last_mean_reward = float("-inf")
+        self.last_timesteps = None
+        # (timesteps, mean reward) of the newest finished evaluation, replaced in one assignment so the learner never
+        # reads the reward of one snapshot with the timesteps of another
+        self.last_result = None
+        # Error a worker reported before it exited
+        self.worker_error = None
+        self._snapshots = {}
+
+        # Same start method as SB3MultipleInstanceEnv, the env factories are sent with cloudpickle as they are
+        # usually local functions of main.py
+        self._context = multiprocessing.get_context("spawn")
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self._payload = cloudpickle.dumps((make_env, get_match))
+        self._workers = [self._start_worker() for _ in range(n_workers)]
+
+        self._writer = SummaryWriter(log_dir)
+        self._collector = threading.Thread(target=self._collect, name="evaluation-collector", daemon=True)
+        self._collector.start()
+
+    def _start_worker(self):
+        worker = self._context.Process(target=_worker, args=(self._payload, self._tasks, self._results), daemon=True)
+        worker.start()
+        return worker
+
+    def _check_workers(self):
+        dead = [i for i, worker in enumerate(self._workers) if not worker.is_alive()]
+        if not dead:
+            return
+        exit_codes = [self._workers[i].exitcode for i in dead]
+        if self.restarts + len(dead) > self.max_restarts:
+            # Nobody reads the queued tasks anymore, don't wait for them to be flushed at exit
+            self._tasks.cancel_join_thread()
+            raise RuntimeError(f"Evaluation workers exited with codes {exit_codes} after {self.restarts} restarts") \
+                from self.worker_error
+        print(f"Evaluation workers exited with codes {exit_codes}, restarting them")
+        for i in dead:
+            self._workers[i] = self._start_worker()
+        self.restarts += len(dead)
+        self.skipped += len(self._snapshots)
+        self._snapshots.clear()
+
+    def submit(self, model, timesteps):
+        """
+        Queues a snapshot of the model's policy, returns False if it was skipped.
+        """
+        self._check_workers()
+        if len(self._snapshots) >= self.max_pending:
+            self.skipped += 1
+            return False
+
+        policy_bytes = io.BytesIO()
+        export_policy(model, policy_bytes)
+        policy_bytes = policy_bytes.getvalue()
+
+        self.submitted += 1
+        snapshot = self.submitted
+        self._snapshots[snapshot] = (timesteps, {})
+        for scenario in self.scenarios:
+            self._tasks.put((snapshot, scenario, self.seed, self.episodes_per_scenario, policy_bytes))
+        return True
+
+    def close(self):
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._results.put(None)
+        self._collector.join()
+        self._writer.close()
+
+    def _collect(self):
+        while True:
+            item = self._results.get()
+            if item is None:
+                break
+            snapshot, scenario, result = item
+            if snapshot is None:
+                print(f"Evaluation worker failed to start:\n{result}")
+                self.worker_error = result
+                continue
+            entry = self._snapshots.get(snapshot)
+            if entry is None:
+                # Given up after a worker restart
+                continue
+            timesteps, scenario_results = entry
+            if isinstance(result, Exception):
+                print(f"Evaluation of {scenario} at {timesteps} timesteps failed: {result!r}")
+            else:
+                for key, value in result.items():
+                    self._writer.add_scalar(f"eval/{scenario}/{key}", value, timesteps)
+            scenario_results[scenario] = result
+
+            if len(scenario_results) == len(self.scenarios):
+                self._finish(snapshot, timesteps, scenario_results)
+
+    def _finish(self, snapshot, timesteps, scenario_results):
+        finished = [r for r in scenario_results.values() if not isinstance(r, Exception)]
+        if finished:
+            mean_reward = float(np.mean([r["mean_reward"] for r in finished]))
+            self._writer.add_scalar("eval/mean_reward", mean_reward, timesteps)
+            self._writer.add_scalar("eval/success_rate", float(np.mean([r["success_rate"] for r in finished])),
+                                    timesteps)
+            self._writer.flush()
+            self.last_mean_reward = mean_reward
+            self.last_timesteps = timesteps
+            self.last_result = (timesteps, mean_reward)
+        self.completed += 1
+        self._snapshots.pop(snapshot, None)
+
+
+class AsyncEvalCallback(BaseCallback):
+    """
+    Replaces EvalCallback, submits a policy snapshot to an EvaluationPool every eval_freq calls. last_submitted is the
+    timesteps of the newest submitted snapshot and last_result the (timesteps, mean reward) of the newest finished
+    evaluation, BackgroundCheckpointCallback saves a checkpoint of each submitted snapshot and stores its result
+    with it.
+    """
+
+    def __init__(self, pool: EvaluationPool, eval_freq, verbose=0):
+        super().__init__(verbose)
+        self.pool = pool
+        self.eval_freq = eval_freq
+        self.last_submitted = None
+
+    @property
+    def last_mean_reward(self):
+        return self.pool.last_mean_reward
+
+    @property
+    def last_result(self):
+        return self.pool.last_result
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.eval_freq == 0:
+            submitted = self.pool.submit(self.model, self.num_timesteps)
+            if submitted:
+                self.last_submitted = self.num_timesteps
+            elif self.verbose >= 1:
+                print(f"Evaluation still running, skipped the snapshot at {self.num_timesteps} timesteps")
+        return True
@@ -0,0 +1,133 @@
+"""
+Exports the policy network of a PPO checkpoint for training/numpy_policy.py, then checks it against PPO.predict.
+
+    python -m training.export_policy rlbot_configs/exit_save.zip
+"""
+import argparse
+import pathlib
+import timeit
+
+import numpy as np
+import torch
+import torch.nn as nn
+from stable_baselines3 import PPO
+from stable_baselines3.common.torch_layers import FlattenExtractor
+
+from training.numpy_policy import NumpyPolicy
+
+
+ACTIVATION_NAMES = {
+    nn.Tanh: "tanh",
+    nn.ReLU: "relu",
+}
+
+# Only needed to unpickle the checkpoint, same values as rlbot_configs/agent.py
+CUSTOM_OBJECTS = {
+    "lr_schedule": 0.00005,
+    "clip_range": .02,
+    "n_envs": 1,
+}
+
+
+def load_checkpoint(checkpoint_path):
+    return PPO.load(str(checkpoint_path), device="cpu", custom_objects=CUSTOM_OBJECTS)
+
+
+def policy_layers(model: PPO):
+    """
+    Returns (weight, bias, activation) for every linear layer from the observation to the action logits.
+    """
+    policy = model.policy
+    if not isinstance(policy.features_extractor, FlattenExtractor):
+        raise ValueError("Only the default FlattenExtractor can be exported")
+
+    modules = list(policy.mlp_extractor.policy_net)
+    # Older SB3 versions share the first layers of the actor and critic
+    shared_net = getattr(policy.mlp_extractor, "shared_net", None)
+    if shared_net is not None:
+        modules = list(shared_net) + modules
+    modules.append(policy.action_net)
+
+    layers = []
+    for module in modules:
+        if isinstance(module, nn.Linear):
+            weight = module.weight.detach().cpu().numpy().T
+            bias = module.bias.detach().cpu().numpy()
+            layers.append([weight, bias, "identity"])
+        elif type(module) in ACTIVATION_NAMES and layers:
+            layers[-1][2] = ACTIVATION_NAMES[type(module)]
+        else:
+            raise ValueError("Cannot export layer {0}".format(module))
+    return layers
+
+
+def export_policy(model: PPO, output_path):
+    """
+    Writes the policy to output_path, which can also be a binary file object like io.BytesIO.
+    """
+    action_nvec = getattr(model.action_space, "nvec", None)
+    if action_nvec is None:
+        raise ValueError("Only MultiDiscrete action spaces can be exported")
+
+    layers = policy_layers(model)
+    arrays = {"n_layers": len(layers), "activations": np.array([activation for _, _, activation in layers]),
+              "action_nvec": np.asarray(action_nvec)}
+    for i, (weight, bias, _) in enumerate(layers):
+        arrays[f"weight_{i}"] = weight.astype(np.float32)
+        arrays[f"bias_{i}"] = bias.astype(np.float32)
+
+    if hasattr(output_path, "write"):
+        np.savez(output_path, **arrays)
+        return
+    with open(output_path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def check_policy(model: PPO, policy: NumpyPolicy, n_observations=1000, seed=0):
+    """
+    Compares deterministic actions and logits with the PPO model on random observations. Returns the number of
+    mismatched actions and the largest absolute logit difference.
+    """
+    rng = np.random.default_rng(seed)
+    observations = rng.normal(size=(n_observations, policy.observation_size)).astype(np.float32)
+
+    expected_actions, _ = model.predict(observations, deterministic=True)
+    with torch.no_grad():
+        obs_tensor, _ = model.policy.obs_to_tensor(observations)
+        latent_pi, _ = model.policy.mlp_extractor(model.policy.extract_features(obs_tensor))
+        expected_logits = model.policy.action_net(latent_pi).cpu().numpy()
+
+    mismatches = 0
+    max_difference = 0.
+    for obs, expected_action, logits in zip(observations, expected_actions, expected_logits):
+        max_difference = max(max_difference, float(np.abs(policy.logits(obs) - logits).max()))
+        mismatches += int(np.any(policy.predict(obs)[0] != expected_action))
+    return mismatches, max_difference
+
+
+def microseconds_per_action(predict, obs, number=2000):
+    predict(obs)
+    return timeit.timeit(lambda: predict(obs), number=number) / number * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m training.export_policy")
+    parser.add_argument("checkpoint", help="PPO checkpoint .zip")
+    parser.add_argument("-o", "--output", help="defaults to the checkpoint path with a .npz suffix")
+    parser.add_argument("--check", type=int, default=1000, help="number of random observations to check")
+    args = parser.parse_args()
+
+    output_path = pathlib.Path(args.output or pathlib.Path(args.checkpoint).with_suffix(".npz"))
+    model = load_checkpoint(args.checkpoint)
+    export_policy(model, output_path)
+    policy = NumpyPolicy(output_path)
+    print(f"Exported {len(policy.weights)} layers to {output_path} ({output_path.stat().st_size} bytes)")
+
+    mismatches, max_difference = check_policy(model, policy, args.check)
+    print(f"{mismatches}/{args.check} actions differ from PPO.predict, max logit difference {max_difference:.2e}")
+
+    obs = np.zeros(policy.observation_size, dtype=np.float32)
+    print(f"PPO.predict: {microseconds_per_action(lambda o: model.predict(o, deterministic=True), obs):8.1f} us/action")
+    print(f"NumpyPolicy: {microseconds_per_action(policy.predict, obs):8.1f} us/action")
+    if mismatches:
+        raise SystemExit(1)
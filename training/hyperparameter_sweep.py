@@ -0,0 +1,279 @@
+"""
+Trains PPO with different hyperparameters in parallel against the simulator of training/simulator.py, so sweeps run
+on machines without Rocket League or a GPU.
+
+    python -m training.hyperparameter_sweep --space learning_rate=1e-4,5e-5,1e-5 --space n_epochs=5,10 \\
+        --timesteps 500000 --output sweep.csv
+
+--space name=value,... sets the values tried for a hyperparameter (DEFAULTS lists them and their default values),
+a single value fixes it. Every combination is a trial, --samples picks random ones instead.
+
+Trials run in a process pool, every worker pinned to its own cores with torch limited to as many threads. Each
+trial is evaluated every --eval-interval timesteps on the same fixed spawns of every scenario, which are sampled
+once and shared with the workers as read-only memory maps. A trial whose evaluation reward is below the median
+of the other trials' at the same evaluation is pruned, after --warmup-evaluations and once --min-trials trials
+have reported it.
+"""
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+from rlgym.envs import Match
+from rlgym.utils.action_parsers import DiscreteAction
+from rlgym.utils.terminal_conditions.common_conditions import TimeoutCondition, NoTouchTimeoutCondition, \
+    GoalScoredCondition
+from stable_baselines3 import PPO
+from stable_baselines3.common.vec_env import VecMonitor, VecNormalize
+
+from training.batched_rewards import BatchedCombinedReward
+from training.evaluation import run_episodes
+from training.launcher import available_cores
+from training.observations import OswaldObservations
+from training.reward_sweep import default_rewards, gamma_from_half_life
+from training.scenarios import SCENARIOS, ScenarioSampler
+from training.sim_vec_env import SimulatedVecEnv
+from training.state_setter import TrainingStateSetter, SpawnListStateSetter
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Hyperparameters of main.py, for reference. Its rollouts and batches are sized for many game instances and a GPU,
+# with the sweep's few simulated matches on a CPU they would take GBs and delay the first evaluation by hours.
+MAIN_HYPERPARAMETERS = {
+    "n_epochs": 10,
+    "learning_rate": 5e-5,
+    "ent_coef": 0.01,
+    "vf_coef": 1.,
+    "clip_range": 0.2,
+    "batch_size": 100_000,
+    "n_steps": 1_000_000,
+    "frame_skip": 8,
+    "half_life_seconds": 5,
+}
+
+# Values of the hyperparameters a sweep doesn't set: main.py's, except for CPU-sized rollouts and batches. n_steps
+# is per env, with the default 4 matches of 2 agents a rollout is 32768 steps, several per --eval-interval.
+DEFAULTS = dict(MAIN_HYPERPARAMETERS, batch_size=4096, n_steps=4096)
+INTEGER_PARAMETERS = ("n_epochs", "batch_size", "n_steps", "frame_skip")
+
+
+def make_match(frame_skip, state_setter, team_size=1, max_steps=10000):
+    # Same rewards, observations and terminal conditions as main.py
+    return Match(
+        team_size=team_size,
+        tick_skip=frame_skip,
+        reward_function=BatchedCombinedReward(*default_rewards()),
+        spawn_opponents=True,
+        terminal_conditions=[TimeoutCondition(max_steps), NoTouchTimeoutCondition(2500), GoalScoredCondition()],
+        obs_builder=OswaldObservations(batched=True),
+        state_setter=state_setter,
+        action_parser=DiscreteAction()
+    )
+
+
+def write_spawns(directory, episodes_per_scenario, scenarios=None, seed=0):
+    """
+    Samples the evaluation spawns of every scenario into blue.npy, orange.npy and ball.npy in directory.
+    """
+    sampler = ScenarioSampler(np.random.default_rng(seed), batch_size=episodes_per_scenario)
+    spawns = [sampler.sample(scenario) for scenario in (scenarios or SCENARIOS)
+              for _ in range(episodes_per_scenario)]
+    for name, rows in zip(("blue", "orange", "ball"), zip(*spawns)):
+        np.save(os.path.join(directory, f"{name}.npy"), np.array(rows))
+
+
+def load_spawns(directory):
+    return [np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in ("blue", "orange", "ball")]
+
+
+def _pin_worker(cores, torch_threads):
+    # Pool initializer, takes the next free group of cores for the lifetime of the worker
+    group = cores.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, group)
+    elif psutil is not None:
+        psutil.Process().cpu_affinity(list(group))
+    torch.set_num_threads(torch_threads)
+
+
+def _should_prune(reports, trial, evaluation, reward, warmup_evaluations, min_trials):
+    if evaluation < warmup_evaluations:
+        return False
+    others = [value for (t, e), value in reports.items() if e == evaluation and t != trial]
+    if len(others) + 1 < min_trials:
+        return False
+    return reward < np.median(others)
+
+
+def run_trial(trial, parameters, settings, spawn_directory, reports):
+    """
+    Trains one trial and evaluates it every settings["eval_interval"] timesteps, reporting the mean evaluation reward
+    to the other trials through reports ({(trial, evaluation): reward}). Returns the trial's row of the results table.
+    """
+    start = time.perf_counter()
+    row = dict(trial=trial, **parameters, status="complete", timesteps=0, evaluations=0,
+               last_eval_reward=float("nan"), best_eval_reward=float("nan"), nan_rewards=0, seconds=0.)
+    try:
+        frame_skip = int(parameters["frame_skip"])
+        gamma = gamma_from_half_life(parameters["half_life_seconds"], frame_skip)
+        seed = settings["seed"] + trial
+
+        def get_match():
+            return make_match(frame_skip, TrainingStateSetter(seed=seed), settings["team_size"],
+                              settings["max_episode_steps"])
+
+        # NaN rewards are replaced by 0 in SimulatedVecEnv, nan_rewards counts them in training and evaluation
+        simulation = SimulatedVecEnv(get_match, settings["n_matches"])
+        env = VecMonitor(VecNormalize(simulation, norm_obs=False, gamma=gamma))
+        spawn_setter = SpawnListStateSetter(*load_spawns(spawn_directory))
+        eval_env = SimulatedVecEnv([make_match(frame_skip, spawn_setter, settings["team_size"],
+                                               settings["max_episode_steps"])])
+        model = PPO(
+            'MlpPolicy',
+            env,
+            n_epochs=int(parameters["n_epochs"]),
+            learning_rate=parameters["learning_rate"],
+            ent_coef=parameters["ent_coef"],
+            vf_coef=parameters["vf_coef"],
+            gamma=gamma,
+            clip_range=parameters["clip_range"],
+            batch_size=int(parameters["batch_size"]),
+            n_steps=int(parameters["n_steps"]),
+            seed=seed,
+            device="cpu"
+        )
+
+        evaluation = 0
+        while model.num_timesteps < settings["timesteps"]:
+            model.learn(total_timesteps=settings["eval_interval"], reset_num_timesteps=False)
+            spawn_setter.rewind()
+            rewards, _, _ = run_episodes(eval_env, model, len(spawn_setter.ball))
+            reward = float(np.mean(rewards))
+            reports[(trial, evaluation)] = reward
+            row.update(timesteps=model.num_timesteps, evaluations=evaluation + 1, last_eval_reward=reward,
+                       best_eval_reward=np.nanmax([row["best_eval_reward"], reward]),
+                       nan_rewards=simulation.nan_rewards + eval_env.nan_rewards)
+            if _should_prune(reports, trial, evaluation, reward, settings["warmup_evaluations"],
+                             settings["min_trials"]):
+                row["status"] = "pruned"
+                break
+            evaluation += 1
+        env.close()
+        eval_env.close()
+    except Exception as e:
+        row.update(status="failed", error=repr(e))
+    row["seconds"] = time.perf_counter() - start
+    return row
+
+
+def sweep(space, settings, n_workers=None, cores_per_trial=1, samples=None, seed=0):
+    """
+    Runs a trial for every combination of space ({name: [values]}, DEFAULTS for missing names), or samples random
+    combinations, in n_workers processes. Returns the results table as a list of rows.
+    """
+    for name in space:
+        if name not in DEFAULTS:
+            raise ValueError("Unknown hyperparameter {0}".format(name))
+    grid = {name: space.get(name, [value]) for name, value in DEFAULTS.items()}
+    trials = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    if samples is not None and samples < len(trials):
+        rng = np.random.default_rng(seed)
+        trials = [trials[i] for i in rng.choice(len(trials), samples, replace=False)]
+
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(available_cores()))
+    if n_workers is None:
+        n_workers = max(len(cores) // cores_per_trial, 1)
+    n_workers = min(n_workers, len(trials))
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as spawn_directory, multiprocessing.Manager() as manager:
+        write_spawns(spawn_directory, settings["episodes_per_scenario"], seed=seed)
+        reports = manager.dict()
+        core_groups = manager.Queue()
+        for w in range(n_workers):
+            # Workers share cores round robin when there are more workers than cores
+            core_groups.put({cores[(w * cores_per_trial + c) % len(cores)] for c in range(cores_per_trial)})
+
+        with concurrent.futures.ProcessPoolExecutor(n_workers, mp_context=context, initializer=_pin_worker,
+                                                    initargs=(core_groups, cores_per_trial)) as pool:
+            futures = [pool.submit(run_trial, i, parameters, settings, spawn_directory, reports)
+                       for i, parameters in enumerate(trials)]
+            results = []
+            for future in concurrent.futures.as_completed(futures):
+                row = future.result()
+                print(f"Trial {row['trial']} {row['status']} after {row['timesteps']} timesteps: "
+                      f"eval reward {row['last_eval_reward']:.3f}, {row['nan_rewards']} NaN rewards replaced "
+                      f"({row['seconds']:.0f} s)")
+                results.append(row)
+    return sorted(results, key=lambda r: r["trial"])
+
+
+def _parse_value(value):
+    number = float(value)
+    return int(number) if number.is_integer() and "e" not in value.lower() and "." not in value else number
+
+
+def _parse_space(items):
+    space = {}
+    for item in items:
+        name, values = item.split("=")
+        space[name] = [_parse_value(v) for v in values.split(",")]
+    return space
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m training.hyperparameter_sweep")
+    parser.add_argument("--space", action="append", default=[], help="hyperparameter=value,value,... to try")
+    parser.add_argument("--samples", type=int, help="run this many random combinations of the space")
+    parser.add_argument("--timesteps", type=int, default=1_000_000, help="timesteps per trial")
+    parser.add_argument("--eval-interval", type=int, default=100_000)
+    parser.add_argument("--episodes-per-scenario", type=int, default=5)
+    parser.add_argument("--warmup-evaluations", type=int, default=2, help="evaluations before a trial can be pruned")
+    parser.add_argument("--min-trials", type=int, default=4, help="trials reporting an evaluation before pruning")
+    parser.add_argument("--n-matches", type=int, default=4, help="simulated matches per trial")
+    parser.add_argument("--team-size", type=int, default=1)
+    parser.add_argument("--max-episode-steps", type=int, default=10000)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--cores-per-trial", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="hyperparameter_sweep.csv", help="results table, CSV")
+    args = parser.parse_args(argv)
+
+    settings = {
+        "timesteps": args.timesteps,
+        "eval_interval": args.eval_interval,
+        "episodes_per_scenario": args.episodes_per_scenario,
+        "warmup_evaluations": args.warmup_evaluations,
+        "min_trials": args.min_trials,
+        "n_matches": args.n_matches,
+        "team_size": args.team_size,
+        "max_episode_steps": args.max_episode_steps,
+        "seed": args.seed,
+    }
+    results = sweep(_parse_space(args.space), settings, args.workers, args.cores_per_trial, args.samples, args.seed)
+
+    columns = list(dict.fromkeys(key for row in results for key in row))
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        writer.writerows(results)
+
+    ranked = sorted(results, key=lambda r: -np.nan_to_num(r["best_eval_reward"], nan=-np.inf))
+    swept = [name for name in DEFAULTS if len(set(row[name] for row in results)) > 1]
+    print(f"{len(results)} trials, ranked by best evaluation reward, written to {args.output}:")
+    for row in ranked:
+        print(f"  {row['best_eval_reward']:10.3f} {row['status']:8s} {row['timesteps']:>10d} timesteps "
+              f"{ {name: row[name] for name in swept} }")
+
+
+if __name__ == "__main__":
+    main()
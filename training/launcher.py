@@ -0,0 +1,273 @@
+"""
+Sizes the number of env instances (Rocket League instances or simulator workers) to the machine and keeps them
+running during training.
+
+ramp_up() starts with one instance and keeps adding instances while each new one still adds enough steps per second,
+up to the limit of max_instances() for the machine's cores and memory. The returned InstancePool relaunches an
+instance that crashes instead of ending training.
+"""
+import os
+import time
+from multiprocessing.connection import wait
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import VecEnv
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Rough resources a Rocket League instance needs
+GAME_MEMORY_BYTES = 3 * 2 ** 30
+GAME_CORES = 1
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def max_instances(memory_per_instance=GAME_MEMORY_BYTES, cores_per_instance=GAME_CORES, reserved_cores=1,
+                  reserved_memory=4 * 2 ** 30):
+    """
+    Number of instances that fit in the cores and memory left after the reserve for the learner. Memory isn't
+    checked when psutil isn't installed.
+    """
+    limit = (available_cores() - reserved_cores) // cores_per_instance
+    if psutil is not None:
+        limit = min(limit, int((psutil.virtual_memory().available - reserved_memory) // memory_per_instance))
+    return max(limit, 1)
+
+
+class InstancePool(VecEnv):
+    """
+    VecEnv over independent instances, each a VecEnv made by make_instance(), e.g. SB3MultipleInstanceEnv(get_match, 1)
+    or SimulatedVecEnv(get_match, 1). An instance whose step raises is closed and relaunched up to max_restarts times,
+    its agents get done=True and the new instance's first observations, with "instance_restarted" set in their infos.
+
+    The step time of every instance is measured from step_async to when its results arrive, instances running in
+    subprocesses are waited on in the order they finish.
+    """
+
+    def __init__(self, make_instance, n_instances=1, max_restarts=3):
+        self.make_instance = make_instance
+        self.max_restarts = max_restarts
+        self.instances = []
+        self.restarts = []
+        self.steps = []
+        self.step_times = []
+        self._step_start = None
+        for _ in range(n_instances):
+            self._launch()
+        first = self.instances[0]
+        super().__init__(self._count_envs(), first.observation_space, first.action_space)
+
+    def _count_envs(self):
+        return sum(instance.num_envs for instance in self.instances)
+
+    def _launch(self, i=None):
+        instance = self.make_instance()
+        if i is None:
+            self.instances.append(instance)
+            self.restarts.append(0)
+            self.steps.append(0)
+            self.step_times.append(0.)
+        else:
+            self.instances[i] = instance
+        return instance
+
+    def add_instances(self, n):
+        """
+        Launches n more instances. Only call it before the env is given to a model, num_envs changes.
+        """
+        for _ in range(n):
+            self._launch()
+        self.num_envs = self._count_envs()
+
+    def remove_instances(self, n):
+        for _ in range(n):
+            self.instances.pop().close()
+            for stats in (self.restarts, self.steps, self.step_times):
+                stats.pop()
+        self.num_envs = self._count_envs()
+
+    def reset_stats(self):
+        self.steps = [0] * len(self.instances)
+        self.step_times = [0.] * len(self.instances)
+
+    def instance_stats(self):
+        """
+        Steps per second each instance would run at on its own, from the measured step times.
+        """
+        return [{"agents": instance.num_envs, "steps": steps, "restarts": restarts,
+                 "steps_per_second": steps / step_time if step_time > 0 else float("nan")}
+                for instance, steps, restarts, step_time in zip(self.instances, self.steps, self.restarts,
+                                                                self.step_times)]
+
+    def _slices(self):
+        start = 0
+        for instance in self.instances:
+            yield slice(start, start + instance.num_envs)
+            start += instance.num_envs
+
+    def reset(self):
+        return np.concatenate([instance.reset() for instance in self.instances])
+
+    def step_async(self, actions):
+        self._step_start = time.perf_counter()
+        for i, (instance, agents) in enumerate(zip(self.instances, self._slices())):
+            try:
+                instance.step_async(actions[agents])
+            except Exception as e:
+                # Found out in step_wait, which restarts the instance
+                print(f"Instance {i} failed to receive actions: {e!r}")
+
+    def _wait_order(self):
+        """
+        Yields (instance index, step time) in the order the instances finish their step. Instances stepping in the
+        calling process (no remotes) are timed by their step_wait.
+        """
+        pending = {i: set(instance.remotes) for i, instance in enumerate(self.instances)
+                   if hasattr(instance, "remotes")}
+        for i in range(len(self.instances)):
+            if i not in pending:
+                yield i, None
+        while pending:
+            ready = set(wait([remote for remotes in pending.values() for remote in remotes]))
+            now = time.perf_counter()
+            for i in list(pending):
+                pending[i] -= ready
+                if not pending[i]:
+                    del pending[i]
+                    yield i, now - self._step_start
+
+    def step_wait(self):
+        obs = [None] * len(self.instances)
+        rewards = [None] * len(self.instances)
+        dones = [None] * len(self.instances)
+        infos = [None] * len(self.instances)
+        for i, step_time in self._wait_order():
+            instance = self.instances[i]
+            start = time.perf_counter()
+            try:
+                obs[i], rewards[i], dones[i], infos[i] = instance.step_wait()
+            except Exception as e:
+                obs[i], rewards[i], dones[i], infos[i] = self._restart(i, e)
+                continue
+            self.steps[i] += 1
+            self.step_times[i] += step_time if step_time is not None else time.perf_counter() - start
+        return np.concatenate(obs), np.concatenate(rewards), np.concatenate(dones), [i for o in infos for i in o]
+
+    def _restart(self, i, error):
+        if self.restarts[i] >= self.max_restarts:
+            raise RuntimeError("Instance {0} crashed more than {1} times".format(i, self.max_restarts)) from error
+        print(f"Instance {i} crashed ({error!r}), relaunching it")
+        try:
+            self.instances[i].close()
+        except Exception:
+            pass
+        self.restarts[i] += 1
+        instance = self._launch(i)
+        obs = instance.reset()
+        n = instance.num_envs
+        return obs, np.zeros(n), np.ones(n, dtype=bool), [{"instance_restarted": True} for _ in range(n)]
+
+    def close(self):
+        for instance in self.instances:
+            instance.close()
+
+    def _instance_of(self, indices):
+        indices = self._get_indices(indices)
+        bounds = np.cumsum([instance.num_envs for instance in self.instances])
+        for index in indices:
+            i = int(np.searchsorted(bounds, index, side="right"))
+            yield self.instances[i], index - (bounds[i] - self.instances[i].num_envs)
+
+    def get_attr(self, attr_name, indices=None):
+        return [instance.get_attr(attr_name, [j])[0] for instance, j in self._instance_of(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        for instance, j in self._instance_of(indices):
+            instance.set_attr(attr_name, value, [j])
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [instance.env_method(method_name, *method_args, indices=[j], **method_kwargs)[0]
+                for instance, j in self._instance_of(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [instance.env_is_wrapped(wrapper_class, [j])[0] for instance, j in self._instance_of(indices)]
+
+    def seed(self, seed=None):
+        return [instance.seed(seed) for instance in self.instances]
+
+    def run_in_workers(self, function):
+        """
+        Calls function() in the worker processes of every instance that has them (SharedMemoryVecEnv).
+        """
+        return [result for instance in self.instances if hasattr(instance, "run_in_workers")
+                for result in instance.run_in_workers(function)]
+
+
+def measure_steps_per_second(env: VecEnv, steps=200, warmup_steps=20, seed=0):
+    """
+    Agent steps per second of the env with random actions.
+    """
+    rng = np.random.default_rng(seed)
+    nvec = env.action_space.nvec
+    env.reset()
+    for i in range(warmup_steps + steps):
+        if i == warmup_steps:
+            start = time.perf_counter()
+        env.step(rng.integers(0, nvec, (env.num_envs, len(nvec))))
+    return env.num_envs * steps / (time.perf_counter() - start)
+
+
+def ramp_up(make_instance, limit=None, min_gain=0.25, steps=200, max_restarts=3):
+    """
+    Adds instances one at a time until the next one adds less than min_gain times the steps per second an instance
+    averaged so far, or limit (max_instances() by default) is reached. Returns the InstancePool with the last
+    instance that was worth adding and the (instances, steps per second) measured on the way.
+    """
+    if limit is None:
+        limit = max_instances()
+    pool = InstancePool(make_instance, 1, max_restarts)
+    history = [(1, measure_steps_per_second(pool, steps))]
+    print(f"1 instance: {history[-1][1]:.0f} steps/s")
+
+    while len(pool.instances) < limit:
+        pool.add_instances(1)
+        rate = measure_steps_per_second(pool, steps)
+        n, previous_rate = history[-1]
+        history.append((n + 1, rate))
+        print(f"{n + 1} instances: {rate:.0f} steps/s ({rate - previous_rate:+.0f})")
+        if rate - previous_rate < min_gain * previous_rate / n:
+            pool.remove_instances(1)
+            break
+
+    pool.reset_stats()
+    print(f"Using {len(pool.instances)} instances, limit {limit}")
+    return pool, history
+
+
+class InstanceStatsCallback(BaseCallback):
+    """
+    Logs the steps per second and restarts of every instance of an InstancePool after each rollout.
+    """
+
+    def __init__(self, pool: InstancePool, verbose=0):
+        super().__init__(verbose)
+        self.pool = pool
+
+    def _on_step(self) -> bool:
+        return True
+
+    def _on_rollout_end(self) -> None:
+        stats = self.pool.instance_stats()
+        for i, instance in enumerate(stats):
+            self.logger.record(f"instances/{i}/steps_per_second", instance["steps_per_second"])
+        self.logger.record("instances/restarts", sum(instance["restarts"] for instance in stats))
+        self.logger.record("instances/count", len(stats))
+        self.pool.reset_stats()
@@ -0,0 +1,326 @@
+"""
+Indexes the scalars of the tensorboard runs under logs/ into a columnar cache, so runs can be compared without
+tensorboard re-reading every event file.
+
+    python -m training.log_index runs
+    python -m training.log_index curve rollout/ep_rew_mean --runs PPO_3_0..PPO_9_0 --smoothing 0.9
+    python -m training.log_index best eval/mean_reward
+
+Every run (directory holding event files) gets one append-only file per tag in the cache directory (logs/.index by
+default), a packed array of (step, wall_time, value) records that queries memory-map. index.json remembers how many
+bytes of every event file were read, so an update only reads what was appended since, and every command updates
+first unless --no-update is passed. It also remembers the size of every tag file, and is only written once the
+appends to the tag files are on disk. Bytes past that size were appended by an update that didn't finish, queries
+ignore them and the next update overwrites them, since their events are read again.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import pathlib
+import re
+import struct
+import time
+
+import numpy as np
+from tensorboard.compat.proto.event_pb2 import Event
+
+RECORD_DTYPE = np.dtype([("step", "<i8"), ("wall_time", "<f8"), ("value", "<f4")])
+INDEX_FILE = "index.json"
+EVENT_FILE_PATTERN = "events.out.tfevents.*"
+
+# TFRecord framing: length (uint64), CRC of the length, data, CRC of the data
+HEADER_SIZE = 12
+FOOTER_SIZE = 4
+
+
+def read_records(f, offset=0):
+    """
+    Yields (record data, offset after the record) from offset on, stopping before a record that isn't completely
+    written yet.
+    """
+    f.seek(offset)
+    while True:
+        header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            return
+        (length,) = struct.unpack_from("<Q", header)
+        data = f.read(length)
+        footer = f.read(FOOTER_SIZE)
+        if len(data) < length or len(footer) < FOOTER_SIZE:
+            return
+        offset += HEADER_SIZE + length + FOOTER_SIZE
+        yield data, offset
+
+
+def _scalar(value):
+    kind = value.WhichOneof("value")
+    if kind == "simple_value":
+        return value.simple_value
+    if kind == "tensor" and value.tensor.dtype == 1 and not value.tensor.tensor_shape.dim:
+        # Scalar float tensors, as written by tf.summary in TF2
+        tensor = value.tensor
+        return tensor.float_val[0] if tensor.float_val else np.frombuffer(tensor.tensor_content, "<f4")[0]
+    return None
+
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def smooth(values, weight):
+    """
+    Tensorboard's smoothing: exponential moving average with weight in [0, 1), debiased for the first values.
+    Values that aren't finite are passed through and left out of the average.
+    """
+    smoothed = np.empty(len(values))
+    last = 0.
+    n = 0
+    for i, value in enumerate(np.asarray(values, dtype=float).tolist()):
+        if not np.isfinite(value):
+            smoothed[i] = value
+            continue
+        n += 1
+        last = last * weight + (1 - weight) * value
+        smoothed[i] = last / (1 - weight ** n) if weight > 0 else last
+    return smoothed
+
+
+class LogIndex:
+    def __init__(self, log_directory="logs", cache_directory=None):
+        self.log_directory = pathlib.Path(log_directory)
+        self.cache_directory = pathlib.Path(cache_directory) if cache_directory else self.log_directory / ".index"
+        # run -> {"files": {event file: bytes read}, "tags": {tag: cache file}, "sizes": {tag: bytes written}}
+        self.index = {"runs": {}}
+        index_path = self.cache_directory / INDEX_FILE
+        if index_path.exists():
+            with open(index_path) as f:
+                self.index = json.load(f)
+        for run, entry in self.index["runs"].items():
+            if "sizes" not in entry:
+                # Written before the sizes were recorded, the tag files are trusted as they are
+                entry["sizes"] = {tag: (self.cache_directory / run / name).stat().st_size
+                                  for tag, name in entry["tags"].items()}
+        self._maps = {}
+
+    def update(self):
+        """
+        Reads what was appended to the event files since the last update, returns the number of new scalars.
+        """
+        event_files = {}
+        for path in self.log_directory.rglob(EVENT_FILE_PATTERN):
+            if self.cache_directory in path.parents:
+                continue
+            run = path.parent.relative_to(self.log_directory).as_posix()
+            event_files.setdefault(run, []).append(path)
+
+        added = 0
+        for run, paths in event_files.items():
+            entry = self.index["runs"].setdefault(run, {"files": {}, "tags": {}, "sizes": {}})
+            if any(entry["files"].get(path.name, 0) > path.stat().st_size for path in paths) or \
+                    set(entry["files"]) - {path.name for path in paths}:
+                # An event file was replaced or deleted, the run is read again from scratch
+                self._drop_run(run)
+                entry = self.index["runs"][run] = {"files": {}, "tags": {}, "sizes": {}}
+            for path in sorted(paths, key=lambda p: _natural_key(p.name)):
+                added += self._read_file(run, entry, path)
+
+        for run in set(self.index["runs"]) - set(event_files):
+            self._drop_run(run)
+            del self.index["runs"][run]
+        self._save_index()
+        return added
+
+    def _read_file(self, run, entry, path):
+        offset = entry["files"].get(path.name, 0)
+        if offset == path.stat().st_size:
+            return 0
+        records = {}
+        with open(path, "rb") as f:
+            for data, offset in read_records(f, offset):
+                event = Event.FromString(data)
+                if event.WhichOneof("what") != "summary":
+                    continue
+                for value in event.summary.value:
+                    scalar = _scalar(value)
+                    if scalar is not None:
+                        records.setdefault(value.tag, []).append((event.step, event.wall_time, scalar))
+
+        for tag, rows in records.items():
+            self._maps.pop((run, tag), None)
+            data = np.array(rows, dtype=RECORD_DTYPE).tobytes()
+            size = entry["sizes"].get(tag, 0)
+            with open(self._tag_path(run, entry, tag), "ab") as f:
+                # Drops what an unfinished update appended after the size in the index
+                f.truncate(size)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            entry["sizes"][tag] = size + len(data)
+        entry["files"][path.name] = offset
+        return sum(len(rows) for rows in records.values())
+
+    def _tag_path(self, run, entry, tag):
+        name = entry["tags"].get(tag)
+        if name is None:
+            base = re.sub(r"[^A-Za-z0-9_.-]", "_", tag)
+            name = base + ".bin"
+            taken = set(entry["tags"].values())
+            i = 1
+            while name in taken:
+                i += 1
+                name = f"{base}_{i}.bin"
+            entry["tags"][tag] = name
+        directory = self.cache_directory / run
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory / name
+
+    def _drop_run(self, run):
+        entry = self.index["runs"].get(run, {"tags": {}})
+        for tag, name in entry["tags"].items():
+            self._maps.pop((run, tag), None)
+            try:
+                os.remove(self.cache_directory / run / name)
+            except OSError:
+                pass
+
+    def _save_index(self):
+        self.cache_directory.mkdir(parents=True, exist_ok=True)
+        path = self.cache_directory / INDEX_FILE
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def runs(self):
+        return sorted(self.index["runs"], key=_natural_key)
+
+    def select(self, specs=None):
+        """
+        Runs matching any of specs: a run name, a glob like PPO_1* or a range like PPO_3_0..PPO_9_0 (both ends
+        included, in natural order). All runs by default.
+        """
+        runs = self.runs()
+        if not specs:
+            return runs
+        selected = set()
+        for spec in specs:
+            if ".." in spec:
+                first, last = (_natural_key(end) for end in spec.split(".."))
+                selected.update(run for run in runs if first <= _natural_key(run) <= last)
+            else:
+                selected.update(fnmatch.filter(runs, spec))
+        return [run for run in runs if run in selected]
+
+    def tags(self, run):
+        return sorted(self.index["runs"][run]["tags"])
+
+    def scalars(self, run, tag):
+        """
+        The (step, wall_time, value) records of a tag in the order they were written, memory-mapped read-only.
+        """
+        entry = self.index["runs"].get(run, {})
+        name = entry.get("tags", {}).get(tag)
+        count = entry.get("sizes", {}).get(tag, 0) // RECORD_DTYPE.itemsize
+        if name is None or not count:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        records = self._maps.get((run, tag))
+        if records is None:
+            records = np.memmap(self.cache_directory / run / name, RECORD_DTYPE, mode="r", shape=(count,))
+            self._maps[(run, tag)] = records
+        return records
+
+    def series(self, run, tag, smoothing=0.):
+        """
+        Steps and values of a tag sorted by step, values smoothed like tensorboard does.
+        """
+        records = self.scalars(run, tag)
+        order = np.argsort(records["step"], kind="stable")
+        steps, values = records["step"][order], records["value"][order].astype(float)
+        return steps, smooth(values, smoothing) if smoothing else values
+
+    def best(self, runs, tag="eval/mean_reward", minimize=False):
+        """
+        {run: (step, value)} of the best value of tag in every run that logged a finite one, e.g. the step of the
+        best evaluated checkpoint.
+        """
+        results = {}
+        for run in runs:
+            records = self.scalars(run, tag)
+            if np.isfinite(records["value"]).any():
+                i = int(np.nanargmin(records["value"]) if minimize else np.nanargmax(records["value"]))
+                results[run] = (int(records["step"][i]), float(records["value"][i]))
+        return results
+
+
+def _sample(steps, values, points):
+    indices = np.unique(np.linspace(0, len(steps) - 1, points).round().astype(int))
+    return steps[indices], values[indices]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m training.log_index")
+    parser.add_argument("--logs", default="logs", help="tensorboard log directory")
+    parser.add_argument("--cache", help="cache directory, <logs>/.index by default")
+    parser.add_argument("--no-update", action="store_true", help="query the cache without reading new events")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("update")
+    runs_parser = commands.add_parser("runs")
+    runs_parser.add_argument("--runs", nargs="*", help="run names, globs or ranges like PPO_3_0..PPO_9_0")
+    tags_parser = commands.add_parser("tags")
+    tags_parser.add_argument("run")
+    curve_parser = commands.add_parser("curve", help="values of a tag against steps")
+    curve_parser.add_argument("tag")
+    curve_parser.add_argument("--runs", nargs="*")
+    curve_parser.add_argument("--smoothing", type=float, default=0.6)
+    curve_parser.add_argument("--points", type=int, default=8, help="steps printed per run")
+    curve_parser.add_argument("--csv", help="write every step of every run to this file")
+    best_parser = commands.add_parser("best", help="step and value of the best value of a tag per run")
+    best_parser.add_argument("tag", nargs="?", default="eval/mean_reward")
+    best_parser.add_argument("--runs", nargs="*")
+    best_parser.add_argument("--minimize", action="store_true")
+    args = parser.parse_args(argv)
+
+    index = LogIndex(args.logs, args.cache)
+    if not args.no_update or args.command == "update":
+        start = time.perf_counter()
+        added = index.update()
+        print(f"Indexed {added} new scalars in {(time.perf_counter() - start) * 1e3:.0f} ms")
+    if args.command == "update":
+        return
+    start = time.perf_counter()
+
+    if args.command == "runs":
+        for run in index.select(args.runs):
+            entry = index.index["runs"][run]
+            print(f"{run:32s} {len(entry['tags']):4d} tags {len(entry['files']):3d} event files")
+    elif args.command == "tags":
+        for tag in index.tags(args.run):
+            records = index.scalars(args.run, tag)
+            steps = f", steps {records['step'].min()}..{records['step'].max()}" if len(records) else ""
+            print(f"{tag:40s} {len(records):8d} values{steps}")
+    elif args.command == "curve":
+        rows = []
+        for run in index.select(args.runs):
+            steps, values = index.series(run, args.tag, args.smoothing)
+            if not len(steps):
+                continue
+            rows += [(run, step, value) for step, value in zip(steps.tolist(), values.tolist())]
+            sampled = " ".join(f"{step}:{value:.3f}" for step, value in zip(*_sample(steps, values, args.points)))
+            print(f"{run:16s} last {values[-1]:10.3f} at {steps[-1]:>10d}  {sampled}")
+        if args.csv:
+            with open(args.csv, "w") as f:
+                f.write("run,step,value\n")
+                f.writelines(f"{run},{step},{value}\n" for run, step, value in rows)
+    elif args.command == "best":
+        ranked = sorted(index.best(index.select(args.runs), args.tag, args.minimize).items(),
+                        key=lambda item: item[1][1], reverse=not args.minimize)
+        for run, (step, value) in ranked:
+            print(f"{run:32s} {args.tag} {value:10.3f} at step {step}")
+    print(f"Query took {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
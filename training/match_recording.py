@@ -0,0 +1,278 @@
+"""
+Records the matches the RLBot bot plays, and turns recordings into a state library TrainingStateSetter can spawn from.
+
+MatchRecorder keeps one row per decision tick in a preallocated ring of chunks: the game time, the action latency
+(seconds from the packet the observation was built from to the chosen action), whether the round was active (not a
+kickoff countdown or goal replay), the number of cars, the score, the decoded game state (PacketDecoder.state of
+rlbot_configs/packet_decoder.py, for the first recorded cars), the observation and the action. Recording a tick is a
+few array copies into the ring. Full chunks are compressed and
+appended to the recording file by a background thread, and if it falls behind, ticks are dropped rather than making
+the bot wait.
+
+A recording file is a JSON header followed by frames, each a zlib-compressed chunk of rows, both prefixed with their
+length. A frame only counts once it's completely written, so a recording cut short by a crash reads up to its last
+complete frame.
+
+    python -m training.match_recording info rlbot_configs/recordings/*.rec
+    python -m training.match_recording states rlbot_configs/recordings/*.rec --output states.npz --every 1 --mirror
+"""
+import argparse
+import json
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+MAGIC = b"OSWREC1\n"
+LENGTH = struct.Struct("<I")
+
+# Per tick scalars, float64 columns
+TICK_FIELDS = ("time", "latency", "round_active", "n_cars", "blue_score", "orange_score")
+
+
+class MatchRecorder:
+    """
+    Records ticks into path, see the module docstring. state_dtype is the float32 layout of the recorded state,
+    packet_decoder.state_dtype(num_boosts, cars, np.float32), and metadata (JSON) is stored in the header.
+    """
+
+    def __init__(self, path, state_dtype, obs_size, action_size=8, metadata=None, chunk_rows=1024, n_chunks=4,
+                 compression_level=6):
+        self.path = path
+        self.state_dtype = np.dtype(state_dtype)
+        self.chunk_rows = chunk_rows
+        self.n_chunks = n_chunks
+        self.compression_level = compression_level
+        self.recorded = 0
+        self.dropped = 0
+
+        rows = chunk_rows * n_chunks
+        self._ticks = [None] * rows
+        self._states = np.zeros((rows, self.state_dtype.itemsize // 4), dtype=np.float32)
+        self._obs = np.zeros((rows, obs_size), dtype=np.float32)
+        self._actions = np.zeros((rows, action_size), dtype=np.float32)
+        self._state_size = self._states.shape[1]
+        self._row = 0
+        self._chunk_end = chunk_rows
+        # Chunks being written by the background thread, the ring skips ticks instead of overwriting them
+        self._busy = [False] * n_chunks
+
+        header = {
+            "tick_fields": TICK_FIELDS,
+            "state_dtype": np.lib.format.dtype_to_descr(self.state_dtype),
+            "obs_size": obs_size,
+            "action_size": action_size,
+            "metadata": metadata or {},
+        }
+        self._file = open(path, "wb")
+        header = json.dumps(header).encode()
+        self._file.write(MAGIC + LENGTH.pack(len(header)) + header)
+        self._file.flush()
+
+        self._queue = queue.SimpleQueue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="match-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, tick, state_values, obs, action):
+        """
+        Records a tick, tick is the tuple of its TICK_FIELDS values and state_values the decoder's flat state (only
+        its prefix for the recorded cars is read).
+        """
+        row = self._row
+        if row < 0:
+            # The chunk was still being written, wait for the next one
+            if self._busy[self._chunk_end // self.chunk_rows - 1]:
+                self.dropped += 1
+                return
+            row = self._row = self._chunk_end - self.chunk_rows
+
+        self._ticks[row] = tick
+        self._states[row] = state_values[:self._state_size]
+        self._obs[row] = obs
+        self._actions[row] = action
+        self.recorded += 1
+        row += 1
+        self._row = row
+        if row == self._chunk_end:
+            self._submit()
+
+    def _submit(self):
+        # Hands the rows of the current chunk to the background thread and moves on to the next chunk
+        chunk = self._chunk_end // self.chunk_rows - 1
+        start = chunk * self.chunk_rows
+        if self._row > start:
+            self._busy[chunk] = True
+            self._queue.put((chunk, start, self._row))
+        self._chunk_end = self._chunk_end % (self.chunk_rows * self.n_chunks) + self.chunk_rows
+        self._row = -1
+
+    def flush(self):
+        """
+        Writes the rows recorded so far, e.g. at the end of a match. The next tick starts a new chunk.
+        """
+        if self._row >= 0:
+            self._submit()
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise RuntimeError("Match recorder failed") from self._error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            chunk, start, stop = item
+            try:
+                if self._error is None:
+                    self._write_frame(start, stop)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._busy[chunk] = False
+        self._file.close()
+
+    def _write_frame(self, start, stop):
+        compressor = zlib.compressobj(self.compression_level)
+        ticks = np.array(self._ticks[start:stop], dtype=np.float64)
+        frame = [compressor.compress(column) for column in
+                 (ticks, self._states[start:stop], self._obs[start:stop], self._actions[start:stop])]
+        frame.append(compressor.flush())
+        data = b"".join(frame)
+        self._file.write(LENGTH.pack(len(data)) + data)
+        self._file.flush()
+
+
+def read_recording(path):
+    """
+    Returns (header, rows) of a recording, rows a structured array with a field for each of the header's tick_fields,
+    plus state (of the header's state dtype), obs and action.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} isn't a match recording")
+    offset = len(MAGIC)
+    (length,) = LENGTH.unpack_from(data, offset)
+    header = json.loads(data[offset + LENGTH.size:offset + LENGTH.size + length])
+    offset += LENGTH.size + length
+
+    state_dtype = np.lib.format.descr_to_dtype(header["state_dtype"])
+    columns = [(field, np.float64, ()) for field in header["tick_fields"]]
+    columns += [("state", state_dtype), ("obs", np.float32, header["obs_size"]),
+                ("action", np.float32, header["action_size"])]
+    row_dtype = np.dtype(columns)
+    column_sizes = [len(header["tick_fields"]) * 8, state_dtype.itemsize, header["obs_size"] * 4,
+                    header["action_size"] * 4]
+
+    frames = []
+    while offset + LENGTH.size <= len(data):
+        (length,) = LENGTH.unpack_from(data, offset)
+        if offset + LENGTH.size + length > len(data):
+            break
+        frame = zlib.decompress(data[offset + LENGTH.size:offset + LENGTH.size + length])
+        offset += LENGTH.size + length
+
+        # Frames hold one column after the other, rows put them back side by side
+        n = len(frame) // sum(column_sizes)
+        rows = np.zeros(n, dtype=row_dtype)
+        ticks = np.frombuffer(frame, np.float64, n * len(header["tick_fields"])).reshape(n, -1)
+        for i, field in enumerate(header["tick_fields"]):
+            rows[field] = ticks[:, i]
+        start = n * column_sizes[0]
+        for field, size in zip(("state", "obs", "action"), column_sizes[1:]):
+            rows[field] = np.frombuffer(frame, rows.dtype[field], n, start)
+            start += n * size
+        frames.append(rows)
+    return header, np.concatenate(frames) if frames else np.zeros(0, dtype=row_dtype)
+
+
+def library_states(rows, every=1., mirror=False):
+    """
+    Spawnable states of a recording's rows, in StateLibrary's format (training/state_setter.py): ball (n, 9),
+    cars (n, cars, 13) and teams (n, cars), -1 for empty slots. One state is kept every `every` seconds of game time,
+    states of kickoff countdowns, goal replays or with a demolished car are left out. With mirror, every state is
+    also added with the teams swapped, as the other team sees it.
+    """
+    if not len(rows):
+        return np.zeros((0, 9), np.float32), np.zeros((0, 0, 13), np.float32), np.zeros((0, 0), np.int8)
+    state = rows["state"]
+    cars = state["cars"]
+    n_cars = np.minimum(rows["n_cars"].astype(int), cars.shape[1])
+    present = np.arange(cars.shape[1]) < n_cars[:, None]
+
+    demolished = ((cars["flags"][..., 3] > 0) & present).any(axis=1)
+    keep = (rows["round_active"] > 0) & ~demolished & (n_cars > 0)
+
+    # Thins the states out to one every `every` seconds, restarting when the clock goes back (a new match)
+    times = rows["time"]
+    next_time = -np.inf
+    for i in np.flatnonzero(keep).tolist():
+        if times[i] < next_time - every:
+            next_time = -np.inf
+        if times[i] < next_time:
+            keep[i] = False
+        else:
+            next_time = times[i] + every
+
+    physics = cars["physics"][keep].reshape(keep.sum(), cars.shape[1], 12)
+    boost = cars["flags"][keep][..., :1]
+    library_cars = np.concatenate((physics, boost), axis=2).astype(np.float32)
+    teams = np.where(present[keep], cars["team"][keep], -1).astype(np.int8)
+    ball = state["ball"][keep].reshape(keep.sum(), 9).astype(np.float32)
+
+    if mirror:
+        # Rotated by pi around the z axis: x and y of positions and velocities flip, pi is added to the yaw
+        flip = np.array([-1, -1, 1], dtype=np.float32)
+        mirrored_ball = ball * np.tile(flip, 3)
+        mirrored_cars = library_cars.copy()
+        for start in (0, 6, 9):
+            mirrored_cars[..., start:start + 3] *= flip
+        mirrored_cars[..., 4] = (mirrored_cars[..., 4] + 2 * np.pi) % (2 * np.pi) - np.pi
+        mirrored_teams = np.where(teams >= 0, 1 - teams, -1).astype(np.int8)
+        ball = np.concatenate((ball, mirrored_ball))
+        library_cars = np.concatenate((library_cars, mirrored_cars))
+        teams = np.concatenate((teams, mirrored_teams))
+    return ball, library_cars, teams
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m training.match_recording")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info_parser = commands.add_parser("info", help="summary of recordings")
+    info_parser.add_argument("recordings", nargs="+")
+    states_parser = commands.add_parser("states", help="build a state library for TrainingStateSetter")
+    states_parser.add_argument("recordings", nargs="+")
+    states_parser.add_argument("--output", default="states.npz")
+    states_parser.add_argument("--every", type=float, default=1., help="seconds of game time between kept states")
+    states_parser.add_argument("--mirror", action="store_true", help="also add every state with the teams swapped")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        for path in args.recordings:
+            header, rows = read_recording(path)
+            latency = rows["latency"] * 1e3 if len(rows) else np.zeros(1)
+            print(f"{path}: {len(rows)} ticks, {np.ptp(rows['time']) if len(rows) else 0:.0f} s of game time, "
+                  f"latency p50 {np.percentile(latency, 50):.2f} ms p99 {np.percentile(latency, 99):.2f} ms "
+                  f"max {latency.max():.2f} ms, {json.dumps(header['metadata'])}")
+        return
+
+    libraries = [library_states(read_recording(path)[1], args.every, args.mirror) for path in args.recordings]
+    n_slots = max(cars.shape[1] for _, cars, _ in libraries)
+    ball = np.concatenate([ball for ball, _, _ in libraries])
+    # Recordings of different car counts are padded to the most cars
+    cars = np.concatenate([np.pad(cars, ((0, 0), (0, n_slots - cars.shape[1]), (0, 0))) for _, cars, _ in libraries])
+    teams = np.concatenate([np.pad(teams, ((0, 0), (0, n_slots - teams.shape[1])), constant_values=-1)
+                            for _, _, teams in libraries])
+    np.savez(args.output, ball=ball, cars=cars, teams=teams)
+    print(f"Wrote {len(ball)} states from {len(args.recordings)} recordings to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
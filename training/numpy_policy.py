@@ -0,0 +1,99 @@
+import os
+import pathlib
+
+import numpy as np
+
+
+# Activations applied in place on a layer's output buffer
+ACTIVATIONS = {
+    "tanh": lambda x: np.tanh(x, out=x),
+    "relu": lambda x: np.maximum(x, 0, out=x),
+    "identity": lambda x: x,
+}
+
+
+def _load_arrays(path):
+    # A directory holds one .npy per array (see training/weight_cache.py), mapped read-only instead of read, so
+    # processes loading the same directory share the weights' memory
+    if isinstance(path, (str, os.PathLike)) and os.path.isdir(path):
+        return {file.stem: np.load(file, mmap_mode="r") for file in pathlib.Path(path).glob("*.npy")}
+    with np.load(path) as artifact:
+        return {name: artifact[name] for name in artifact.files}
+
+
+class NumpyPolicy:
+    """
+    Runs the actor of an SB3 MlpPolicy exported with training/export_policy.py using only NumPy. Every layer writes
+    into a buffer allocated once, so predicting an action doesn't allocate and doesn't need torch or a GPU.
+
+    path is the exported .npz (or a file object), or a directory of .npy arrays written by training/weight_cache.py
+    whose weights are memory-mapped.
+    """
+
+    def __init__(self, path):
+        artifact = _load_arrays(path)
+        n_layers = int(artifact["n_layers"])
+        # No copy for memory-mapped arrays, they are float32 and contiguous already
+        self.weights = [np.ascontiguousarray(artifact[f"weight_{i}"], dtype=np.float32) for i in range(n_layers)]
+        self.biases = [np.ascontiguousarray(artifact[f"bias_{i}"], dtype=np.float32) for i in range(n_layers)]
+        activations = [str(name) for name in artifact["activations"]]
+        self.action_nvec = np.asarray(artifact["action_nvec"]).astype(np.int64)
+
+        for name in activations:
+            if name not in ACTIVATIONS:
+                raise ValueError("Unsupported activation {0}".format(name))
+        self._activations = [ACTIVATIONS[name] for name in activations]
+
+        self.observation_size = self.weights[0].shape[0]
+        self._obs = np.empty(self.observation_size, dtype=np.float32)
+        self._outputs = [np.empty(weight.shape[1], dtype=np.float32) for weight in self.weights]
+        self._action = np.empty(len(self.action_nvec), dtype=np.int64)
+        bounds = np.concatenate(([0], np.cumsum(self.action_nvec)))
+        self._action_slices = [slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+        if self._outputs[-1].size != bounds[-1]:
+            raise ValueError("Policy outputs {0} logits but the action space needs {1}".format(
+                self._outputs[-1].size, bounds[-1]))
+
+        self._rng = np.random.default_rng()
+
+    def logits(self, obs):
+        """
+        Action logits for a single observation, the returned array is reused by the next call.
+        """
+        np.copyto(self._obs, np.reshape(obs, -1), casting="same_kind")
+        x = self._obs
+        for weight, bias, activation, out in zip(self.weights, self.biases, self._activations, self._outputs):
+            np.matmul(x, weight, out=out)
+            out += bias
+            x = activation(out)
+        return x
+
+    def predict(self, obs, deterministic=True):
+        """
+        Same return value as PPO.predict for a MultiDiscrete action space, (action, None). The action array is reused
+        by the next call.
+        """
+        logits = self.logits(obs)
+        if not deterministic:
+            # Gumbel-max trick samples from the categorical distributions of the logits
+            logits = logits - np.log(-np.log(self._rng.random(logits.size)))
+        for i, action_slice in enumerate(self._action_slices):
+            self._action[i] = logits[action_slice].argmax()
+        return self._action, None
+
+    def predict_batch(self, obs, deterministic=True):
+        """
+        Actions for a (n, observation size) batch in one forward pass, returns ((n, actions) array, None).
+        """
+        x = np.asarray(obs, dtype=np.float32).reshape(-1, self.observation_size)
+        for weight, bias, activation in zip(self.weights, self.biases, self._activations):
+            x = x @ weight
+            x += bias
+            x = activation(x)
+        if not deterministic:
+            x -= np.log(-np.log(self._rng.random(x.shape)))
+        actions = np.empty((len(x), len(self.action_nvec)), dtype=np.int64)
+        for i, action_slice in enumerate(self._action_slices):
+            actions[:, i] = x[:, action_slice].argmax(axis=1)
+        return actions, None
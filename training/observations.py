@@ -6,18 +6,251 @@ from rlgym.utils.gamestates import PlayerData, GameState, PhysicsObject
 from rlgym.utils.obs_builders import ObsBuilder
 
 
+class _CarSlot:
+    """
+    Views into an observation buffer for the values of one car.
+    """
+
+    def __init__(self, buffer: np.ndarray, start: int, other: bool):
+        vectors = buffer[start:start + 27].reshape(9, 3)
+        (self.rel_pos, self.rel_vel, self.rel_attack, self.rel_defend, self.position,
+         self.forward, self.up, self.linear_velocity, self.angular_velocity) = vectors
+        self.flags = buffer[start + 27:start + 31]
+
+        # Position and velocity relative to the observing player, only for allies and enemies
+        if other:
+            self.rel_other_pos = buffer[start + 31:start + 34]
+            self.rel_other_vel = buffer[start + 34:start + 37]
+
+
+class _ObsLayout:
+    """
+    Slot offsets of an observation and the preallocated buffers they point into.
+    """
+
+    def __init__(self, n_actions: int, n_pads: int, n_allies: int, n_enemies: int, team=None, teams=()):
+        # The layout fits as long as the player's team and the teams of all players stay the same
+        self.team = team
+        self.teams = teams
+        self.pads_start = OswaldObservations.BALL_OBS_LENGTH + n_actions
+        self.self_start = self.pads_start + n_pads
+        self.allies_start = self.self_start + OswaldObservations.PLAYER_OBS_LENGTH
+        self.enemies_start = self.allies_start + n_allies * OswaldObservations.OTHER_OBS_LENGTH
+        self.size = self.enemies_start + n_enemies * OswaldObservations.OTHER_OBS_LENGTH
+
+        # Unnormalized values are written in float64, then normalized and cast into the float32 output at the end
+        self.scratch = np.zeros(self.size, dtype=np.float64)
+        self.out = np.zeros(self.size, dtype=np.float32)
+        self.scale = np.ones(self.size, dtype=np.float64)
+
+        self.ball_position, self.ball_linear_velocity, self.ball_angular_velocity = self.scratch[:9].reshape(3, 3)
+        self.previous_action = self.scratch[9:self.pads_start]
+        self.pads = self.scratch[self.pads_start:self.self_start]
+        self.player = _CarSlot(self.scratch, self.self_start, other=False)
+        self.allies = [_CarSlot(self.scratch, self.allies_start + i * OswaldObservations.OTHER_OBS_LENGTH, other=True)
+                       for i in range(n_allies)]
+        self.enemies = [_CarSlot(self.scratch, self.enemies_start + i * OswaldObservations.OTHER_OBS_LENGTH, other=True)
+                        for i in range(n_enemies)]
+
+        self.scale[:9] = OswaldObservations.BALL_SCALE
+        self.scale[self.self_start:self.allies_start] = OswaldObservations.CAR_SCALE
+        for i in range(n_allies + n_enemies):
+            start = self.allies_start + i * OswaldObservations.OTHER_OBS_LENGTH
+            self.scale[start:start + OswaldObservations.PLAYER_OBS_LENGTH] = OswaldObservations.CAR_SCALE
+            self.scale[start + OswaldObservations.PLAYER_OBS_LENGTH:start + OswaldObservations.OTHER_OBS_LENGTH] = \
+                OswaldObservations.POS_STD
+
+    def fits(self, player: PlayerData, state: GameState, previous_action: np.ndarray) -> bool:
+        # Compared in a loop rather than by building the teams tuple, which would allocate on every call
+        if player.team_num != self.team or len(state.players) != len(self.teams) or \
+                len(previous_action) != len(self.previous_action):
+            return False
+        i = 0
+        for other in state.players:
+            if other.team_num != self.teams[i]:
+                return False
+            i += 1
+        return True
+
+
+def fixed_slot_size(max_team_size: int, n_pads: int, n_actions: int = common_values.NUM_ACTIONS) -> int:
+    """
+    Length of an observation with fixed slots for max_team_size - 1 allies and max_team_size enemies.
+    """
+    n_slots = 2 * max_team_size - 1
+    return (OswaldObservations.BALL_OBS_LENGTH + n_actions + n_pads + OswaldObservations.PLAYER_OBS_LENGTH +
+            n_slots * (OswaldObservations.OTHER_OBS_LENGTH + 1))
+
+
+def fixed_slot_team_size(obs_size: int, n_pads: int = 34, n_actions: int = common_values.NUM_ACTIONS, limit: int = 8):
+    """
+    The max_team_size of fixed-slot observations of length obs_size, None if no team size gives that length (e.g.
+    the variable layout of a model trained without fixed slots).
+    """
+    for max_team_size in range(1, limit + 1):
+        if fixed_slot_size(max_team_size, n_pads, n_actions) == obs_size:
+            return max_team_size
+    return None
+
+
+def fixed_slot_indices(max_team_size: int, n_pads: int, n_allies: int, n_enemies: int,
+                       n_actions: int = common_values.NUM_ACTIONS) -> np.ndarray:
+    """
+    Position in the fixed-slot observation of every value of the variable layout with n_allies and n_enemies, so
+    fixed[indices] = obs scatters an observation into the slots and fixed[indices] gathers it back.
+    """
+    if n_allies > max_team_size - 1 or n_enemies > max_team_size:
+        raise ValueError("{0} allies and {1} enemies don't fit the slots of max_team_size {2}".format(
+            n_allies, n_enemies, max_team_size))
+    other = OswaldObservations.OTHER_OBS_LENGTH
+    allies_start = OswaldObservations.BALL_OBS_LENGTH + n_actions + n_pads + OswaldObservations.PLAYER_OBS_LENGTH
+    enemies_start = allies_start + (max_team_size - 1) * other
+    return np.concatenate([np.arange(allies_start + n_allies * other),
+                           np.arange(enemies_start, enemies_start + n_enemies * other)])
+
+
+def variable_layout(obs: np.ndarray, max_team_size: int, n_allies: int = 0, n_enemies: int = 1,
+                    n_actions: int = common_values.NUM_ACTIONS) -> np.ndarray:
+    """
+    Compatibility shim for models trained without fixed slots: the observation (or rows of observations) as
+    OswaldObservations(max_team_size=None) builds it with the first n_allies allies and n_enemies enemies, by default
+    the 1v1 layout. The number of boost pads is worked out from the observation's length.
+    """
+    n_pads = obs.shape[-1] - fixed_slot_size(max_team_size, 0, n_actions)
+    return obs[..., fixed_slot_indices(max_team_size, n_pads, n_allies, n_enemies, n_actions)]
+
+
 class OswaldObservations(ObsBuilder):
     # Normalization distances
-    POS_STD = 2300 
+    POS_STD = 2300
     ANG_STD = math.pi
 
-    def __init__(self):
+    # Orange players see the field mirrored through the x and y axes
+    INVERT = np.array([-1, -1, 1])
+
+    # Lengths of the observation blocks
+    BALL_OBS_LENGTH = 9
+    PLAYER_OBS_LENGTH = 31
+    OTHER_OBS_LENGTH = PLAYER_OBS_LENGTH + 6
+
+    # Divisors of each value in the ball and car blocks, forward and up vectors and the flags are not normalized
+    BALL_SCALE = np.repeat([POS_STD, POS_STD, ANG_STD], 3).astype(np.float64)
+    CAR_SCALE = np.concatenate([np.full(15, POS_STD), np.ones(6), np.full(3, POS_STD), np.full(3, ANG_STD),
+                                np.ones(4)])
+
+    def __init__(self, preallocate=False, batched=False, max_team_size=None):
+        """
+        :param preallocate: Write observations into a reusable float32 buffer per player instead of building a new
+        array every call. The returned array is overwritten by the next build_obs call for the same player. The only
+        temporaries left are the views PhysicsObject.forward() and up() return.
+        :param batched: Build the observations of every player at once with build_obs_batch in pre_step, build_obs
+        then returns the player's row.
+        :param max_team_size: Give every observation the same length whatever the team sizes, with slots for
+        max_team_size - 1 allies and max_team_size enemies. Slots without a car are zeros, and one value per slot
+        (allies then enemies, after the slots) is 1 when the slot holds a car. One policy can then play and be
+        trained in 1v1, 2v2 and 3v3 matches at once.
+        """
         super().__init__()
+        self.preallocate = preallocate
+        self.batched = batched
+        self.max_team_size = max_team_size
+        self._attack_goal = np.asarray(common_values.ORANGE_GOAL_BACK, dtype=np.float64)
+        self._defend_goal = np.asarray(common_values.BLUE_GOAL_BACK, dtype=np.float64)
+        self._layouts = {}
+
+        # Order of the other cars in each player's observation, keyed by the teams of the players
+        self._other_indices = {}
+        self._batch = None
+        self._batch_rows = {}
+        self._batch_state = None
+
+        # Where the values of the variable layout go in the fixed slots, keyed by the teams of the players
+        self._slot_maps = {}
+        self._slot_buffers = {}
 
     def reset(self, initial_state: GameState):
-        pass
+        self._layouts = {}
+        if self.preallocate:
+            for player in initial_state.players:
+                self._layouts[player.car_id] = self._build_layout(player, initial_state)
+        if self.batched:
+            self._get_other_indices(tuple(player.team_num for player in initial_state.players))
+        self._batch = None
+        self._batch_state = None
+
+    def pre_step(self, state: GameState):
+        if self.batched:
+            self._batch = self.build_obs_batch(state)
+            self._batch_rows = {player.car_id: i for i, player in enumerate(state.players)}
+            self._batch_state = state
+
+    def _build_layout(self, player: PlayerData, state: GameState) -> _ObsLayout:
+        n_allies = sum(1 for other in state.players if other.team_num == player.team_num) - 1
+        n_enemies = len(state.players) - 1 - n_allies
+        return _ObsLayout(common_values.NUM_ACTIONS, len(state.boost_pads), n_allies, n_enemies, player.team_num,
+                          tuple(other.team_num for other in state.players))
+
+    def _get_slot_map(self, teams, n_pads: int, n_actions: int):
+        """
+        For the players of teams: the fixed-slot observation with only the presence values set, per group of
+        players with the same number of allies and enemies their rows and fixed_slot_indices, and the
+        fixed_slot_indices of every player.
+        """
+        key = (teams, n_pads, n_actions)
+        slot_map = self._slot_maps.get(key)
+        if slot_map is None:
+            size = fixed_slot_size(self.max_team_size, n_pads, n_actions)
+            masks_start = size - (2 * self.max_team_size - 1)
+            template = np.zeros((len(teams), size))
+            groups = {}
+            for i, team in enumerate(teams):
+                n_allies = sum(1 for other in teams if other == team) - 1
+                n_enemies = len(teams) - 1 - n_allies
+                enemy_masks_start = masks_start + self.max_team_size - 1
+                template[i, masks_start:masks_start + n_allies] = 1
+                template[i, enemy_masks_start:enemy_masks_start + n_enemies] = 1
+                groups.setdefault((n_allies, n_enemies), []).append(i)
+            groups = [(np.array(rows), fixed_slot_indices(self.max_team_size, n_pads, n_allies, n_enemies, n_actions))
+                      for (n_allies, n_enemies), rows in groups.items()]
+            player_indices = [None] * len(teams)
+            for rows, indices in groups:
+                for i in rows:
+                    player_indices[i] = indices
+            slot_map = self._slot_maps[key] = (template, groups, player_indices)
+        return slot_map
+
+    def _to_fixed_slots(self, obs: np.ndarray, player: PlayerData, state: GameState, n_actions: int) -> np.ndarray:
+        teams = tuple(other.team_num for other in state.players)
+        template, _, player_indices = self._get_slot_map(teams, len(state.boost_pads), n_actions)
+        row = next(i for i, other in enumerate(state.players) if other.car_id == player.car_id)
+        indices = player_indices[row]
+
+        if self.preallocate:
+            fixed = self._slot_buffers.get(player.car_id)
+            if fixed is None or len(fixed) != template.shape[1]:
+                fixed = self._slot_buffers[player.car_id] = np.zeros(template.shape[1], dtype=np.float32)
+            fixed[:] = template[row]
+        else:
+            fixed = template[row].copy()
+        fixed[indices] = obs
+        return fixed
 
     def build_obs(self, player: PlayerData, state: GameState, previous_action: np.ndarray) -> Any:
+        if self.batched:
+            if state is not self._batch_state:
+                self.pre_step(state)
+            obs = self._batch[self._batch_rows[player.car_id]]
+            obs[self.BALL_OBS_LENGTH:self.BALL_OBS_LENGTH + len(previous_action)] = previous_action
+            return obs
+
+        obs = self._build_variable_obs(player, state, previous_action)
+        if self.max_team_size is not None:
+            return self._to_fixed_slots(obs, player, state, len(previous_action))
+        return obs
+
+    def _build_variable_obs(self, player: PlayerData, state: GameState, previous_action: np.ndarray) -> np.ndarray:
+        if self.preallocate:
+            return self._build_obs_into_buffer(player, state, previous_action)
 
         if player.team_num == common_values.ORANGE_TEAM:
             inverted = True
@@ -60,6 +293,160 @@ class OswaldObservations(ObsBuilder):
         obs.extend(enemies)
         return np.concatenate(obs)
 
+    def _get_other_indices(self, teams) -> np.ndarray:
+        other_indices = self._other_indices.get(teams)
+        if other_indices is None:
+            # Allies first, then enemies, each in the order of state.players
+            other_indices = np.array([
+                [j for j, team in enumerate(teams) if j != i and team == teams[i]] +
+                [j for j, team in enumerate(teams) if team != teams[i]]
+                for i in range(len(teams))
+            ], dtype=int).reshape(len(teams), len(teams) - 1)
+            self._other_indices[teams] = other_indices
+        return other_indices
+
+    def build_obs_batch(self, state: GameState, previous_actions: np.ndarray = None) -> np.ndarray:
+        """
+        Builds the observations of every player in state.players at once.
+
+        :param state: The current state of the game.
+        :param previous_actions: (n_players, n_actions) actions taken at the previous step, zeros if not given.
+        :return: (n_players, obs_dim) array, row i is build_obs for state.players[i]. With max_team_size, the
+        observations are scattered into their fixed slots with one assignment per number of allies and enemies.
+        """
+        players = state.players
+        n = len(players)
+        if previous_actions is None:
+            previous_actions = np.zeros((n, common_values.NUM_ACTIONS))
+
+        teams = tuple(player.team_num for player in players)
+        other_indices = self._get_other_indices(teams)
+
+        cars = np.array([(player.car_data.position, player.car_data.linear_velocity, player.car_data.angular_velocity,
+                          player.car_data.forward(), player.car_data.up()) for player in players],
+                        dtype=np.float64).reshape(n, 5, 3)
+        flags = np.array([[player.boost_amount, player.on_ground, player.has_flip, player.is_demoed]
+                          for player in players], dtype=np.float64).reshape(n, 4)
+        ball = np.array((state.ball.position, state.ball.linear_velocity, state.ball.angular_velocity), dtype=np.float64)
+
+        # Row i holds the sign flips of player i's point of view
+        orange = np.array(teams) == common_values.ORANGE_TEAM
+        sign = np.where(orange[:, None], self.INVERT, 1)
+        pads = np.where(orange[:, None], state.boost_pads[::-1], state.boost_pads)
+
+        # Ball and cars from the point of view of each player, cars are indexed [player, car]
+        view_ball = ball[None] * sign[:, None, :]
+        view_cars = cars[None] * sign[:, None, None, :]
+        view_position = view_cars[:, :, 0]
+        view_linear_velocity = view_cars[:, :, 1]
+
+        car_obs = np.concatenate([
+            view_ball[:, None, 0] - view_position,
+            view_ball[:, None, 1] - view_linear_velocity,
+            self._attack_goal - view_position,
+            self._defend_goal - view_position,
+            view_position,
+            view_cars[:, :, 3],
+            view_cars[:, :, 4],
+            view_linear_velocity,
+            view_cars[:, :, 2],
+            np.repeat(flags[None], n, axis=0),
+        ], axis=2) / self.CAR_SCALE
+
+        # Other cars relative to the player, as position and velocity differences
+        rows = np.arange(n)
+        viewers = rows[:, None]
+        relative = (view_cars[viewers, other_indices, :2] - view_cars[rows, rows, None, :2]) / self.POS_STD
+        others = np.concatenate([car_obs[viewers, other_indices], relative.reshape(n, n - 1, 6)], axis=2)
+
+        obs = np.concatenate([
+            view_ball.reshape(n, 9) / self.BALL_SCALE,
+            previous_actions,
+            pads,
+            car_obs[rows, rows],
+            others.reshape(n, -1),
+        ], axis=1)
+        if self.max_team_size is None:
+            return obs
+
+        template, groups, _ = self._get_slot_map(teams, len(state.boost_pads), previous_actions.shape[1])
+        fixed = template.copy()
+        for group_rows, indices in groups:
+            fixed[group_rows[:, None], indices] = obs[group_rows]
+        return fixed
+
+    def _build_obs_into_buffer(self, player: PlayerData, state: GameState, previous_action: np.ndarray) -> np.ndarray:
+        layout = self._layouts.get(player.car_id)
+        if layout is None or not layout.fits(player, state, previous_action):
+            # Players or teams changed since reset (or reset was never called, as in the RLBot bot)
+            layout = self._layouts[player.car_id] = self._build_layout(player, state)
+
+        if player.team_num == common_values.ORANGE_TEAM:
+            inverted = True
+            ball = state.inverted_ball
+            pads = state.inverted_boost_pads
+        else:
+            inverted = False
+            ball = state.ball
+            pads = state.boost_pads
+
+        layout.ball_position[:] = ball.position
+        layout.ball_linear_velocity[:] = ball.linear_velocity
+        layout.ball_angular_velocity[:] = ball.angular_velocity
+        layout.previous_action[:] = previous_action
+        layout.pads[:] = pads
+
+        player_car = self._write_player(layout.player, player, ball, inverted)
+
+        n_allies = 0
+        n_enemies = 0
+        for other in state.players:
+            if other.car_id == player.car_id:
+                continue
+
+            if other.team_num == player.team_num:
+                slot = layout.allies[n_allies]
+                n_allies += 1
+            else:
+                slot = layout.enemies[n_enemies]
+                n_enemies += 1
+
+            other_car = self._write_player(slot, other, ball, inverted)
+
+            # Extra info
+            np.subtract(other_car.position, player_car.position, out=slot.rel_other_pos)
+            np.subtract(other_car.linear_velocity, player_car.linear_velocity, out=slot.rel_other_vel)
+
+        # Every value is rewritten above, so the scratch buffer can be normalized in place
+        np.divide(layout.scratch, layout.scale, out=layout.scratch)
+        np.copyto(layout.out, layout.scratch, casting="same_kind")
+        return layout.out
+
+    def _write_player(self, slot: _CarSlot, player: PlayerData, ball: PhysicsObject, inverted: bool):
+        if inverted:
+            player_car = player.inverted_car_data
+        else:
+            player_car = player.car_data
+
+        # Same values as _add_player_to_obs before normalization
+        np.subtract(ball.position, player_car.position, out=slot.rel_pos)
+        np.subtract(ball.linear_velocity, player_car.linear_velocity, out=slot.rel_vel)
+        np.subtract(self._attack_goal, player_car.position, out=slot.rel_attack)
+        np.subtract(self._defend_goal, player_car.position, out=slot.rel_defend)
+        slot.position[:] = player_car.position
+        slot.forward[:] = player_car.forward()
+        slot.up[:] = player_car.up()
+        slot.linear_velocity[:] = player_car.linear_velocity
+        slot.angular_velocity[:] = player_car.angular_velocity
+
+        flags = slot.flags
+        flags[0] = player.boost_amount
+        flags[1] = player.on_ground
+        flags[2] = player.has_flip
+        flags[3] = player.is_demoed
+
+        return player_car
+
     def _add_player_to_obs(self, obs: List, player: PlayerData, ball: PhysicsObject, inverted: bool):
         if inverted:
             player_car = player.inverted_car_data
@@ -91,4 +478,4 @@ class OswaldObservations(ObsBuilder):
              int(player.has_flip),
              int(player.is_demoed)]])
 
-        return player_car
\ No newline at end of file
+        return player_car
@@ -0,0 +1,284 @@
+"""
+Opponent league: the orange cars of every match are played by frozen snapshots of past policies instead of the
+policy being trained.
+
+Snapshots are the policy networks of checkpoints exported with training/export_policy.py into the league directory,
+and are run with NumpyPolicy on the CPU. Only the most recently used ones are kept loaded, up to max_resident_bytes.
+LeagueVecEnv hides the orange agents from the learner. Every step it groups them by the snapshot they play, so the
+opponents of all instances cost one batched forward pass per distinct snapshot, and at the end of each episode it
+records the result and matches the blue team against a new opponent. Opponents are drawn with weights favouring
+win rates near 50%.
+"""
+import json
+import os
+import pathlib
+from collections import OrderedDict
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import VecEnvWrapper
+
+from training.export_policy import export_policy, load_checkpoint
+from training.numpy_policy import NumpyPolicy
+
+INDEX_FILE = "league.json"
+
+
+class SnapshotCache:
+    """
+    Least recently used NumpyPolicy snapshots, evicted once their weights take more than max_bytes. The snapshot
+    just requested is always kept.
+    """
+
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.policies = OrderedDict()
+        self.bytes = 0
+        self.loads = 0
+
+    @staticmethod
+    def _size(policy):
+        return sum(array.nbytes for array in policy.weights + policy.biases)
+
+    def get(self, name, path):
+        policy = self.policies.get(name)
+        if policy is not None:
+            self.policies.move_to_end(name)
+            return policy
+
+        policy = NumpyPolicy(path)
+        self.loads += 1
+        self.policies[name] = policy
+        self.bytes += self._size(policy)
+        while self.bytes > self.max_bytes and len(self.policies) > 1:
+            _, evicted = self.policies.popitem(last=False)
+            self.bytes -= self._size(evicted)
+        return policy
+
+    def discard(self, name):
+        policy = self.policies.pop(name, None)
+        if policy is not None:
+            self.bytes -= self._size(policy)
+
+
+class OpponentLeague:
+    """
+    The snapshots opponents are drawn from and the results against them, kept in directory (league.json and one
+    .npz per snapshot) so a restarted run continues with the same league. Past max_snapshots, the oldest snapshot
+    that isn't pinned is retired.
+
+    An opponent is drawn with weight p * (1 - p) + min_weight, p being the learner's smoothed win rate against it,
+    so new opponents and those it beats about half the time are played most.
+    """
+
+    def __init__(self, directory, observation_size, max_snapshots=50, max_resident_bytes=256 * 2 ** 20,
+                 min_weight=0.01, seed=None):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.observation_size = observation_size
+        self.max_snapshots = max_snapshots
+        self.min_weight = min_weight
+        self.cache = SnapshotCache(max_resident_bytes)
+        self.rng = np.random.default_rng(seed)
+
+        # name -> {"file", "pinned", "wins", "losses", "draws"}, in the order the snapshots were added
+        self.snapshots = OrderedDict()
+        index_path = self.directory / INDEX_FILE
+        if index_path.exists():
+            with open(index_path) as f:
+                self.snapshots.update(json.load(f)["snapshots"])
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def add_model(self, model, name, pinned=False):
+        """
+        Exports the policy of a PPO model as snapshot name.
+        """
+        if model.observation_space.shape != (self.observation_size,):
+            raise ValueError("Snapshot {0} observes {1} values, the league's matches {2}".format(
+                name, model.observation_space.shape, self.observation_size))
+        file = f"{name}.npz"
+        export_policy(model, self.directory / file)
+        self.cache.discard(name)
+        stats = self.snapshots.pop(name, {"wins": 0, "losses": 0, "draws": 0})
+        stats.update(file=file, pinned=pinned)
+        self.snapshots[name] = stats
+        self._retire()
+
+    def add_checkpoint(self, path, name=None, pinned=False):
+        """
+        Exports the policy of a PPO checkpoint (.zip), named after the file by default.
+        """
+        self.add_model(load_checkpoint(path), name or pathlib.Path(path).stem, pinned)
+
+    def _retire(self):
+        while len(self.snapshots) > self.max_snapshots:
+            name = next((name for name, stats in self.snapshots.items() if not stats["pinned"]), None)
+            if name is None:
+                return
+            stats = self.snapshots.pop(name)
+            self.cache.discard(name)
+            try:
+                os.remove(self.directory / stats["file"])
+            except OSError:
+                pass
+
+    def policy(self, name):
+        return self.cache.get(name, self.directory / self.snapshots[name]["file"])
+
+    def win_rates(self):
+        """
+        {name: (win rate, games)}, draws count as half a win.
+        """
+        rates = {}
+        for name, stats in self.snapshots.items():
+            games = stats["wins"] + stats["losses"] + stats["draws"]
+            rates[name] = ((stats["wins"] + 0.5 * stats["draws"]) / games if games else float("nan"), games)
+        return rates
+
+    def choose(self, n=1):
+        """
+        Draws the opponents of n matches.
+        """
+        if not self.snapshots:
+            raise ValueError("The league has no snapshots to play against")
+        names = list(self.snapshots)
+        stats = self.snapshots.values()
+        score = np.array([s["wins"] + 0.5 * s["draws"] for s in stats])
+        games = np.array([s["wins"] + s["losses"] + s["draws"] for s in stats])
+        # Win rate with a uniform prior, unplayed opponents count as even
+        p = (score + 1) / (games + 2)
+        weights = p * (1 - p) + self.min_weight
+        return [names[i] for i in self.rng.choice(len(names), n, p=weights / weights.sum())]
+
+    def record(self, name, result):
+        """
+        Records a finished match against name, result is the learner's goal difference.
+        """
+        stats = self.snapshots.get(name)
+        if stats is None:
+            # Retired during the match
+            return
+        stats["wins" if result > 0 else "losses" if result < 0 else "draws"] += 1
+
+    def save(self):
+        path = self.directory / INDEX_FILE
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"snapshots": self.snapshots}, f, indent=1)
+        os.replace(tmp_path, path)
+
+
+class LeagueVecEnv(VecEnvWrapper):
+    """
+    Shows the learner only the blue agents of venv's matches and plays the orange ones with the league's snapshots.
+    venv's agents are its matches' players in order, 2 * team_size per match with the blue team first, like rlgym
+    and SimulatedVecEnv lay them out.
+
+    At the end of an episode the infos of the match's blue agents get "opponent" set to the snapshot it played
+    against, and its result is read from rlgym's "result" info (blue goal difference).
+    """
+
+    def __init__(self, venv, league: OpponentLeague, team_size=1, deterministic=False):
+        super().__init__(venv)
+        self.league = league
+        self.team_size = team_size
+        self.deterministic = deterministic
+
+        match_size = 2 * team_size
+        if venv.num_envs % match_size:
+            raise ValueError("{0} agents can't be split into matches of {1}".format(venv.num_envs, match_size))
+        self.n_matches = venv.num_envs // match_size
+        agents = np.arange(venv.num_envs).reshape(self.n_matches, 2, team_size)
+        self.learner_agents = agents[:, 0].ravel()
+        self.opponent_agents = agents[:, 1].ravel()
+        self.num_envs = len(self.learner_agents)
+
+        self.opponents = [None] * self.n_matches
+        self._opponent_obs = None
+        self._actions = None
+
+    def _assign(self, matches):
+        for match, name in zip(matches, self.league.choose(len(matches))):
+            self.opponents[match] = name
+
+    def reset(self):
+        obs = self.venv.reset()
+        self._assign(range(self.n_matches))
+        self._opponent_obs = obs[self.opponent_agents]
+        return obs[self.learner_agents]
+
+    def _opponent_actions(self):
+        # One forward pass per snapshot for all the opponent cars it plays
+        actions = np.empty((len(self.opponent_agents),) + self.action_space.shape, dtype=np.int64)
+        match_of_agent = np.repeat(np.arange(self.n_matches), self.team_size)
+        opponents = np.array(self.opponents)[match_of_agent]
+        for name in set(self.opponents):
+            rows = np.flatnonzero(opponents == name)
+            actions[rows] = self.league.policy(name).predict_batch(self._opponent_obs[rows], self.deterministic)[0]
+        return actions
+
+    def step_async(self, actions):
+        if self._actions is None:
+            self._actions = np.zeros((self.venv.num_envs,) + np.shape(actions)[1:], dtype=np.asarray(actions).dtype)
+        self._actions[self.learner_agents] = actions
+        self._actions[self.opponent_agents] = self._opponent_actions()
+        self.venv.step_async(self._actions)
+
+    def step_wait(self):
+        obs, rewards, dones, infos = self.venv.step_wait()
+        learner_infos = [infos[i] for i in self.learner_agents]
+        finished = np.flatnonzero(dones[self.learner_agents[::self.team_size]])
+        for match in finished:
+            first = match * self.team_size
+            result = learner_infos[first].get("result")
+            if result is not None:
+                self.league.record(self.opponents[match], result)
+            for i in range(first, first + self.team_size):
+                learner_infos[i] = dict(learner_infos[i], opponent=self.opponents[match])
+        if len(finished):
+            self._assign(finished)
+        self._opponent_obs = obs[self.opponent_agents]
+        return obs[self.learner_agents], rewards[self.learner_agents], dones[self.learner_agents], learner_infos
+
+    def _venv_indices(self, indices):
+        return [int(self.learner_agents[i]) for i in self._get_indices(indices)]
+
+    def get_attr(self, attr_name, indices=None):
+        return self.venv.get_attr(attr_name, self._venv_indices(indices))
+
+    def set_attr(self, attr_name, value, indices=None):
+        return self.venv.set_attr(attr_name, value, self._venv_indices(indices))
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self.venv.env_method(method_name, *method_args, indices=self._venv_indices(indices), **method_kwargs)
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return self.venv.env_is_wrapped(wrapper_class, self._venv_indices(indices))
+
+
+class LeagueCallback(BaseCallback):
+    """
+    Adds a snapshot of the model to the league every add_freq steps and logs the league after each rollout: win rate
+    and games against every snapshot under league/<name>/, and the number of snapshots and loaded ones.
+    """
+
+    def __init__(self, league: OpponentLeague, add_freq, name_prefix="snapshot", verbose=0):
+        super().__init__(verbose)
+        self.league = league
+        self.add_freq = add_freq
+        self.name_prefix = name_prefix
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.add_freq == 0:
+            self.league.add_model(self.model, f"{self.name_prefix}_{self.num_timesteps}")
+        return True
+
+    def _on_rollout_end(self) -> None:
+        for name, (win_rate, games) in self.league.win_rates().items():
+            self.logger.record(f"league/{name}/win_rate", win_rate, exclude="stdout")
+            self.logger.record(f"league/{name}/games", games, exclude="stdout")
+        self.logger.record("league/snapshots", len(self.league))
+        self.logger.record("league/loaded", len(self.league.cache.policies))
+        self.league.save()
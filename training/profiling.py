@@ -0,0 +1,288 @@
+"""
+Timers for the training hot paths, aggregated into histograms and logged to tensorboard by ProfilingCallback.
+
+Timers are installed by replacing methods of the profiled objects with timed wrappers (instrument_match,
+instrument_model), so nothing is timed and nothing costs anything while profiling is off. Every process aggregates
+into its own PROFILER, the callback also collects the ones of SharedMemoryVecEnv's worker processes.
+
+StackSampler records the Python stacks of the learner process for a time window in the collapsed format read by
+flamegraph.pl and speedscope.
+"""
+import collections
+import functools
+import math
+import sys
+import threading
+import time
+
+from stable_baselines3.common.callbacks import BaseCallback
+
+# Histogram bins, 8 per decade from 100 ns up to 100 s
+BINS_PER_DECADE = 8
+MIN_EXPONENT = -7
+N_BINS = 9 * BINS_PER_DECADE
+
+
+class TimerStats:
+    """
+    Calls, total, max and log-spaced histogram of the durations recorded by one timer.
+    """
+    __slots__ = ("count", "total", "max", "bins")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.bins = [0] * N_BINS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        i = int((math.log10(seconds) - MIN_EXPONENT) * BINS_PER_DECADE) if seconds > 0 else 0
+        self.bins[min(max(i, 0), N_BINS - 1)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.bins = [a + b for a, b in zip(self.bins, other.bins)]
+
+    def percentile(self, q):
+        """
+        Upper edge of the histogram bin holding the q-th percentile, in seconds.
+        """
+        target = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.bins):
+            seen += n
+            if seen >= target and n:
+                return min(10 ** (MIN_EXPONENT + (i + 1) / BINS_PER_DECADE), self.max)
+        return self.max
+
+    def __getstate__(self):
+        return self.count, self.total, self.max, self.bins
+
+    def __setstate__(self, state):
+        self.count, self.total, self.max, self.bins = state
+
+
+class Profiler:
+    def __init__(self):
+        self.stats = collections.defaultdict(TimerStats)
+
+    def record(self, name, seconds):
+        self.stats[name].add(seconds)
+
+    def wrap(self, function, name):
+        """
+        Returns function timed as name.
+        """
+        stats = self.stats[name]
+        perf_counter = time.perf_counter
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats.add(perf_counter() - start)
+        timed.profiled = True
+        return timed
+
+    def instrument(self, obj, attribute, name):
+        """
+        Replaces the method obj.attribute by a timed wrapper, methods that are already timed are left alone.
+        """
+        method = getattr(obj, attribute, None)
+        if method is None or getattr(method, "profiled", False):
+            return
+        setattr(obj, attribute, self.wrap(method, name))
+
+    def collect(self, reset=True):
+        """
+        Returns a copy of the stats of every timer, {name: TimerStats}, and zeroes them if reset is set.
+        """
+        collected = {}
+        # Wrappers hold on to their TimerStats, so they are copied and zeroed in place instead of replaced
+        for name, stats in self.stats.items():
+            collected[name] = TimerStats()
+            collected[name].merge(stats)
+            if reset:
+                stats.reset()
+        return collected
+
+
+PROFILER = Profiler()
+
+
+def collect_profile():
+    """
+    Stats of this process's PROFILER, run in worker processes by ProfilingCallback.
+    """
+    return PROFILER.collect()
+
+
+def instrument_match(match, profiler=PROFILER):
+    """
+    Times the observation builder, reward functions and state setter of an RLGym Match.
+    """
+    obs_builder = match._obs_builder
+    for attribute in ("pre_step", "build_obs", "build_obs_batch"):
+        profiler.instrument(obs_builder, attribute, f"observations/{attribute}")
+
+    reward_function = match._reward_fn
+    name = type(reward_function).__name__
+    profiler.instrument(reward_function, "pre_step", f"rewards/{name}.pre_step")
+    profiler.instrument(reward_function, "get_reward", f"rewards/{name}.get_reward")
+    for func in getattr(reward_function, "reward_functions", ()):
+        profiler.instrument(func, "get_reward", f"rewards/{type(func).__name__}")
+    # BatchedCombinedReward computes its components with one kernel per reward function instead of get_reward
+    kernels = getattr(reward_function, "_kernels", None)
+    if kernels is not None:
+        reward_function._kernels = [profiler.wrap(kernel, f"rewards/{type(func).__name__}")
+                                    for kernel, func in zip(kernels, reward_function.reward_functions)]
+
+    profiler.instrument(match._state_setter, "reset", "state_setter/reset")
+    return match
+
+
+def instrument_model(model, profiler=PROFILER):
+    """
+    Times env steps, policy forward passes and the phases of PPO's update. The model itself isn't instrumented,
+    model.save() would pickle the wrappers, ProfilingCallback times collect_rollouts and train from its hooks instead.
+    """
+    profiler.instrument(model.env, "step", "env/step")
+    profiler.instrument(model.policy, "forward", "policy/forward")
+    profiler.instrument(model.policy, "evaluate_actions", "ppo/evaluate_actions")
+    profiler.instrument(model.policy.optimizer, "step", "ppo/optimizer_step")
+    profiler.instrument(model.rollout_buffer, "compute_returns_and_advantage", "ppo/compute_returns")
+    return model
+
+
+def _workers_of(env):
+    # The innermost env, through VecEnvWrappers, that can run functions in its worker processes
+    while not hasattr(env, "run_in_workers") and hasattr(env, "venv"):
+        env = env.venv
+    return env if hasattr(env, "run_in_workers") else None
+
+
+class StackSampler:
+    """
+    Samples the stacks of every other thread of the process every interval seconds and counts them in the collapsed
+    format: one line per distinct stack, "thread;outer function;...;inner function count".
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.counts[";".join(reversed(stack))] += 1
+
+
+class ProfilingCallback(BaseCallback):
+    """
+    Instruments the model when training starts and logs every timer after each rollout under profile/<timer>/:
+    mean, p50, p99 and max in microseconds, calls, and share of the wall-clock time since the previous rollout.
+    Timers of SharedMemoryVecEnv workers are summed over the workers, so their share can pass 1.
+
+    With stack_path set, the stacks of the learner process are sampled for stack_sample_seconds, starting
+    stack_sample_delay seconds into training, and written to stack_path.
+    """
+
+    def __init__(self, profiler=PROFILER, stack_path=None, stack_sample_seconds=30, stack_sample_delay=60,
+                 verbose=0):
+        super().__init__(verbose)
+        self.profiler = profiler
+        self.stack_path = stack_path
+        self.stack_sample_seconds = stack_sample_seconds
+        self.stack_sample_delay = stack_sample_delay
+        self._sampler = None
+        self._start_time = None
+        self._last_flush = None
+        self._rollout_start = None
+        self._rollout_end = None
+
+    def _on_training_start(self) -> None:
+        instrument_model(self.model, self.profiler)
+        self._start_time = self._last_flush = time.perf_counter()
+        self._rollout_start = self._rollout_end = None
+
+    def _on_rollout_start(self) -> None:
+        now = time.perf_counter()
+        if self._rollout_end is not None:
+            # From the end of the previous rollout, the update and the logger dump
+            self.profiler.record("ppo/train", now - self._rollout_end)
+        self._rollout_start = now
+
+    def _on_step(self) -> bool:
+        if self.stack_path is None:
+            return True
+        elapsed = time.perf_counter() - self._start_time
+        if self._sampler is None and elapsed > self.stack_sample_delay:
+            self._sampler = StackSampler()
+            self._sampler.start()
+        elif self._sampler is not None and elapsed > self.stack_sample_delay + self.stack_sample_seconds:
+            self._sampler.stop()
+            self._sampler.write(self.stack_path)
+            if self.verbose >= 1:
+                print(f"Wrote sampled stacks to {self.stack_path}")
+            self.stack_path = None
+        return True
+
+    def _on_rollout_end(self) -> None:
+        self._rollout_end = time.perf_counter()
+        self.profiler.record("ppo/collect_rollouts", self._rollout_end - self._rollout_start)
+        stats = self.profiler.collect()
+        workers = _workers_of(self.training_env)
+        if workers is not None:
+            for worker_stats in workers.run_in_workers(collect_profile):
+                for name, timer in worker_stats.items():
+                    stats.setdefault(name, TimerStats()).merge(timer)
+
+        now = time.perf_counter()
+        elapsed = now - self._last_flush
+        self._last_flush = now
+        for name, timer in sorted(stats.items()):
+            if timer.count == 0:
+                continue
+            self.logger.record(f"profile/{name}/mean_us", timer.total / timer.count * 1e6, exclude="stdout")
+            self.logger.record(f"profile/{name}/p50_us", timer.percentile(50) * 1e6, exclude="stdout")
+            self.logger.record(f"profile/{name}/p99_us", timer.percentile(99) * 1e6, exclude="stdout")
+            self.logger.record(f"profile/{name}/max_us", timer.max * 1e6, exclude="stdout")
+            self.logger.record(f"profile/{name}/calls", timer.count, exclude="stdout")
+            self.logger.record(f"profile/{name}/share", timer.total / elapsed, exclude="stdout")
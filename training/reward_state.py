@@ -0,0 +1,101 @@
+import numpy as np
+from rlgym.utils.common_values import BLUE_TEAM
+from rlgym.utils.gamestates import GameState, PlayerData
+
+
+# Columns of RewardStateStore.values, the event columns are in the order of OswaldRewardFunction's weights
+STATE_COLUMNS = ("goals", "conceded", "touched", "shots", "saves", "demos", "boost", "ball_speed")
+EVENT_COLUMNS = STATE_COLUMNS[:7]
+EVENTS = slice(0, len(EVENT_COLUMNS))
+TOUCHED = EVENT_COLUMNS.index("touched")
+BALL_SPEED = STATE_COLUMNS.index("ball_speed")
+
+
+def write_player_events(player: PlayerData, state: GameState, out):
+    """
+    Writes the player's values of the event columns into out without allocating.
+    """
+    opponent = state.orange_score if player.team_num == BLUE_TEAM else state.blue_score
+    out[0] = player.match_goals
+    out[1] = opponent
+    out[2] = player.ball_touched
+    out[3] = player.match_shots
+    out[4] = player.match_saves
+    out[5] = player.match_demolishes
+    out[6] = player.boost_amount
+    return out
+
+
+def player_events(player: PlayerData, state: GameState):
+    """
+    The player's values of the event columns as a tuple, like write_player_events writes them.
+    """
+    opponent = state.orange_score if player.team_num == BLUE_TEAM else state.blue_score
+    return (player.match_goals, opponent, player.ball_touched, player.match_shots, player.match_saves,
+            player.match_demolishes, player.boost_amount)
+
+
+class RewardStateStore:
+    """
+    Per-match state of the stateful reward functions, one row of values per car with a column per tracked value.
+    A single store can be shared by several reward functions as each one only updates its own columns.
+    """
+
+    def __init__(self, max_cars=8):
+        self.values = np.zeros((max_cars, len(STATE_COLUMNS)))
+        self.rows = {}
+        self._deltas = np.zeros(len(EVENT_COLUMNS))
+
+    def reset(self, initial_state: GameState):
+        self.values[:] = 0
+        self.rows = {}
+        ball_speed = np.linalg.norm(initial_state.ball.linear_velocity)
+        for player in initial_state.players:
+            row = self.row(player.car_id)
+            write_player_events(player, initial_state, self.values[row, EVENTS])
+            self.values[row, BALL_SPEED] = ball_speed
+
+    def row(self, car_id):
+        row = self.rows.get(car_id)
+        if row is None:
+            row = len(self.rows)
+            if row == len(self.values):
+                self.values = np.concatenate((self.values, np.zeros_like(self.values)))
+            self.rows[car_id] = row
+        return row
+
+    def event_deltas(self, rows, events):
+        """
+        Stores the new event values for rows and returns how much each one went up since the last call. Touches are
+        a flag rather than a counter, so a touch counts on every step it is set. rows can be a single row with 1-D
+        events, the returned array is then reused by the next call.
+        """
+        if isinstance(rows, (int, np.integer)):
+            previous = self.values[rows, EVENTS]
+            deltas = np.subtract(events, previous, out=self._deltas)
+            np.maximum(deltas, 0, out=deltas)
+            deltas[TOUCHED] = events[TOUCHED]
+            previous[:] = events
+            return deltas
+
+        deltas = np.maximum(events - self.values[rows, EVENTS], 0)
+        deltas[:, TOUCHED] = events[:, TOUCHED]
+        self.values[rows, EVENTS] = events
+        return deltas
+
+    def ball_speed_gain(self, rows, ball_speed):
+        """
+        Stores the ball speed seen by rows and returns how much it went up since their last call.
+        """
+        if isinstance(rows, (int, np.integer)):
+            gain = max(ball_speed - self.values.item(rows, BALL_SPEED), 0.)
+        else:
+            gain = np.maximum(ball_speed - self.values[rows, BALL_SPEED], 0)
+        self.values[rows, BALL_SPEED] = ball_speed
+        return gain
+
+    def snapshot(self):
+        """
+        Copy of the stored values as {car_id: {column: value}}, for debugging.
+        """
+        return {car_id: dict(zip(STATE_COLUMNS, self.values[row].tolist())) for car_id, row in self.rows.items()}
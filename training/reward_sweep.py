@@ -0,0 +1,359 @@
+"""
+Re-evaluates the reward functions offline over trajectories recorded by TrajectoryRecorder and sweeps reward weights.
+
+    python -m training.reward_sweep trajectories/test
+    python -m training.reward_sweep trajectories/test --grid PlayerVelocityReward=0.001,0.005,0.01 \\
+        --grid goals=5,10,20 --workers 8 --output sweep.json
+
+Rewards are split into columns: one per reward function, except OswaldRewardFunction which gets one per event
+(goals, conceded, ...) so its event weights can be swept too. Grid values replace the CombinedReward weight of a
+reward function, or the OswaldRewardFunction weight of an event.
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import tempfile
+
+import numpy as np
+from rlgym.utils.common_values import BLUE_TEAM
+from rlgym.utils.gamestates import GameState
+
+from training.batched_rewards import PlayerArrays, player_to_ball_reward, hit_speed_reward, airdribble_reward, \
+    ball_to_goal_reward, player_velocity_reward
+from training.reward_state import EVENT_COLUMNS, TOUCHED
+from training.rewards import OswaldRewardFunction, PlayerToBallRewardFunction, HitSpeedRewardFunction, \
+    AirdribbleRewardFunction, BallToGoalRewardFunction, PlayerVelocityReward
+from training.trajectory_recorder import TrajectoryReader
+
+# Offsets in the plugin state format
+BALL = 3 + GameState.BOOST_PADS_LENGTH
+PLAYERS = BALL + GameState.BALL_STATE_LENGTH
+# Offsets in a player's block, the tertiary values are goals, saves, shots, demos, pickups, demoed, on ground,
+# touched, has jump, has flip and boost
+CAR_POSITION = 2
+CAR_LINEAR_VELOCITY = 9
+TERTIARY = 28
+TERTIARY_EVENTS = {"goals": 0, "touched": 7, "shots": 2, "saves": 1, "demos": 3, "boost": 10}
+
+# Percentiles reported for every column
+PERCENTILES = (1, 50, 99)
+
+
+def default_rewards():
+    # Same rewards and weights as main.py
+    reward_functions = (
+        PlayerToBallRewardFunction(),
+        HitSpeedRewardFunction(reward_weight=5),
+        AirdribbleRewardFunction(reward_weight=3),
+        BallToGoalRewardFunction(reward_weight=5),
+        PlayerVelocityReward(),
+        OswaldRewardFunction(goal_weight=10, concede_weight=-10, touch_weight=1, shot_weight=5, save_weight=5,
+                             boost_pickup_weight=0.1),
+    )
+    return reward_functions, (1, 1, 1, 1, 0.005, 1)
+
+
+def gamma_from_half_life(half_life_seconds=5, frame_skip=8):
+    # Same discount factor as main.py
+    fps = 120 / frame_skip
+    return np.exp(np.log(0.5) / (fps * half_life_seconds))
+
+
+class Rollouts:
+    """
+    Recorded episodes concatenated into flat arrays, one row per step of one agent.
+    """
+
+    def __init__(self, states, players, episode_ids, rewards, components):
+        self.states = states
+        self.players = players.astype(np.int64)
+        self.episode_ids = episode_ids
+        self.rewards = rewards
+        self.components = components
+
+        self.episode_starts = np.ones(len(states), dtype=bool)
+        self.episode_starts[1:] = episode_ids[1:] != episode_ids[:-1]
+        starts = np.flatnonzero(self.episode_starts)
+        self.steps = np.arange(len(states)) - np.repeat(starts, np.diff(np.append(starts, len(states))))
+        self.n_episodes = int(episode_ids.max()) + 1 if len(episode_ids) else 0
+
+    @classmethod
+    def load(cls, directory, max_episodes=None, complete_only=True):
+        reader = TrajectoryReader(directory)
+        episodes = [i for i, e in enumerate(reader.episodes) if e["complete"] or not complete_only][:max_episodes]
+        if not episodes:
+            raise ValueError("No episodes recorded in {0}".format(directory))
+
+        rows = [reader.episode(i) for i in episodes]
+        episode_ids = np.repeat(np.arange(len(rows)), [len(r) for r in rows])
+        return cls(np.concatenate([r["state"] for r in rows]).astype(np.float64),
+                   np.concatenate([r["player"] for r in rows]), episode_ids,
+                   np.concatenate([r["reward"] for r in rows]), np.concatenate([r["components"] for r in rows]))
+
+    def _player_columns(self, start, width=1):
+        offsets = PLAYERS + self.players * GameState.PLAYER_INFO_LENGTH + start
+        return self.states[np.arange(len(self.states))[:, None], offsets[:, None] + np.arange(width)]
+
+    def player_arrays(self):
+        tertiary = self._player_columns(TERTIARY, GameState.PLAYER_TERTIARY_INFO_LENGTH)
+        team = self._player_columns(1)[:, 0].astype(int)
+        conceded = np.where(team == BLUE_TEAM, self.states[:, 2], self.states[:, 1])
+        events = np.column_stack([conceded if name == "conceded" else tertiary[:, TERTIARY_EVENTS[name]]
+                                  for name in EVENT_COLUMNS])
+        return PlayerArrays(self._player_columns(CAR_POSITION, 3), self._player_columns(CAR_LINEAR_VELOCITY, 3),
+                            self.states[:, BALL:BALL + 3], self.states[:, BALL + 3:BALL + 6], team, events,
+                            self._player_columns(0)[:, 0].astype(int))
+
+    def goal_difference(self):
+        """
+        Goals scored minus goals conceded by each episode's agent over the episode.
+        """
+        arrays = self.player_arrays()
+        scored = np.where(arrays.team == BLUE_TEAM, self.states[:, 1], self.states[:, 2])
+        difference = scored - arrays.events[:, EVENT_COLUMNS.index("conceded")]
+        ends = np.append(np.flatnonzero(self.episode_starts)[1:], len(difference)) - 1
+        return difference[ends] - difference[self.episode_starts]
+
+
+def _since_previous_step(values, episode_starts):
+    """
+    Increase of values since the previous row, 0 on the first row of every episode since the state before it
+    isn't recorded.
+    """
+    increase = np.zeros_like(values)
+    increase[1:] = values[1:] - values[:-1]
+    increase[episode_starts] = 0
+    return np.maximum(increase, 0)
+
+
+def reward_columns(rollouts: Rollouts, reward_functions):
+    """
+    Returns the column names, the (rows, columns) matrix of unweighted values, and for every column the index of its
+    reward function and its weight inside that function (the event weight for OswaldRewardFunction, else 1).
+    """
+    arrays = rollouts.player_arrays()
+    names, columns, owners, inner_weights = [], [], [], []
+
+    for i, func in enumerate(reward_functions):
+        name = type(func).__name__
+        if isinstance(func, OswaldRewardFunction):
+            deltas = _since_previous_step(arrays.events, rollouts.episode_starts)
+            deltas[:, TOUCHED] = arrays.events[:, TOUCHED]
+            for j, event in enumerate(EVENT_COLUMNS):
+                names.append(event)
+                columns.append(deltas[:, j])
+                owners.append(i)
+                inner_weights.append(func.weights[j])
+            continue
+
+        if isinstance(func, PlayerToBallRewardFunction):
+            values = player_to_ball_reward(arrays, func.ball_speed_factor)
+        elif isinstance(func, HitSpeedRewardFunction):
+            ball_speed = np.linalg.norm(arrays.ball_velocity, axis=1)
+            previous_ball_speed = np.concatenate(([0.], ball_speed[:-1]))
+            previous_ball_speed[rollouts.episode_starts] = ball_speed[rollouts.episode_starts]
+            values = hit_speed_reward(arrays, func.reward_weight, previous_ball_speed)
+        elif isinstance(func, AirdribbleRewardFunction):
+            values = airdribble_reward(arrays, func.reward_weight, func.min_distance_threshold)
+        elif isinstance(func, BallToGoalRewardFunction):
+            values = ball_to_goal_reward(arrays, func.reward_weight, func.min_distance_threshold)
+        elif isinstance(func, PlayerVelocityReward):
+            values = player_velocity_reward(arrays)
+        else:
+            raise ValueError("No offline implementation for reward function {0}".format(name))
+        names.append(name)
+        columns.append(values)
+        owners.append(i)
+        inner_weights.append(1.)
+
+    return names, np.column_stack(columns), np.array(owners), np.array(inner_weights, dtype=float)
+
+
+def mask_nan(columns):
+    """
+    Returns columns with their NaN values set to 0, and the number of NaN values in each column.
+    PlayerToBallRewardFunction is NaN for a car without velocity, which would make every sum over it NaN.
+    """
+    nan = np.isnan(columns)
+    return np.where(nan, 0., columns), nan.sum(axis=0)
+
+
+def column_weights(names, owners, inner_weights, reward_weights, overrides=None):
+    """
+    Final weight of every column. overrides maps a column name to a new reward weight (reward function columns)
+    or event weight (OswaldRewardFunction columns).
+    """
+    outer = np.asarray(reward_weights, dtype=float)[owners]
+    inner = inner_weights.copy()
+    for name, value in (overrides or {}).items():
+        if name not in names:
+            raise ValueError("Unknown reward column {0}".format(name))
+        j = names.index(name)
+        if name in EVENT_COLUMNS:
+            inner[j] = value
+        else:
+            outer[owners == owners[j]] = value
+    return outer * inner
+
+
+def describe(values):
+    """
+    Distribution summary of each column of values, leaving out NaN values.
+    """
+    values = np.asarray(values, dtype=float).reshape(len(values), -1)
+    summary = {
+        "mean": np.nanmean(values, axis=0),
+        "std": np.nanstd(values, axis=0),
+        "min": np.nanmin(values, axis=0),
+        "max": np.nanmax(values, axis=0),
+        "nonzero": np.nanmean(np.where(np.isnan(values), np.nan, values != 0), axis=0),
+    }
+    for q, percentile in zip(PERCENTILES, np.nanpercentile(values, PERCENTILES, axis=0)):
+        summary[f"p{q}"] = percentile
+    return summary
+
+
+def discounted_returns(rewards, rollouts: Rollouts, gamma):
+    """
+    Discounted return from the first step of every episode, for each column of rewards.
+    """
+    rewards = np.asarray(rewards, dtype=float).reshape(len(rewards), -1)
+    discounted = rewards * (gamma ** rollouts.steps)[:, None]
+    returns = np.zeros((rollouts.n_episodes, rewards.shape[1]))
+    np.add.at(returns, rollouts.episode_ids, discounted)
+    return returns
+
+
+def _evaluate_configs(columns_path, episodes_path, gamma, weights):
+    """
+    Process pool task: statistics of every weight configuration (row of weights) over the shared memmapped columns.
+    """
+    columns = np.load(columns_path, mmap_mode="r")
+    episodes = np.load(episodes_path)
+    episode_ids, steps, outcome = episodes["episode_ids"], episodes["steps"], episodes["outcome"]
+
+    rewards = columns @ weights.T
+    discounted = rewards * (gamma ** steps)[:, None]
+    returns = np.zeros((int(episode_ids.max()) + 1, len(weights)))
+    np.add.at(returns, episode_ids, discounted)
+
+    contribution = np.abs(np.asarray(columns).mean(axis=0)[None, :] * weights)
+    results = []
+    for c in range(len(weights)):
+        correlation = np.corrcoef(returns[:, c], outcome)[0, 1] if outcome.std() > 0 and returns[:, c].std() > 0 \
+            else float("nan")
+        results.append({
+            "mean_reward": float(rewards[:, c].mean()),
+            "std_reward": float(rewards[:, c].std()),
+            "mean_return": float(returns[:, c].mean()),
+            "std_return": float(returns[:, c].std()),
+            "outcome_correlation": float(correlation),
+            "contribution": (contribution[c] / max(contribution[c].sum(), 1e-12)).tolist(),
+        })
+    return results
+
+
+def sweep(rollouts: Rollouts, columns, configs, gamma, workers=None, chunk_size=16):
+    """
+    Evaluates every (n_columns,) weight vector of configs across a process pool. The columns are shared with the
+    workers through a memory-mapped file instead of being pickled for every task. NaN values count as 0.
+    """
+    configs = np.asarray(configs, dtype=np.float32)
+    with tempfile.TemporaryDirectory() as directory:
+        columns_path = os.path.join(directory, "columns.npy")
+        episodes_path = os.path.join(directory, "episodes.npz")
+        np.save(columns_path, mask_nan(columns)[0].astype(np.float32))
+        np.savez(episodes_path, episode_ids=rollouts.episode_ids, steps=rollouts.steps,
+                 outcome=rollouts.goal_difference())
+
+        chunks = [configs[i:i + chunk_size] for i in range(0, len(configs), chunk_size)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_evaluate_configs, itertools.repeat(columns_path), itertools.repeat(episodes_path),
+                               itertools.repeat(gamma), chunks)
+            return [result for chunk in results for result in chunk]
+
+
+def _parse_grid(grid):
+    parameters = {}
+    for item in grid:
+        name, values = item.split("=")
+        parameters[name] = [float(v) for v in values.split(",")]
+    return parameters
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m training.reward_sweep")
+    parser.add_argument("directory", help="directory written by TrajectoryRecorder")
+    parser.add_argument("--grid", action="append", default=[], help="column=value,value,... to sweep")
+    parser.add_argument("--samples", type=int, help="evaluate this many random configurations of the grid")
+    parser.add_argument("--max-episodes", type=int)
+    parser.add_argument("--half-life-seconds", type=float, default=5)
+    parser.add_argument("--frame-skip", type=int, default=8)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--top", type=int, default=10, help="number of configurations to print")
+    parser.add_argument("--output", help="write the full report as JSON")
+    args = parser.parse_args(argv)
+
+    rollouts = Rollouts.load(args.directory, args.max_episodes)
+    reward_functions, reward_weights = default_rewards()
+    names, columns, owners, inner_weights = reward_columns(rollouts, reward_functions)
+    gamma = gamma_from_half_life(args.half_life_seconds, args.frame_skip)
+    baseline = column_weights(names, owners, inner_weights, reward_weights)
+    print(f"{len(rollouts.states)} steps in {rollouts.n_episodes} episodes, gamma {gamma:.5f}")
+
+    # Distributions leave the NaN values out, the returns, correlations and sweep count them as 0
+    distribution = describe(columns)
+    nan_steps = int(np.count_nonzero(np.isnan(columns).any(axis=1)))
+    columns, nan_counts = mask_nan(columns)
+    print(f"{'column':28s} {'mean':>10s} {'std':>10s} {'p1':>10s} {'p50':>10s} {'p99':>10s} {'nonzero':>8s} "
+          f"{'NaN':>6s}")
+    for j, name in enumerate(names):
+        print(f"{name:28s} {distribution['mean'][j]:10.4f} {distribution['std'][j]:10.4f} {distribution['p1'][j]:10.4f} "
+              f"{distribution['p50'][j]:10.4f} {distribution['p99'][j]:10.4f} {distribution['nonzero'][j]:8.1%} "
+              f"{nan_counts[j]:6d}")
+    if nan_steps:
+        print(f"NaN values on {nan_steps} steps ({nan_steps / len(columns):.1%}) were set to 0")
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correlation = np.corrcoef(columns, rowvar=False)
+    returns = describe(discounted_returns(columns @ baseline, rollouts, gamma))
+    print(f"Baseline discounted return: mean {returns['mean'][0]:.3f}, std {returns['std'][0]:.3f}")
+
+    grid = _parse_grid(args.grid)
+    overrides = [dict(zip(grid, values)) for values in itertools.product(*grid.values())] if grid else [{}]
+    if args.samples is not None and args.samples < len(overrides):
+        rng = np.random.default_rng(0)
+        overrides = [overrides[i] for i in rng.choice(len(overrides), args.samples, replace=False)]
+    configs = [column_weights(names, owners, inner_weights, reward_weights, o) for o in overrides]
+
+    results = sweep(rollouts, columns, configs, gamma, args.workers)
+    for override, result in zip(overrides, results):
+        result["overrides"] = override
+    ranked = sorted(results, key=lambda r: -np.nan_to_num(r["outcome_correlation"], nan=-np.inf))
+    print(f"{len(results)} configurations, ranked by correlation of the discounted return with the goal difference:")
+    for result in ranked[:args.top]:
+        print(f"  {result['outcome_correlation']:+.3f} return {result['mean_return']:10.3f} "
+              f"reward {result['mean_reward']:9.4f} {result['overrides']}")
+
+    if args.output:
+        report = {
+            "steps": len(rollouts.states),
+            "episodes": rollouts.n_episodes,
+            "gamma": gamma,
+            "columns": names,
+            "baseline_weights": baseline.tolist(),
+            "distribution": {key: value.tolist() for key, value in distribution.items()},
+            "nan_values": nan_counts.tolist(),
+            "nan_steps": nan_steps,
+            "correlation": np.nan_to_num(correlation).tolist(),
+            "baseline_return": {key: float(value[0]) for key, value in returns.items()},
+            "configs": ranked,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Per-component reward telemetry for BatchedCombinedReward.
+
+With telemetry_capacity set, BatchedCombinedReward copies its unweighted components into a RewardRingBuffer every step
+(one array assignment). Only when an episode ends are the buffer's rows summed, weighted and attached to the final
+state. RewardComponentsInfo moves these episode summaries into the infos of the done agents, like VecMonitor's
+"episode" key, and RewardTelemetryCallback logs their means under reward_components/ after each rollout.
+"""
+from collections import deque
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import VecEnvWrapper
+
+INFO_KEY = "reward_components"
+
+
+class RewardRingBuffer:
+    """
+    The last capacity steps of unweighted reward components, one (players, components) row per step. Rows of an
+    episode about to be overwritten are first added to the episode's running sums, so episodes longer than the buffer
+    are summed completely.
+    """
+
+    def __init__(self, capacity, n_players, n_components):
+        self.capacity = capacity
+        self.raw = np.zeros((capacity, n_players, n_components), dtype=np.float32)
+        self.position = 0  # Steps recorded so far, the next row is position % capacity
+        self.episode_start = 0
+        self._counted = 0  # Steps of the episode already added to _sums
+        self._sums = np.zeros((n_players, n_components))
+
+    @property
+    def shape(self):
+        return self.raw.shape[1:]
+
+    def record(self, components):
+        self.raw[self.position % self.capacity] = components
+        self.position += 1
+        if self.position % self.capacity == 0:
+            # The buffer is full and wraps around next step
+            start = max(self.episode_start, self._counted)
+            self._sums += self.raw[start % self.capacity:].sum(axis=0)
+            self._counted = self.position
+
+    def recent(self, steps=None):
+        """
+        The last steps rows (all the buffer holds by default), oldest first.
+        """
+        steps = min(self.position, self.capacity if steps is None else steps)
+        rows = np.arange(self.position - steps, self.position) % self.capacity
+        return self.raw[rows]
+
+    def episode_sums(self):
+        # Rows not yet added to _sums never wrap around, the buffer is folded into _sums whenever it's full
+        start = max(self.episode_start, self._counted)
+        first = start % self.capacity
+        return self._sums + self.raw[first:first + self.position - start].sum(axis=0)
+
+    def start_episode(self):
+        self.episode_start = self._counted = self.position
+        self._sums[:] = 0
+
+    def summary(self, names, weights):
+        """
+        Sums of the current episode, {"names", "length", "sum", "weighted_sum"} with (players, components) arrays.
+        """
+        sums = self.episode_sums()
+        return {"names": names, "length": self.position - self.episode_start, "sum": sums,
+                "weighted_sum": sums * weights}
+
+
+class RewardComponentsInfo(VecEnvWrapper):
+    """
+    Sets info["reward_components"] of every done agent to its row of the episode summary BatchedCombinedReward
+    attached to the final state. It needs the states in the infos, so it wraps the matches' VecEnv directly (inside
+    SharedMemoryVecEnv's workers, which send the infos of done agents to the learner).
+    """
+
+    def reset(self):
+        return self.venv.reset()
+
+    def step_wait(self):
+        obs, rewards, dones, infos = self.venv.step_wait()
+        for i in np.flatnonzero(dones):
+            state = infos[i].get("state")
+            summary = getattr(state, "reward_episode", None)
+            if summary is None:
+                continue
+            # Like rlgym's Match, the agents of a match are its players in order
+            player = 0
+            while i - player > 0 and infos[i - player - 1].get("state") is state:
+                player += 1
+            # Agents of a match may share one info dict
+            infos[i] = dict(infos[i])
+            infos[i][INFO_KEY] = {"names": summary["names"], "length": summary["length"],
+                                  "sum": summary["sum"][player], "weighted_sum": summary["weighted_sum"][player]}
+        return obs, rewards, dones, infos
+
+
+class RewardTelemetryCallback(BaseCallback):
+    """
+    Keeps the reward component summaries of the last buffer_size episodes and logs, after each rollout, per component:
+    mean episode sum, weighted sum, mean per step, and fraction of the episode's total absolute weighted reward.
+    """
+
+    def __init__(self, buffer_size=100, verbose=0):
+        super().__init__(verbose)
+        self.episodes = deque(maxlen=buffer_size)
+
+    def _on_step(self) -> bool:
+        infos = self.locals["infos"]
+        for i in np.flatnonzero(self.locals["dones"]):
+            summary = infos[i].get(INFO_KEY)
+            if summary is not None:
+                self.episodes.append(summary)
+        return True
+
+    def _on_rollout_end(self) -> None:
+        if not self.episodes:
+            return
+        names = self.episodes[-1]["names"]
+        episodes = [e for e in self.episodes if e["names"] == names]
+        sums = np.array([e["sum"] for e in episodes])
+        weighted = np.array([e["weighted_sum"] for e in episodes])
+        lengths = np.array([max(e["length"], 1) for e in episodes])
+        total = np.abs(weighted).sum(axis=1, keepdims=True)
+        fraction = np.divide(np.abs(weighted), total, out=np.zeros_like(weighted), where=total > 0)
+
+        for c, name in enumerate(names):
+            self.logger.record(f"reward_components/{name}/episode_sum", sums[:, c].mean(), exclude="stdout")
+            self.logger.record(f"reward_components/{name}/weighted_sum", weighted[:, c].mean(), exclude="stdout")
+            self.logger.record(f"reward_components/{name}/step_mean", (sums[:, c] / lengths).mean(), exclude="stdout")
+            self.logger.record(f"reward_components/{name}/fraction", fraction[:, c].mean(), exclude="stdout")
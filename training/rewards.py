@@ -5,62 +5,38 @@ from rlgym.utils.common_values import BLUE_TEAM, ORANGE_TEAM, ORANGE_GOAL_BACK,
     BLUE_GOAL_BACK, BALL_MAX_SPEED, BACK_WALL_Y, BALL_RADIUS, BACK_NET_Y
 from rlgym.utils.gamestates import GameState, PlayerData
 
+from training.reward_state import RewardStateStore, EVENT_COLUMNS, write_player_events
+
 
 class OswaldRewardFunction(RewardFunction):
     """
     This class calculates the reward for an agent based on the events that occur in a Rocket League, such as scoring goals,
     conceding goals, touching the ball, taking shots, making saves, and picking up boost. The rewards for these events
-    are weighted according to a set of adjustable weights that can be specified as input parameters to the class. Based off of cumulation
-    of events as opposed to events per episode
+    are weighted according to a set of adjustable weights that can be specified as input parameters to the class. Rewards
+    the events of each step, the last values of every car are kept in a RewardStateStore that can be shared with other
+    reward functions.
 
     """
 
     def __init__(self, goal_weight=0, concede_weight=0., touch_weight=0., shot_weight=0., save_weight=0., 
-                 demo_weight=0., boost_pickup_weight=0.):
+                 demo_weight=0., boost_pickup_weight=0., state_store: RewardStateStore = None):
 
         super().__init__()
         self.weights = np.array([goal_weight, concede_weight, touch_weight, shot_weight, save_weight, 
                                  demo_weight, boost_pickup_weight])
 
         # Track changes when event occurs
-        self.last_stored_values = {}
-
-
-    def _extract_player_values(self, player: PlayerData, state: GameState):
-        # Determine which team reward is being calculated for
-        if player.team_num == BLUE_TEAM:
-            team, opponent = state.blue_score, state.orange_score
-        else:
-            team, opponent = state.orange_score, state.blue_score
-
-        return np.array([player.match_goals, opponent, player.ball_touched, player.match_shots,
-                        player.match_saves, player.match_demolishes, player.boost_amount])
-
-    def _calculate_value_differences(self, old_values, new_values):
-        diff_values = new_values - old_values
-        diff_values[diff_values < 0] = 0  # Increasing values
-        return diff_values
-
+        self.state_store = state_store if state_store is not None else RewardStateStore()
+        self._values = np.zeros(len(EVENT_COLUMNS))
 
     def reset(self, initial_state: GameState, optional_data=None):
-        self.cumulative_values = {}
-        for player in initial_state.players:
-            self.cumulative_values[player.car_id] = self._extract_player_values(player, initial_state)
-    
-    def _get_event_reward(self, diff_values):
-        return np.dot(self.weights, diff_values)
+        self.state_store.reset(initial_state)
 
     def get_reward(self, player: PlayerData, state: GameState, previous_action: np.ndarray, optional_data=None):
-        reward = 0
-
-        # Reward for events (goal, save, ball touch, etc.)
-        cumulative_values = self.cumulative_values[player.car_id]
-        new_values = self._extract_player_values(player, state)
-        cumulative_values += new_values
-
-        reward = reward + self._get_event_reward(cumulative_values)
-        self.cumulative_values[player.car_id] = cumulative_values
-        return float(reward)
+        # Reward for events (goal, save, ball touch, etc.) since the last step
+        new_values = write_player_events(player, state, self._values)
+        diff_values = self.state_store.event_deltas(self.state_store.row(player.car_id), new_values)
+        return float(np.dot(self.weights, diff_values))
 
 
 
@@ -125,38 +101,23 @@ class HitSpeedRewardFunction(RewardFunction):
     """
     Calculates the reward for the agent based on the speed of the ball after it is hit.
     """
-    def __init__(self, reward_weight, min_speed_threshold=100):
+    def __init__(self, reward_weight, min_speed_threshold=100, state_store: RewardStateStore = None):
         super().__init__()
         self.reward_weight = reward_weight
         self.min_speed_threshold = min_speed_threshold
 
-    def reset(self, initial_state: GameState, optional_data=None):
-        # Initialize optional_data as an empty dictionary if it is None
-        if optional_data is None:
-            optional_data = {}
+        # The previous ball speed of every car is kept between steps
+        self.state_store = state_store if state_store is not None else RewardStateStore()
 
-        ball_linear_velocity = math.vecmag(initial_state.ball.linear_velocity)
-        optional_data['previous_ball_speed'] = ball_linear_velocity
-        return optional_data
+    def reset(self, initial_state: GameState, optional_data=None):
+        self.state_store.reset(initial_state)
 
     def get_reward(self, player: PlayerData, state: GameState, previous_action: np.ndarray, optional_data=None):
-        ball_linear_velocity = math.vecmag(state.ball.linear_velocity) 
-        if optional_data is None:
-            optional_data = {}
-
-        # Retrieve the previous ball speed from the optional_data dictionary
-        previous_ball_speed = optional_data.get('previous_ball_speed', 0)
-      
-        # Calculate the reward based on the change in ball speed
-        reward = 0
-        if ball_linear_velocity != None:
-            if ball_linear_velocity > previous_ball_speed:
-                reward = self.reward_weight * (ball_linear_velocity - previous_ball_speed) / BALL_MAX_SPEED
-                # Update the previous ball speed for the next timestep
-                optional_data['previous_ball_speed'] = ball_linear_velocity
-        
-        
-        return float(reward)
+        ball_linear_velocity = math.vecmag(state.ball.linear_velocity)
+
+        # Calculate the reward based on the change in ball speed since this player's last step
+        gain = self.state_store.ball_speed_gain(self.state_store.row(player.car_id), ball_linear_velocity)
+        return float(self.reward_weight * gain / BALL_MAX_SPEED)
 
 
 class AirdribbleRewardFunction(RewardFunction):
@@ -0,0 +1,199 @@
+"""
+Rollout buffer for PPO runs with very long rollouts (main.py collects n_steps=1,000,000 per env).
+
+SB3's RolloutBuffer keeps the rollout's observations in RAM as float32 and copies all of them again when the first
+minibatch is drawn (swap_and_flatten). DiskRolloutBuffer writes observations (float32, or float16 for normalized
+observations like OswaldObservations') and actions (the smallest integer type holding the action space) into
+memory-mapped temporary files, and drops their pages from the process's resident memory as it goes, so only the
+page cache holds them and the kernel can evict them when memory runs short. Rewards, values, log probabilities and
+advantages are one float per step and env and stay in RAM.
+
+With float32 observations, training is identical to SB3's buffer: GAE uses the same arithmetic, only computed on
+chunks of steps at once, and minibatches are drawn from the same permutation in the same order. Each minibatch is
+read from the files in row order, for locality, then put back in the permutation's order, on a background thread
+that prepares the next minibatches while the optimizer works on the current one.
+"""
+import collections
+import concurrent.futures
+import mmap
+import os
+import tempfile
+from typing import Generator, Optional
+
+import numpy as np
+from gym import spaces
+from stable_baselines3.common.buffers import BaseBuffer, RolloutBuffer
+from stable_baselines3.common.type_aliases import RolloutBufferSamples
+
+
+def _action_dtype(action_space):
+    # Smallest integer type holding every action, float32 (like SB3) for continuous actions
+    if isinstance(action_space, spaces.MultiDiscrete):
+        n = int(np.max(action_space.nvec))
+    elif isinstance(action_space, spaces.Discrete):
+        n = action_space.n
+    elif isinstance(action_space, spaces.MultiBinary):
+        n = 2
+    else:
+        return np.dtype(np.float32)
+    return np.min_scalar_type(n - 1)
+
+
+class _MappedArray:
+    """
+    An array in a memory-mapped temporary file, deleted as soon as it's created so nothing is left behind.
+    """
+
+    def __init__(self, directory, shape, dtype):
+        self.file = tempfile.TemporaryFile(dir=directory, prefix="rollout-")
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self.file.truncate(max(size, 1))
+        self.map = mmap.mmap(self.file.fileno(), max(size, 1))
+        self.array = np.frombuffer(self.map, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+    def release(self):
+        """
+        Drops the mapped pages from the process's resident memory, the data stays in the file.
+        """
+        if hasattr(self.map, "madvise"):
+            self.map.madvise(mmap.MADV_DONTNEED)
+
+    def close(self):
+        self.array = None
+        self.map.close()
+        self.file.close()
+
+
+class DiskRolloutBuffer(RolloutBuffer):
+    """
+    RolloutBuffer keeping observations and actions in memory-mapped files in directory (the system's temporary
+    directory by default), see the module docstring.
+
+    :param obs_dtype: Type the observations are stored as, np.float16 halves the files for observations whose values
+        are normalized to a few units, at about 3 significant digits.
+    :param chunk_size: Steps per vectorized GAE chunk, also the number of steps written between releases of the
+        observation pages.
+    :param prefetch: Minibatches prepared ahead of the optimizer.
+    """
+
+    def __init__(self, buffer_size, observation_space, action_space, device="auto", gae_lambda=1, gamma=0.99,
+                 n_envs=1, directory=None, obs_dtype=np.float32, chunk_size=4096, prefetch=2):
+        self.directory = directory
+        self.obs_dtype = np.dtype(obs_dtype)
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+        self._mapped = []
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        super().__init__(buffer_size, observation_space, action_space, device, gae_lambda, gamma, n_envs)
+
+    @classmethod
+    def from_model(cls, model, **kwargs):
+        """
+        A buffer with the size and settings of the buffer of an SB3 on-policy model, which replaces it with
+        model.rollout_buffer = DiskRolloutBuffer.from_model(model).
+        """
+        return cls(model.n_steps, model.observation_space, model.action_space, model.device, model.gae_lambda,
+                   model.gamma, model.n_envs, **kwargs)
+
+    def _map(self, shape, dtype):
+        mapped = _MappedArray(self.directory, shape, dtype)
+        self._mapped.append(mapped)
+        return mapped
+
+    def reset(self) -> None:
+        if self.observations is None:
+            self._observations = self._map((self.buffer_size, self.n_envs, *self.obs_shape), self.obs_dtype)
+            self._actions = self._map((self.buffer_size, self.n_envs, self.action_dim),
+                                      _action_dtype(self.action_space))
+            self.observations = self._observations.array
+            self.actions = self._actions.array
+            shape = (self.buffer_size, self.n_envs)
+            self.rewards = np.zeros(shape, dtype=np.float32)
+            self.returns = np.zeros(shape, dtype=np.float32)
+            self.episode_starts = np.zeros(shape, dtype=np.float32)
+            self.values = np.zeros(shape, dtype=np.float32)
+            self.log_probs = np.zeros(shape, dtype=np.float32)
+            self.advantages = np.zeros(shape, dtype=np.float32)
+        # Every row is overwritten by the next rollout, so the files are reused as they are
+        self.generator_ready = False
+        BaseBuffer.reset(self)
+
+    def close(self):
+        # The maps can only be closed once no array views them
+        self.observations = self.actions = None
+        for mapped in self._mapped:
+            mapped.close()
+        self._mapped = []
+
+    def add(self, *args, **kwargs) -> None:
+        super().add(*args, **kwargs)
+        if self.pos % self.chunk_size == 0 or self.full:
+            self._observations.release()
+            self._actions.release()
+
+    def compute_returns_and_advantage(self, last_values, dones: np.ndarray) -> None:
+        """
+        GAE(lambda) advantages and TD(lambda) returns, same values as RolloutBuffer's. The deltas and discounts of a
+        chunk of steps are computed in one vectorized pass, only the recurrence itself runs step by step.
+        """
+        last_values = last_values.clone().cpu().numpy().flatten()
+
+        # The last step bootstraps from last_values, computed like RolloutBuffer does
+        step = self.buffer_size - 1
+        next_non_terminal = 1.0 - dones
+        delta = self.rewards[step] + self.gamma * last_values * next_non_terminal - self.values[step]
+        self.advantages[step] = last_gae_lam = delta
+
+        for end in range(step, 0, -self.chunk_size):
+            start = max(end - self.chunk_size, 0)
+            next_non_terminal = 1.0 - self.episode_starts[start + 1:end + 1]
+            next_values = self.values[start + 1:end + 1]
+            deltas = self.rewards[start:end] + self.gamma * next_values * next_non_terminal - self.values[start:end]
+            discounts = self.gamma * self.gae_lambda * next_non_terminal
+            for t in range(end - start - 1, -1, -1):
+                last_gae_lam = deltas[t] + discounts[t] * last_gae_lam
+                self.advantages[start + t] = last_gae_lam
+        np.add(self.advantages, self.values, out=self.returns)
+
+    def get(self, batch_size: Optional[int] = None) -> Generator[RolloutBufferSamples, None, None]:
+        assert self.full, ""
+        total = self.buffer_size * self.n_envs
+        indices = np.random.permutation(total)
+        if batch_size is None:
+            batch_size = total
+
+        # One worker keeps up to prefetch minibatches ready, a minibatch is read while the previous one is trained on
+        with concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="rollout-prefetch") as pool:
+            pending = collections.deque()
+            for start in range(0, total, batch_size):
+                pending.append(pool.submit(self._get_samples, indices[start:start + batch_size]))
+                if len(pending) > self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _get_samples(self, batch_inds: np.ndarray, env=None) -> RolloutBufferSamples:
+        # batch_inds index the rollout flattened env by env, like RolloutBuffer.swap_and_flatten
+        steps = batch_inds % self.buffer_size
+        envs = batch_inds // self.buffer_size
+        rows = steps * self.n_envs + envs
+        order = np.argsort(rows)
+        sorted_rows = rows[order]
+
+        observations = np.empty((len(rows), *self.obs_shape), dtype=np.float32)
+        observations[order] = self.observations.reshape(-1, *self.obs_shape)[sorted_rows]
+        actions = np.empty((len(rows), self.action_dim), dtype=np.float32)
+        actions[order] = self.actions.reshape(-1, self.action_dim)[sorted_rows]
+        self._observations.release()
+        self._actions.release()
+
+        data = (
+            observations,
+            actions,
+            self.values.reshape(-1)[rows],
+            self.log_probs.reshape(-1)[rows],
+            self.advantages.reshape(-1)[rows],
+            self.returns.reshape(-1)[rows],
+        )
+        return RolloutBufferSamples(*tuple(map(self.to_torch, data)))
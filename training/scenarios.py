@@ -0,0 +1,184 @@
+import bisect
+import numpy as np
+from rlgym.utils.gamestates import GameState
+from rlgym.utils.terminal_conditions import TerminalCondition
+
+
+# Columns of the car arrays, one row per spawn
+CAR_COLUMNS = ("x", "y", "z", "yaw", "boost")
+# Columns of the ball arrays
+BALL_COLUMNS = ("x", "y", "z", "vx", "vy", "vz")
+
+
+def _spawns(n, blue, orange, ball):
+    return (np.tile(np.asarray(blue, dtype=float), (n, 1)), np.tile(np.asarray(orange, dtype=float), (n, 1)),
+            np.tile(np.asarray(ball, dtype=float), (n, 1)))
+
+
+def sample_attack(rng: np.random.Generator, n):
+    # Blue starts at midfield facing the ball in front of the orange goal, random x so the agent doesn't become
+    # acclimated to one ball position
+    blue, orange, ball = _spawns(n, (0, 0, 0, 0.5 * np.pi, 0.25), (0, 4260, 0, -0.5 * np.pi, 0.25), (0, 2816, 70, 0, 0, 0))
+    car_x = rng.integers(-500, 501, n)
+    blue[:, 0] = car_x
+    ball[:, 0] = car_x
+    return blue, orange, ball
+
+
+def sample_defend(rng: np.random.Generator, n):
+    # Ball rolling towards the blue goal with blue in net
+    blue, orange, ball = _spawns(n, (0, -5120, 0, 0.5 * np.pi, 0.5), (0, -2500, 0, -0.5 * np.pi, 0.5), (0, -2816, 70, 0, 0, 0))
+    ball[:, 3] = rng.integers(-200, 201, n)
+    ball[:, 4] = rng.integers(100, 1501, n)
+    return blue, orange, ball
+
+
+def sample_center(rng: np.random.Generator, n):
+    # Ball spawned on top of the blue car near midfield
+    return _spawns(n, (0, -1024, 30, 0.5 * np.pi, 0.5), (0, 1024, 30, -0.5 * np.pi, 0.5), (0, -960, 70, 0, 0, 0))
+
+
+# name -> (sampler, success), success(blue goals, orange goals) is from the blue team's side of the episode
+SCENARIOS = {
+    "attack": (sample_attack, lambda scored, conceded: scored > 0),
+    "defend": (sample_defend, lambda scored, conceded: conceded == 0),
+    "center": (sample_center, lambda scored, conceded: scored > 0),
+}
+
+# Same mix as the original random.randint(0, 12) % 3
+DEFAULT_WEIGHTS = {"attack": 5 / 13, "defend": 4 / 13, "center": 4 / 13}
+
+# Spawns a state recorded in a real match, only offered by state setters given a StateLibrary
+# (training/state_setter.py), so it isn't one of SCENARIOS. Success is not losing the episode.
+RECORDED_SCENARIO = "recorded"
+RECORDED_SUCCESS = lambda scored, conceded: scored >= conceded
+
+
+class ScenarioSampler:
+    """
+    Samples spawn states of each scenario in batches from a seeded generator, sample() then only indexes the next
+    row of the batch. Batches are kept as lists of floats, which are faster to copy into a StateWrapper than NumPy
+    scalars.
+    """
+
+    def __init__(self, rng: np.random.Generator, batch_size=1024):
+        self.rng = rng
+        self.batch_size = batch_size
+        self._batches = {}
+        self._next = {}
+
+    def sample(self, scenario):
+        """
+        Returns the (blue car, orange car, ball) rows of the next spawn of the scenario.
+        """
+        i = self._next.get(scenario, self.batch_size)
+        if i == self.batch_size:
+            sampler, _ = SCENARIOS[scenario]
+            self._batches[scenario] = [array.tolist() for array in sampler(self.rng, self.batch_size)]
+            i = 0
+        self._next[scenario] = i + 1
+        blue, orange, ball = self._batches[scenario]
+        return blue[i], orange[i], ball[i]
+
+
+class ScenarioCurriculum:
+    """
+    Chooses the scenario of each reset from weights that can be changed at runtime. With adaptive set, the weights
+    are also scaled by how often the agent fails each scenario (a smoothed failure rate, at least min_scale), so
+    more episodes go to the scenarios it is weakest at.
+    """
+
+    def __init__(self, rng: np.random.Generator, weights=None, adaptive=False, smoothing=0.05, min_scale=0.1,
+                 batch_size=1024, scenarios=None):
+        self.rng = rng
+        self.scenarios = tuple(scenarios if scenarios is not None else SCENARIOS)
+        self.adaptive = adaptive
+        self.smoothing = smoothing
+        self.min_scale = min_scale
+        self.batch_size = batch_size
+
+        self.episodes = dict.fromkeys(self.scenarios, 0)
+        self.successes = dict.fromkeys(self.scenarios, 0)
+        self.success_rates = dict.fromkeys(self.scenarios, 0.5)
+
+        self._uniforms = []
+        self.set_weights(weights if weights is not None else DEFAULT_WEIGHTS)
+
+    def set_weights(self, weights):
+        """
+        Sets the base weight of each scenario from a {scenario: weight} dict, missing scenarios get 0.
+        """
+        for scenario in weights:
+            if scenario not in self.scenarios:
+                raise ValueError("Unknown scenario {0}".format(scenario))
+        self.base_weights = {scenario: float(weights.get(scenario, 0)) for scenario in self.scenarios}
+        self._update_cumulative_weights()
+
+    @property
+    def weights(self):
+        """
+        Current probability of each scenario.
+        """
+        weights = dict(self.base_weights)
+        if self.adaptive:
+            for scenario in self.scenarios:
+                weights[scenario] *= max(1 - self.success_rates[scenario], self.min_scale)
+        total = sum(weights.values())
+        if total <= 0:
+            raise ValueError("Scenario weights must have a positive sum")
+        return {scenario: weight / total for scenario, weight in weights.items()}
+
+    def _update_cumulative_weights(self):
+        self._cumulative_weights = np.cumsum(list(self.weights.values())).tolist()
+
+    def choose(self):
+        if not self._uniforms:
+            self._uniforms = self.rng.random(self.batch_size).tolist()
+        i = bisect.bisect_right(self._cumulative_weights, self._uniforms.pop())
+        return self.scenarios[min(i, len(self.scenarios) - 1)]
+
+    def record(self, scenario, success):
+        self.episodes[scenario] += 1
+        self.successes[scenario] += int(success)
+        self.success_rates[scenario] += self.smoothing * (float(success) - self.success_rates[scenario])
+        if self.adaptive:
+            self._update_cumulative_weights()
+
+    def stats(self):
+        return {scenario: {"episodes": self.episodes[scenario], "successes": self.successes[scenario],
+                           "success_rate": self.success_rates[scenario], "weight": weight}
+                for scenario, weight in self.weights.items()}
+
+
+class ScenarioOutcomeCondition(TerminalCondition):
+    """
+    Never ends an episode, it records whether the blue team succeeded at the scenario TrainingStateSetter spawned,
+    from the goals scored during the episode, so the curriculum can adapt. Add it to the match's terminal conditions.
+
+    The goals are counted when the next episode starts. The scoreboard carries over resets (Match.get_result relies
+    on it too), so they are the score difference between the two initial states. The state with the goal isn't seen
+    by is_terminal when an earlier condition such as GoalScoredCondition ends the episode on it.
+    """
+
+    def __init__(self, state_setter):
+        super().__init__()
+        self.state_setter = state_setter
+        self._scenario = None
+        self._initial_score = None
+
+    def reset(self, initial_state: GameState):
+        self._record_outcome(initial_state)
+        # Terminal conditions are reset after the state setter, so this is the scenario of the new episode
+        self._scenario = self.state_setter.last_scenario
+        self._initial_score = (initial_state.blue_score, initial_state.orange_score)
+
+    def is_terminal(self, current_state: GameState) -> bool:
+        return False
+
+    def _record_outcome(self, next_initial_state: GameState):
+        if self._scenario is None:
+            return
+        scored = next_initial_state.blue_score - self._initial_score[0]
+        conceded = next_initial_state.orange_score - self._initial_score[1]
+        success = RECORDED_SUCCESS if self._scenario == RECORDED_SCENARIO else SCENARIOS[self._scenario][1]
+        self.state_setter.curriculum.record(self._scenario, success(scored, conceded))
@@ -0,0 +1,267 @@
+"""
+VecEnv whose workers write observations, rewards and dones into shared memory instead of pickling them through pipes.
+
+Every worker process runs a VecEnv (e.g. the agents of one match) and writes its rows of preallocated slabs, the
+learner returns NumPy views of the slabs without copying. The pipes to the workers only carry a one byte command and
+a one byte reply per step, plus the infos of agents whose episode ended, which also lets InstancePool wait on them.
+Slabs are double buffered: the arrays returned by a step stay valid until the step after the next one, long enough
+for SB3's rollout collection, which stores the previous observations after stepping.
+
+Every worker replies once its env is created, and the constructor waits for that reply before starting the next
+worker, so game instances launch one after the other and an env that can't be created fails the constructor.
+"""
+import multiprocessing
+import pickle
+import traceback
+
+import cloudpickle
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+
+# Commands, the first byte of every message to a worker
+STEP = 0
+RESET = 1
+CALL = 2
+CLOSE = 3
+RUN = 4
+
+# First byte of a worker's reply
+OK = 0
+INFOS = 1
+RESULT = 2
+ERROR = 3
+
+
+class _Slabs:
+    """
+    Two buffers of every array, stored in RawArrays so they can be handed to spawned workers.
+    """
+
+    def __init__(self, context, n_envs, obs_shape, action_shape, action_dtype):
+        self.action_dtype = action_dtype
+        action_size = int(np.prod(action_shape))
+        obs_size = int(np.prod(obs_shape))
+        self.shapes = {
+            "obs": (2, n_envs) + tuple(obs_shape),
+            "terminal_obs": (n_envs,) + tuple(obs_shape),
+            "actions": (n_envs,) + tuple(action_shape),
+            "rewards": (2, n_envs),
+            "dones": (2, n_envs),
+        }
+        self.raw = {
+            "obs": context.RawArray("f", 2 * n_envs * obs_size),
+            "terminal_obs": context.RawArray("f", n_envs * obs_size),
+            "actions": context.RawArray("d", n_envs * action_size),
+            "rewards": context.RawArray("d", 2 * n_envs),
+            "dones": context.RawArray("b", 2 * n_envs),
+        }
+
+    def views(self):
+        dtypes = {"obs": np.float32, "terminal_obs": np.float32, "actions": np.float64, "rewards": np.float64,
+                  "dones": np.bool_}
+        return {name: np.frombuffer(raw, dtype=dtypes[name]).reshape(self.shapes[name])
+                for name, raw in self.raw.items()}
+
+
+def _worker(remote, parent_remote, payload, slabs, agents, send_infos):
+    parent_remote.close()
+    try:
+        env = cloudpickle.loads(payload)()
+    except Exception:
+        remote.send_bytes(bytes([ERROR]) + traceback.format_exc().encode())
+        remote.close()
+        raise SystemExit(1)
+    remote.send_bytes(bytes([OK]))
+    views = slabs.views()
+    obs, terminal_obs, actions = views["obs"], views["terminal_obs"], views["actions"]
+    rewards, dones = views["rewards"], views["dones"]
+
+    while True:
+        message = remote.recv_bytes()
+        command = message[0]
+        try:
+            if command == STEP:
+                buffer = message[1]
+                step_obs, step_rewards, step_dones, infos = env.step(actions[agents].astype(slabs.action_dtype))
+                obs[buffer, agents] = step_obs
+                rewards[buffer, agents] = step_rewards
+                dones[buffer, agents] = step_dones
+                done_agents = np.flatnonzero(step_dones)
+                for j in done_agents:
+                    terminal_obs[agents.start + j] = infos[j]["terminal_observation"]
+                if send_infos:
+                    for info in infos:
+                        info.pop("terminal_observation", None)
+                    remote.send_bytes(bytes([INFOS]) + pickle.dumps(infos))
+                elif len(done_agents):
+                    # Episode ends are rare, their infos (e.g. RewardComponentsInfo's summaries) are sent without the
+                    # game state
+                    infos = [{key: value for key, value in infos[j].items()
+                              if key not in ("terminal_observation", "state")} if j in done_agents else {}
+                             for j in range(len(infos))]
+                    remote.send_bytes(bytes([INFOS]) + pickle.dumps(infos))
+                else:
+                    remote.send_bytes(bytes([OK]))
+            elif command == RESET:
+                obs[message[1], agents] = env.reset()
+                remote.send_bytes(bytes([OK]))
+            elif command == CALL:
+                method, args, kwargs = cloudpickle.loads(message[1:])
+                result = getattr(env, method)(*args, **kwargs)
+                remote.send_bytes(bytes([RESULT]) + cloudpickle.dumps(result))
+            elif command == RUN:
+                function = cloudpickle.loads(message[1:])
+                remote.send_bytes(bytes([RESULT]) + cloudpickle.dumps(function()))
+            elif command == CLOSE:
+                env.close()
+                remote.send_bytes(bytes([OK]))
+                break
+        except Exception:
+            remote.send_bytes(bytes([ERROR]) + traceback.format_exc().encode())
+    remote.close()
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    Drop-in replacement for SubprocVecEnv based envs like SB3MultipleInstanceEnv. env_fns are functions returning a
+    VecEnv each, e.g. lambda: SB3SingleInstanceEnv(Gym(get_match())), and n_agents the number of envs each one has.
+    The action and observation spaces are taken from observation_space and action_space, which every worker's env
+    must match.
+
+    Infos only hold terminal_observation, and the infos of agents whose episode ended without RLGym's game state,
+    unless send_infos is set: then the workers pickle all their infos (with the game state) through the pipe, as
+    TrajectoryRecorder needs them.
+
+    The workers are started one at a time, each once the env of the previous one is created. If an env_fn raises or
+    its worker dies, the workers already started are closed and RuntimeError is raised.
+    """
+
+    def __init__(self, env_fns, n_agents, observation_space, action_space, send_infos=False, start_method="spawn"):
+        n_envs = sum(n_agents)
+        super().__init__(n_envs, observation_space, action_space)
+        self.send_infos = send_infos
+        self._buffer = 0
+        self.closed = False
+
+        context = multiprocessing.get_context(start_method)
+        self._slabs = _Slabs(context, n_envs, observation_space.shape, action_space.shape, action_space.dtype)
+        views = self._slabs.views()
+        self._obs, self._terminal_obs, self._actions = views["obs"], views["terminal_obs"], views["actions"]
+        self._rewards, self._dones = views["rewards"], views["dones"]
+
+        self.agents = []
+        self.remotes = []
+        self.processes = []
+        start = 0
+        for env_fn, n in zip(env_fns, n_agents):
+            agents = slice(start, start + n)
+            start += n
+            remote, work_remote = context.Pipe()
+            args = (work_remote, remote, cloudpickle.dumps(env_fn), self._slabs, agents, send_infos)
+            process = context.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            work_remote.close()
+            try:
+                self._receive(remote)
+            except (EOFError, RuntimeError) as e:
+                process.join()
+                remote.close()
+                self.close()
+                raise RuntimeError(f"Worker {len(self.processes)} failed to start its env "
+                                   f"(exit code {process.exitcode})") from e
+            self.agents.append(agents)
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+    def _receive(self, remote):
+        reply = remote.recv_bytes()
+        if reply[0] == ERROR:
+            raise RuntimeError("Worker failed:\n" + reply[1:].decode())
+        return reply
+
+    def reset(self):
+        self._buffer ^= 1
+        for remote in self.remotes:
+            remote.send_bytes(bytes([RESET, self._buffer]))
+        for remote in self.remotes:
+            self._receive(remote)
+        return self._obs[self._buffer]
+
+    def step_async(self, actions):
+        self._buffer ^= 1
+        self._actions[:] = np.reshape(actions, self._actions.shape)
+        for remote in self.remotes:
+            remote.send_bytes(bytes([STEP, self._buffer]))
+
+    def step_wait(self):
+        buffer = self._buffer
+        dones = self._dones[buffer]
+        infos = [{} for _ in range(self.num_envs)]
+        for remote, agents in zip(self.remotes, self.agents):
+            reply = self._receive(remote)
+            if reply[0] == INFOS:
+                infos[agents] = pickle.loads(reply[1:])
+        for i in np.flatnonzero(dones):
+            infos[i]["terminal_observation"] = self._terminal_obs[i].copy()
+        return self._obs[buffer], self._rewards[buffer], dones, infos
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send_bytes(bytes([CLOSE]))
+        for remote, process in zip(self.remotes, self.processes):
+            try:
+                self._receive(remote)
+            except (EOFError, RuntimeError):
+                pass
+            process.join()
+        self.closed = True
+
+    def _call_workers(self, calls):
+        """
+        Calls a method of the VecEnv of every worker in calls ({worker: (method, args, kwargs)}), returns the results
+        in the order of the workers.
+        """
+        for w, call in calls.items():
+            self.remotes[w].send_bytes(bytes([CALL]) + cloudpickle.dumps(call))
+        return [cloudpickle.loads(self._receive(self.remotes[w])[1:]) for w in calls]
+
+    def run_in_workers(self, function):
+        """
+        Calls function() in every worker process, e.g. to collect what the worker measured, returns the results in the
+        order of the workers.
+        """
+        payload = bytes([RUN]) + cloudpickle.dumps(function)
+        for remote in self.remotes:
+            remote.send_bytes(payload)
+        return [cloudpickle.loads(self._receive(remote)[1:]) for remote in self.remotes]
+
+    def _call(self, indices, method, *args, **kwargs):
+        # The indices are translated to each worker's own envs, results come back grouped by worker
+        indices = self._get_indices(indices)
+        calls = {}
+        for w, agents in enumerate(self.agents):
+            local = [i - agents.start for i in indices if agents.start <= i < agents.stop]
+            if local:
+                calls[w] = (method, args, dict(kwargs, indices=local))
+        results = []
+        for result in self._call_workers(calls):
+            results += result if result is not None else []
+        return results
+
+    def get_attr(self, attr_name, indices=None):
+        return self._call(indices, "get_attr", attr_name)
+
+    def set_attr(self, attr_name, value, indices=None):
+        self._call(indices, "set_attr", attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._call(indices, "env_method", method_name, *method_args, **method_kwargs)
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return self._call(indices, "env_is_wrapped", wrapper_class)
+
+    def seed(self, seed=None):
+        calls = {w: ("seed", (None if seed is None else seed + agents.start,), {}) for w, agents in enumerate(self.agents)}
+        return [s for seeds in self._call_workers(calls) for s in (seeds or [])]
@@ -0,0 +1,125 @@
+from typing import Any, Callable, List, Optional, Sequence, Union
+
+import numpy as np
+from rlgym.envs import Match
+from stable_baselines3.common.vec_env import VecEnv
+
+from training.simulator import SimulatedMatches
+
+
+class SimulatedVecEnv(VecEnv):
+    """
+    In-process replacement for SB3MultipleInstanceEnv that runs the matches against SimulatedArenas instead of
+    Rocket League instances. Like SB3MultipleInstanceEnv, every agent of every match is one env.
+
+    Matches with different team sizes or settings are simulated in separate SimulatedMatches, their observations
+    must have the same length (see OswaldObservations' max_team_size).
+
+    Simulated cars often stand exactly still, and PlayerToBallRewardFunction is NaN for a car without velocity. Such
+    NaN rewards are replaced by 0 before they reach PPO, nan_rewards counts them.
+    """
+
+    def __init__(self, match_func_or_matches: Union[Callable[[], Match], Sequence[Match]], num_instances: Optional[int] = None):
+        if callable(match_func_or_matches):
+            assert num_instances is not None, "If using a function to generate Match objects, num_instances must be specified"
+            match_func_or_matches = [match_func_or_matches() for _ in range(num_instances)]
+
+        self.matches = list(match_func_or_matches)
+        # Matches are grouped by configuration, every group is simulated by one SimulatedMatches
+        groups = {}
+        for i, match in enumerate(self.matches):
+            groups.setdefault(tuple(match.get_config()), []).append(i)
+        self.simulations = [SimulatedMatches([self.matches[i] for i in group]) for group in groups.values()]
+        self._groups = list(groups.values())
+        self._owners = [None] * len(self.matches)
+        for s, group in enumerate(self._groups):
+            for local, i in enumerate(group):
+                self._owners[i] = (s, local)
+        self.n_agents_per_env = [m.agents for m in self.matches]
+        self._actions = None
+        self.nan_rewards = 0
+
+        super().__init__(sum(self.n_agents_per_env), self.matches[0].observation_space, self.matches[0].action_space)
+
+    def reset(self):
+        flat_obs = []
+        for i, n_agents in enumerate(self.n_agents_per_env):
+            obs = self._reset_match(i)
+            if n_agents <= 1:
+                flat_obs.append(obs)
+            else:
+                flat_obs += obs
+        return np.asarray(flat_obs)
+
+    def _reset_match(self, i):
+        s, local = self._owners[i]
+        return self.simulations[s].reset(local)
+
+    def _step_matches(self, match_actions):
+        results = [None] * len(self.matches)
+        for simulation, group in zip(self.simulations, self._groups):
+            for i, result in zip(group, simulation.step([match_actions[i] for i in group])):
+                results[i] = result
+        return results
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self._actions = actions
+
+    def step_wait(self):
+        match_actions = []
+        i = 0
+        for n_agents in self.n_agents_per_env:
+            match_actions.append(self._actions[i:i + n_agents])
+            i += n_agents
+
+        flat_obs = []
+        flat_rews = []
+        flat_dones = []
+        flat_infos = []
+        for i, (n_agents, (obs, rew, done, info)) in enumerate(zip(self.n_agents_per_env, self._step_matches(match_actions))):
+            if n_agents <= 1:
+                obs, rew = [obs], [rew]
+
+            infos = [dict(info) for _ in range(n_agents)]
+            if done:
+                # Same auto reset as SubprocVecEnv's worker
+                for agent_info, agent_obs in zip(infos, obs):
+                    agent_info["terminal_observation"] = agent_obs
+                obs = self._reset_match(i)
+                if n_agents <= 1:
+                    obs = [obs]
+
+            flat_obs += obs
+            flat_rews += rew
+            flat_dones += [done] * n_agents
+            flat_infos += infos
+
+        rewards = np.array(flat_rews, dtype=float)
+        nan = np.isnan(rewards)
+        if nan.any():
+            self.nan_rewards += int(nan.sum())
+            rewards[nan] = 0
+        return np.asarray(flat_obs), rewards, np.array(flat_dones), flat_infos
+
+    def close(self) -> None:
+        pass
+
+    def _get_matches(self, indices) -> List[Match]:
+        owners = np.repeat(np.arange(len(self.matches)), self.n_agents_per_env)
+        return [self.matches[owners[i]] for i in self._get_indices(indices)]
+
+    def get_attr(self, attr_name: str, indices=None) -> List[Any]:
+        return [getattr(match, attr_name) for match in self._get_matches(indices)]
+
+    def set_attr(self, attr_name: str, value: Any, indices=None) -> None:
+        for match in self._get_matches(indices):
+            setattr(match, attr_name, value)
+
+    def env_method(self, method_name: str, *method_args, indices=None, **method_kwargs) -> List[Any]:
+        return [getattr(match, method_name)(*method_args, **method_kwargs) for match in self._get_matches(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None) -> List[bool]:
+        return [False] * len(self._get_indices(indices))
+
+    def seed(self, seed: Optional[int] = None) -> List[Union[None, int]]:
+        return [None] * self.num_envs
@@ -0,0 +1,453 @@
+import numpy as np
+from rlgym.utils.common_values import BLUE_TEAM, ORANGE_TEAM, SIDE_WALL_X, BACK_WALL_Y, CEILING_Z, BACK_NET_Y, \
+    GOAL_HEIGHT, BALL_RADIUS, BALL_MAX_SPEED, CAR_MAX_SPEED, SUPERSONIC_THRESHOLD, CAR_MAX_ANG_VEL, BOOST_LOCATIONS
+from rlgym.utils.state_setters.wrappers import StateWrapper
+
+# Simple stand-in for the Rocket League physics so the training code can run without the game.
+# Units are the game's (uu, uu/s, rad), values are rounded from the game where they are known.
+TICK_RATE = 120
+GRAVITY = -650.
+GOAL_HALF_WIDTH = 892.755
+
+BALL_REST_Z = 93.15
+BALL_DRAG = 0.0305
+BALL_RESTITUTION = 0.6
+BALL_FRICTION = 0.7
+BALL_MIN_BOUNCE_SPEED = 60.
+
+CAR_REST_Z = 17.
+CAR_RADIUS = 60.
+CAR_EDGE = 50.
+THROTTLE_ACCEL = 1600.
+BRAKE_ACCEL = 3500.
+COAST_DECEL = 525.
+BOOST_ACCEL = 991.667
+BOOST_CONSUMPTION = 0.333
+MAX_DRIVE_SPEED = 1410.
+JUMP_SPEED = 292.
+DODGE_SPEED = 500.
+DEMO_RESPAWN_SECONDS = 3.
+
+BIG_PAD_BOOST = 1.
+SMALL_PAD_BOOST = 0.12
+BIG_PAD_RESPAWN = 10.
+SMALL_PAD_RESPAWN = 4.
+BIG_PAD_RADIUS = 208.
+SMALL_PAD_RADIUS = 144.
+
+PAD_LOCATIONS = np.array(BOOST_LOCATIONS)
+BIG_PADS = PAD_LOCATIONS[:, 2] > 71
+
+# Mirror of a position or velocity through the x and y axes, used for the orange point of view
+INVERT = np.array([-1., -1., 1.])
+
+# Lengths of the parts of the state floats sent by the RLGym plugin
+PLAYER_INFO_LENGTH = 39
+
+
+def euler_to_quaternion(euler: np.ndarray) -> np.ndarray:
+    """
+    Converts (..., 3) pitch, yaw, roll angles in RLGym's convention to (..., 4) w, x, y, z quaternions.
+    """
+    # rlgym.utils.math.quat_to_euler negates pitch and roll
+    half_roll = -euler[..., 2] / 2
+    half_pitch = -euler[..., 0] / 2
+    half_yaw = euler[..., 1] / 2
+    cr, sr = np.cos(half_roll), np.sin(half_roll)
+    cp, sp = np.cos(half_pitch), np.sin(half_pitch)
+    cy, sy = np.cos(half_yaw), np.sin(half_yaw)
+    return np.stack([cr * cp * cy + sr * sp * sy,
+                     sr * cp * cy - cr * sp * sy,
+                     cr * sp * cy + sr * cp * sy,
+                     cr * cp * sy - sr * sp * cy], axis=-1)
+
+
+def invert_quaternion(quaternion: np.ndarray) -> np.ndarray:
+    # Rotation by pi around the z axis
+    w, x, y, z = np.moveaxis(quaternion, -1, 0)
+    return np.stack([-z, -y, x, w], axis=-1)
+
+
+def euler_to_forward(euler: np.ndarray) -> np.ndarray:
+    cp, sp = np.cos(euler[..., 0]), np.sin(euler[..., 0])
+    cy, sy = np.cos(euler[..., 1]), np.sin(euler[..., 1])
+    return np.stack([cp * cy, cp * sy, sp], axis=-1)
+
+
+def _heading_into_goal(ball_position, ball_velocity, goal_sign, horizon=2.):
+    """
+    Whether the ball will cross the goal line at y = goal_sign * BACK_WALL_Y between the posts within horizon seconds,
+    ignoring gravity and bounces.
+    """
+    velocity_y = ball_velocity[..., 1] * goal_sign
+    with np.errstate(divide="ignore", invalid="ignore"):
+        time = (BACK_WALL_Y - ball_position[..., 1] * goal_sign) / velocity_y
+    crossing_x = ball_position[..., 0] + ball_velocity[..., 0] * np.where(velocity_y > 0, time, 0)
+    return (velocity_y > 0) & (time < horizon) & (np.abs(crossing_x) < GOAL_HALF_WIDTH)
+
+
+class SimulatedArenas:
+    """
+    Vectorized stand-in for n_arenas Rocket League instances with the same cars in each. The ball moves ballistically
+    and bounces off the floor, ceiling and walls, cars are kinematic and driven by the 8 RLGym controls, and boost pads,
+    touches, shots, saves, demos and goals are tracked. States are read and written in the same float format as the
+    RLGym plugin, so an RLGym Match can parse them unchanged.
+    """
+
+    def __init__(self, n_arenas: int, car_ids, teams, gravity=1., boost_consumption=1.):
+        self.n_arenas = n_arenas
+        self.car_ids = np.asarray(car_ids, dtype=int)
+        self.teams = np.asarray(teams, dtype=int)
+        self.n_cars = len(self.car_ids)
+        self.gravity = GRAVITY * gravity
+        self.boost_consumption = BOOST_CONSUMPTION * boost_consumption
+
+        n, c = n_arenas, self.n_cars
+        self.ticks = np.zeros(n, dtype=int)
+        self.scores = np.zeros((n, 2), dtype=int)
+        self.last_touch = np.full(n, -1)
+
+        self.ball_position = np.zeros((n, 3))
+        self.ball_linear_velocity = np.zeros((n, 3))
+        self.ball_angular_velocity = np.zeros((n, 3))
+
+        self.car_position = np.zeros((n, c, 3))
+        self.car_linear_velocity = np.zeros((n, c, 3))
+        self.car_angular_velocity = np.zeros((n, c, 3))
+        self.car_rotation = np.zeros((n, c, 3))
+        self.boost_amount = np.zeros((n, c))
+        self.on_ground = np.ones((n, c), dtype=bool)
+        self.has_jump = np.ones((n, c), dtype=bool)
+        self.has_flip = np.ones((n, c), dtype=bool)
+        self.is_demoed = np.zeros((n, c), dtype=bool)
+        self.demo_timer = np.zeros((n, c))
+        self.ball_touched = np.zeros((n, c), dtype=bool)
+        self.jump_held = np.zeros((n, c), dtype=bool)
+
+        # Match goals, saves, shots, demolishes and boost pickups, in the plugin's order
+        self.stats = np.zeros((n, c, 5), dtype=int)
+
+        self.pad_timers = np.zeros((n, len(PAD_LOCATIONS)))
+
+        # Blue cars respawn on their own side, orange cars on the mirrored side
+        self._team_sign = np.where(self.teams == BLUE_TEAM, 1., -1.)
+
+    def reset_arena(self, i: int, reset_floats):
+        """
+        Applies a reset state in the format of StateWrapper.format_state to arena i.
+        """
+        values = np.asarray(reset_floats, dtype=float)
+        self.ball_position[i] = values[0:3]
+        self.ball_linear_velocity[i] = values[3:6]
+        self.ball_angular_velocity[i] = values[6:9]
+
+        cars = values[9:].reshape(-1, 14)
+        slots = np.searchsorted(self.car_ids, cars[:, 0].astype(int))
+        self.car_position[i, slots] = cars[:, 1:4]
+        self.car_linear_velocity[i, slots] = cars[:, 4:7]
+        self.car_angular_velocity[i, slots] = cars[:, 7:10]
+        self.car_rotation[i, slots] = cars[:, 10:13]
+        self.boost_amount[i, slots] = cars[:, 13]
+
+        self.on_ground[i] = self.car_position[i, :, 2] <= CAR_REST_Z + 1
+        self.has_jump[i] = True
+        self.has_flip[i] = True
+        self.is_demoed[i] = False
+        self.demo_timer[i] = 0
+        self.ball_touched[i] = False
+        self.jump_held[i] = False
+        self.pad_timers[i] = 0
+        self.last_touch[i] = -1
+
+    def step(self, controls: np.ndarray, ticks: int):
+        """
+        Advances every arena by ticks physics ticks with (n_arenas, n_cars, 8) controls held constant.
+        """
+        controls = np.asarray(controls, dtype=float).reshape(self.n_arenas, self.n_cars, 8)
+        self.ball_touched[:] = False
+        dt = 1 / TICK_RATE
+        for _ in range(ticks):
+            self._step_cars(controls, dt)
+            self._step_ball(dt)
+            self._touch_ball()
+            self._demolish()
+            self._pick_up_boost(dt)
+            self._score_goals()
+        self.ticks += ticks
+
+    def _step_cars(self, controls, dt):
+        throttle, steer, pitch, yaw, roll = np.moveaxis(controls[..., :5], -1, 0)
+        jump, boost, handbrake = np.moveaxis(controls[..., 5:] > 0, -1, 0)
+        active = ~self.is_demoed
+        boosting = boost & (self.boost_amount > 0) & active
+        jump_pressed = jump & ~self.jump_held & active
+        self.jump_held = jump
+
+        rotation = self.car_rotation
+        forward = euler_to_forward(rotation)
+        ground = self.on_ground & active
+        air = ~self.on_ground & active
+
+        # Driving, the car always moves along its heading on the ground
+        speed = np.einsum("ncj,ncj->nc", self.car_linear_velocity, forward)
+        drive = np.where(np.abs(speed) < MAX_DRIVE_SPEED, throttle * THROTTLE_ACCEL, 0.)
+        braking = throttle * speed < 0
+        drive = np.where(braking, throttle * BRAKE_ACCEL, drive)
+        coast = np.where(throttle == 0, -np.sign(speed) * np.minimum(np.abs(speed), COAST_DECEL * dt) / dt, 0.)
+        speed = speed + (drive + coast + boosting * BOOST_ACCEL) * dt
+        curvature = np.interp(np.abs(speed), [0, 500, 1000, 1500, 1750, 2300],
+                              [0.0069, 0.00398, 0.00235, 0.001375, 0.0011, 0.00088])
+        yaw_rate = steer * speed * curvature * np.where(handbrake, 1.5, 1.)
+        rotation[..., 1] = np.where(ground, rotation[..., 1] + yaw_rate * dt, rotation[..., 1])
+        rotation[..., 0] = np.where(ground, 0., rotation[..., 0])
+        rotation[..., 2] = np.where(ground, 0., rotation[..., 2])
+        ground_velocity = euler_to_forward(rotation) * speed[..., None]
+
+        # Flying, inputs set the rotation rates and boost pushes along the nose
+        rates = np.stack([pitch, yaw, roll], axis=-1) * CAR_MAX_ANG_VEL
+        air_rotation = rotation + rates * dt
+        rotation[:] = np.where(air[..., None], air_rotation, rotation)
+        air_velocity = self.car_linear_velocity + (euler_to_forward(rotation) * (boosting * BOOST_ACCEL)[..., None]) * dt
+        air_velocity[..., 2] += self.gravity * dt
+
+        velocity = np.where(ground[..., None], ground_velocity, air_velocity)
+
+        # First jump from the ground, a second press in the air dodges along the nose
+        jumping = jump_pressed & ground & self.has_jump
+        velocity[..., 2] += jumping * JUMP_SPEED
+        dodging = jump_pressed & air & self.has_flip
+        velocity += (euler_to_forward(rotation * [0, 1, 0]) * (dodging * DODGE_SPEED)[..., None])
+        self.has_jump &= ~jumping
+        self.has_flip &= ~dodging
+        self.on_ground &= ~jumping
+
+        speed = np.linalg.norm(velocity, axis=-1, keepdims=True)
+        velocity *= np.minimum(1., CAR_MAX_SPEED / np.maximum(speed, 1e-9))
+        velocity[~active] = 0
+        self.car_linear_velocity = velocity
+        self.car_angular_velocity = np.where(air[..., None], rates, 0.)
+        self.car_angular_velocity[..., 2] += np.where(ground, yaw_rate, 0.)
+        self.boost_amount = np.maximum(self.boost_amount - boosting * self.boost_consumption * dt, 0.)
+
+        position = self.car_position + velocity * dt
+        np.clip(position[..., 0], -SIDE_WALL_X + CAR_EDGE, SIDE_WALL_X - CAR_EDGE, out=position[..., 0])
+        np.clip(position[..., 1], -BACK_WALL_Y + CAR_EDGE, BACK_WALL_Y - CAR_EDGE, out=position[..., 1])
+        np.clip(position[..., 2], CAR_REST_Z, CEILING_Z - CAR_EDGE, out=position[..., 2])
+        landed = (position[..., 2] <= CAR_REST_Z) & (self.car_linear_velocity[..., 2] <= 0) & active
+        self.car_linear_velocity[..., 2] = np.where(landed, 0., self.car_linear_velocity[..., 2])
+        self.on_ground |= landed
+        self.has_jump |= landed
+        self.has_flip |= landed
+        self.car_position = np.where(active[..., None], position, self.car_position)
+
+        # Demolished cars come back on their own side after a delay
+        self.demo_timer = np.maximum(self.demo_timer - dt, 0.)
+        respawn = self.is_demoed & (self.demo_timer == 0)
+        if respawn.any():
+            spawn = np.array([0., -4608., CAR_REST_Z]) * np.stack([np.ones_like(self._team_sign),
+                                                                   self._team_sign,
+                                                                   np.ones_like(self._team_sign)], axis=-1)
+            self.car_position = np.where(respawn[..., None], spawn, self.car_position)
+            self.car_rotation[..., 1] = np.where(respawn, np.pi / 2 * self._team_sign, self.car_rotation[..., 1])
+            self.boost_amount = np.where(respawn, 0.333, self.boost_amount)
+            self.is_demoed &= ~respawn
+            self.on_ground |= respawn
+
+    def _step_ball(self, dt):
+        velocity = self.ball_linear_velocity
+        velocity[:, 2] += self.gravity * dt
+        velocity *= 1 - BALL_DRAG * dt
+        position = self.ball_position + velocity * dt
+
+        # Floor, ceiling and side walls
+        for axis, low, high in ((2, BALL_RADIUS, CEILING_Z - BALL_RADIUS),
+                                (0, -SIDE_WALL_X + BALL_RADIUS, SIDE_WALL_X - BALL_RADIUS)):
+            hit = (position[:, axis] < low) | (position[:, axis] > high)
+            position[:, axis] = np.clip(position[:, axis], low, high)
+
+            # Slow contacts, like the ball rolling on the floor, don't bounce or lose speed along the surface
+            bounce = hit & (np.abs(velocity[:, axis]) > BALL_MIN_BOUNCE_SPEED)
+            velocity[:, axis] = np.where(hit, np.where(bounce, -velocity[:, axis] * BALL_RESTITUTION, 0.), velocity[:, axis])
+            if bounce.any():
+                others = [a for a in range(3) if a != axis]
+                velocity[np.ix_(bounce, others)] *= BALL_FRICTION
+
+        # Back walls, except through the goal mouth where the ball continues into the net
+        in_mouth = (np.abs(position[:, 0]) < GOAL_HALF_WIDTH - BALL_RADIUS) & (position[:, 2] < GOAL_HEIGHT - BALL_RADIUS)
+        limit = np.where(in_mouth, BACK_NET_Y - BALL_RADIUS, BACK_WALL_Y - BALL_RADIUS)
+        hit = np.abs(position[:, 1]) > limit
+        position[:, 1] = np.clip(position[:, 1], -limit, limit)
+        velocity[:, 1] = np.where(hit, -velocity[:, 1] * BALL_RESTITUTION, velocity[:, 1])
+
+        speed = np.linalg.norm(velocity, axis=1, keepdims=True)
+        velocity *= np.minimum(1., BALL_MAX_SPEED / np.maximum(speed, 1e-9))
+        self.ball_position = position
+        self.ball_angular_velocity *= 1 - BALL_DRAG * dt
+
+    def _touch_ball(self):
+        for c in range(self.n_cars):
+            offset = self.ball_position - self.car_position[:, c]
+            distance = np.linalg.norm(offset, axis=1)
+            touching = (distance < BALL_RADIUS + CAR_RADIUS) & ~self.is_demoed[:, c]
+            if not touching.any():
+                continue
+
+            normal = offset[touching] / np.maximum(distance[touching], 1e-9)[:, None]
+            ball_position = self.ball_position[touching]
+            ball_velocity = self.ball_linear_velocity[touching]
+            goal_sign = np.where(self.teams[c] == BLUE_TEAM, 1., -1.)
+            was_shot_on_own_goal = _heading_into_goal(ball_position, ball_velocity, -goal_sign)
+
+            # Push the ball out of the car and bounce it off along the contact normal
+            approach = np.einsum("ij,ij->i", self.car_linear_velocity[touching, c] - ball_velocity, normal)
+            ball_velocity = ball_velocity + normal * (np.maximum(approach, 0) * (1 + BALL_RESTITUTION) + 100)[:, None]
+            self.ball_linear_velocity[touching] = ball_velocity
+            self.ball_position[touching] = self.car_position[touching, c] + normal * (BALL_RADIUS + CAR_RADIUS)
+            self.ball_angular_velocity[touching] += np.cross(normal, ball_velocity) / 1000
+
+            is_shot = _heading_into_goal(ball_position, ball_velocity, goal_sign)
+            is_save = was_shot_on_own_goal & ~_heading_into_goal(ball_position, ball_velocity, -goal_sign)
+            self.stats[touching, c, 2] += is_shot
+            self.stats[touching, c, 1] += is_save
+            self.ball_touched[touching, c] = True
+            self.last_touch[touching] = c
+
+    def _demolish(self):
+        speed = np.linalg.norm(self.car_linear_velocity, axis=-1)
+        for a in range(self.n_cars):
+            for b in range(self.n_cars):
+                if self.teams[a] == self.teams[b]:
+                    continue
+                distance = np.linalg.norm(self.car_position[:, a] - self.car_position[:, b], axis=1)
+                demo = (distance < 2 * CAR_RADIUS) & (speed[:, a] >= SUPERSONIC_THRESHOLD) & \
+                       ~self.is_demoed[:, a] & ~self.is_demoed[:, b]
+                if demo.any():
+                    self.is_demoed[demo, b] = True
+                    self.demo_timer[demo, b] = DEMO_RESPAWN_SECONDS
+                    self.car_linear_velocity[demo, b] = 0
+                    self.stats[demo, a, 3] += 1
+
+    def _pick_up_boost(self, dt):
+        self.pad_timers = np.maximum(self.pad_timers - dt, 0.)
+        offset = self.car_position[:, :, None, :2] - PAD_LOCATIONS[:, :2]
+        in_range = (np.einsum("ncpj,ncpj->ncp", offset, offset) < np.where(BIG_PADS, BIG_PAD_RADIUS, SMALL_PAD_RADIUS) ** 2) \
+            & (self.car_position[:, :, None, 2] < 170) & ~self.is_demoed[..., None]
+        for c in range(self.n_cars):
+            pickup = in_range[:, c] & (self.pad_timers == 0) & (self.boost_amount[:, c, None] < 1)
+            if not pickup.any():
+                continue
+            amount = pickup @ np.where(BIG_PADS, BIG_PAD_BOOST, SMALL_PAD_BOOST)
+            self.boost_amount[:, c] = np.minimum(self.boost_amount[:, c] + amount, 1.)
+            self.pad_timers = np.where(pickup, np.where(BIG_PADS, BIG_PAD_RESPAWN, SMALL_PAD_RESPAWN), self.pad_timers)
+            self.stats[:, c, 4] += pickup.sum(axis=1)
+
+    def _score_goals(self):
+        scored = (np.abs(self.ball_position[:, 1]) > BACK_WALL_Y + BALL_RADIUS) & \
+                 (np.abs(self.ball_position[:, 0]) < GOAL_HALF_WIDTH) & (self.ball_position[:, 2] < GOAL_HEIGHT)
+        if not scored.any():
+            return
+
+        # The ball entering the orange goal at +y is a blue goal
+        scoring_team = np.where(self.ball_position[:, 1] > 0, BLUE_TEAM, ORANGE_TEAM)
+        for team in (BLUE_TEAM, ORANGE_TEAM):
+            self.scores[:, team] += scored & (scoring_team == team)
+
+        arenas = np.flatnonzero(scored & (self.last_touch >= 0))
+        scorers = self.last_touch[arenas]
+        own_goal = self.teams[scorers] != scoring_team[arenas]
+        self.stats[arenas[~own_goal], scorers[~own_goal], 0] += 1
+
+        # Kickoff position
+        self.ball_position[scored] = [0., 0., BALL_REST_Z]
+        self.ball_linear_velocity[scored] = 0
+        self.ball_angular_velocity[scored] = 0
+
+    def encode(self, arenas=slice(None)) -> np.ndarray:
+        """
+        Returns a (n_arenas, state_length) array, each row in the float format GameState.decode reads from the plugin.
+
+        :param arenas: Index of the arenas to encode, all of them by default.
+        """
+        car_position = self.car_position[arenas]
+        car_linear_velocity = self.car_linear_velocity[arenas]
+        car_angular_velocity = self.car_angular_velocity[arenas]
+        n, c = car_position.shape[:2]
+        quaternion = euler_to_quaternion(self.car_rotation[arenas])
+        pads = (self.pad_timers[arenas] == 0).astype(float)
+        ball = np.concatenate([self.ball_position[arenas], self.ball_linear_velocity[arenas],
+                               self.ball_angular_velocity[arenas]], axis=1)
+
+        players = np.concatenate([
+            np.broadcast_to(self.car_ids[:, None], (n, c, 1)),
+            np.broadcast_to(self.teams[:, None], (n, c, 1)),
+            car_position, quaternion, car_linear_velocity, car_angular_velocity,
+            car_position * INVERT, invert_quaternion(quaternion),
+            car_linear_velocity * INVERT, car_angular_velocity * INVERT,
+            self.stats[arenas],
+            self.is_demoed[arenas, :, None], self.on_ground[arenas, :, None], self.ball_touched[arenas, :, None],
+            self.has_jump[arenas, :, None], self.has_flip[arenas, :, None], self.boost_amount[arenas, :, None],
+        ], axis=2)
+
+        return np.concatenate([
+            self.ticks[arenas, None], self.scores[arenas],
+            pads,
+            ball, ball * np.tile(INVERT, 3),
+            players.reshape(n, c * PLAYER_INFO_LENGTH),
+        ], axis=1)
+
+
+class SimulatedMatches:
+    """
+    Runs RLGym Match objects against SimulatedArenas, the same way rlgym.gym.Gym runs them against the game. The
+    matches' state setters, observation builders, reward functions and terminal conditions are used unchanged.
+    """
+
+    def __init__(self, matches):
+        self.matches = list(matches)
+        first = self.matches[0]
+        for match in self.matches:
+            if match.get_config() != first.get_config():
+                raise ValueError("All simulated matches must have the same team size, tick skip and settings")
+
+        team_size, spawn_opponents, self.tick_skip, _, gravity, boost_consumption = first.get_config()
+        car_ids = [StateWrapper.BLUE_ID1 + i for i in range(team_size)]
+        teams = [BLUE_TEAM] * team_size
+        if spawn_opponents:
+            car_ids += [StateWrapper.ORANGE_ID1 + i for i in range(team_size)]
+            teams += [ORANGE_TEAM] * team_size
+
+        self.arenas = SimulatedArenas(len(self.matches), car_ids, teams, gravity, boost_consumption)
+        self.n_agents_per_match = [match.agents for match in self.matches]
+        self._states = [None] * len(self.matches)
+        self._controls = np.zeros((len(self.matches), len(car_ids), 8))
+
+    def reset(self, i: int):
+        match = self.matches[i]
+        self.arenas.reset_arena(i, match.get_reset_state())
+        self._controls[i] = 0
+        state = match.parse_state(self.arenas.encode(slice(i, i + 1))[0].tolist())
+        match.episode_reset(state)
+        self._states[i] = state
+        return match.build_observations(state)
+
+    def step(self, actions):
+        """
+        Steps every match with its agents' actions, returns lists of (obs, reward, done, info) per match.
+        """
+        for i, (match, match_actions) in enumerate(zip(self.matches, actions)):
+            parsed = match.parse_actions(match_actions, self._states[i])
+            match.format_actions(parsed)
+            self._controls[i, :len(parsed)] = parsed
+
+        self.arenas.step(self._controls, self.tick_skip)
+        encoded = self.arenas.encode()
+
+        results = []
+        for i, match in enumerate(self.matches):
+            state = match.parse_state(encoded[i].tolist())
+            obs = match.build_observations(state)
+            done = match.is_done(state)
+            reward = match.get_rewards(state, done)
+            self._states[i] = state
+            results.append((obs, reward, done, {"state": state, "result": match.get_result(state)}))
+        return results
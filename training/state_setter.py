@@ -1,97 +1,135 @@
 from rlgym.utils.state_setters import StateSetter
 from rlgym.utils.state_setters import StateWrapper
 import numpy as np
-import random
+
+from training.scenarios import ScenarioSampler, ScenarioCurriculum, SCENARIOS, RECORDED_SCENARIO
 
 
 class TrainingStateSetter(StateSetter):
-    def __init__(self):
+    def __init__(self, seed=None, scenario_weights=None, adaptive=False, batch_size=1024, state_library=None):
+        """
+        seed makes the spawns reproducible, scenario_weights ({scenario: weight}) and adaptive are passed to
+        ScenarioCurriculum. With a state_library (StateLibrary or the path of one), the "recorded" scenario spawns
+        one of its states, give it a weight to use it.
+        """
         super().__init__()
+        rng = np.random.default_rng(seed)
+        self.rng = rng
+        if state_library is not None and not isinstance(state_library, StateLibrary):
+            state_library = StateLibrary(state_library)
+        self.state_library = state_library
+        scenarios = tuple(SCENARIOS) + ((RECORDED_SCENARIO,) if state_library is not None else ())
+        self.sampler = ScenarioSampler(rng, batch_size)
+        self.curriculum = ScenarioCurriculum(rng, scenario_weights, adaptive, batch_size=batch_size,
+                                             scenarios=scenarios)
+        self.last_scenario = None
+
+    def reseed(self, seed):
+        """
+        Restarts the spawns and scenario choices from seed, e.g. to replay the same episodes for every evaluation.
+        """
+        rng = np.random.default_rng(seed)
+        self.rng = rng
+        self.sampler = ScenarioSampler(rng, self.sampler.batch_size)
+        self.curriculum.rng = rng
+        self.curriculum._uniforms = []
 
     def reset(self, state_wrapper: StateWrapper):
         """
-        Randomly chooses 
+        Spawns the cars and ball of a scenario chosen by the curriculum: attack, defend, center (ball spawned on
+        top of the agent's car) or recorded. Spawns are pre-sampled in batches, see training/scenarios.py.
+        """
+        self.last_scenario = self.curriculum.choose()
+        if self.last_scenario == RECORDED_SCENARIO:
+            library = self.state_library
+            library.apply(state_wrapper, library.sample(self.rng, len(state_wrapper.blue_cars()),
+                                                        len(state_wrapper.orange_cars())))
+        else:
+            apply_spawn(state_wrapper, *self.sampler.sample(self.last_scenario))
+
+
+class StateLibrary:
+    """
+    States recorded in real matches, built from the bot's match recordings with python -m training.match_recording
+    states. ball holds (position, linear velocity, angular velocity) rows, cars a (position, pitch yaw roll, linear
+    velocity, angular velocity, boost) row per car slot of every state, and teams the team of every slot, -1 if empty.
+    """
+
+    def __init__(self, path):
+        with np.load(path) as library:
+            self.ball, self.cars, self.teams = library["ball"], library["cars"], library["teams"]
+        if not len(self.ball):
+            raise ValueError("{0} holds no states".format(path))
+        self.blue_counts = (self.teams == 0).sum(axis=1)
+        self.orange_counts = (self.teams == 1).sum(axis=1)
+        self._candidates = {}
+
+    def __len__(self):
+        return len(self.ball)
+
+    def sample(self, rng: np.random.Generator, blue_count, orange_count):
+        """
+        Index of a random state with at least blue_count blue and orange_count orange cars.
         """
-        car_x = random.randint(-500, 500)
-        CAR_Z = 0
-        yaw = 0
-        state_num = random.randint(0,12)
-
-        # Attack
-        if state_num % 3 == 0:
-            for car in state_wrapper.cars:
-                # team_num = 0 = blue team
-                if car.team_num == 0:
-                    # select a unique spawn state from pre-determined values
-                    CAR_Y = 0
-                    yaw = 0.5 * np.pi
-                    car.set_pos(car_x, CAR_Y, CAR_Z)
-
-                # team_num = 1 = orange team
-                elif car.team_num == 1:
-                    # select a unique spawn state from pre-determined values
-                    CAR_Y = 4260
-                    yaw = -0.5 * np.pi
-                    car.set_pos(0, CAR_Y, CAR_Z)
-
-
-                # set car state values
-                
-                car.set_rot(yaw=yaw)
-                car.boost = 0.25
-            
-            state_wrapper.ball.set_pos(x=car_x, y=2816.0, z=70.0) # random x value so agent doesn't become acclimated to one ball pos
-            state_wrapper.ball.set_lin_vel(0, 0, 0)
-        
-        # Defend
-        elif state_num % 3 == 1:
-            for car in state_wrapper.cars:
-                # team_num = 0 = blue team
-                if car.team_num == 0:
-                    # select a unique spawn state from pre-determined valuesl
-                    car_y2 = -5120
-                    yaw = 0.5 * np.pi
-                    car.set_pos(0, car_y2, CAR_Z)
-
-                # team_num = 1 = orange team
-                elif car.team_num == 1:
-                    # select a unique spawn state from pre-determined values
-                    CAR_Y = -2500
-                    yaw = -0.5 * np.pi
-                    car.set_pos(0, CAR_Y, CAR_Z)
-
-
-                # set car state values
-                
-                car.set_rot(yaw=yaw)
-                car.boost = 0.5
-
-            ball_x_velo = random.randint(-200, 200)
-            ball_y_velo = random.randint(100,1500)
-            state_wrapper.ball.set_pos(0.0, -2816.0, 70.0)
-            state_wrapper.ball.set_lin_vel(ball_x_velo, ball_y_velo, 0)
-        
-        # Center spawn on top of agent's car
-        elif state_num % 3 == 2:
-            for car in state_wrapper.cars:
-                # team_num = 0 = blue team
-                if car.team_num == 0:
-                    # select a unique spawn state from pre-determined valuesl
-                    yaw = 0.5 * np.pi
-                    car.set_pos(0.0, -1024.0, 30.0)
-
-                # team_num = 1 = orange team
-                elif car.team_num == 1:
-                    # select a unique spawn state from pre-determined values
-                    CAR_Y = -2500
-                    yaw = -0.5 * np.pi
-                    car.set_pos(0.0,  1024.0, 30.0)
-
-
-                # set car state values
-                
-                car.set_rot(yaw=yaw)
-                car.boost = 0.5
-
-            state_wrapper.ball.set_pos(0.0, -960.0, 70.0)
-            state_wrapper.ball.set_lin_vel(0, 0, 0)
\ No newline at end of file
+        key = (blue_count, orange_count)
+        candidates = self._candidates.get(key)
+        if candidates is None:
+            candidates = np.flatnonzero((self.blue_counts >= blue_count) & (self.orange_counts >= orange_count))
+            if not len(candidates):
+                raise ValueError("No recorded state has {0} blue and {1} orange cars".format(blue_count, orange_count))
+            self._candidates[key] = candidates
+        return int(candidates[rng.integers(len(candidates))])
+
+    def apply(self, state_wrapper: StateWrapper, i):
+        """
+        Places the ball and cars as in state i, the cars of a team take the team's recorded cars in order.
+        """
+        ball = self.ball[i].tolist()
+        state_wrapper.ball.set_pos(*ball[0:3])
+        state_wrapper.ball.set_lin_vel(*ball[3:6])
+        state_wrapper.ball.set_ang_vel(*ball[6:9])
+
+        cars = self.cars[i].tolist()
+        slots = {team: iter(np.flatnonzero(self.teams[i] == team).tolist()) for team in (0, 1)}
+        for car in state_wrapper.cars:
+            x, y, z, pitch, yaw, roll, vx, vy, vz, wx, wy, wz, boost = cars[next(slots[car.team_num])]
+            car.set_pos(x, y, z)
+            car.set_rot(pitch, yaw, roll)
+            car.set_lin_vel(vx, vy, vz)
+            car.set_ang_vel(wx, wy, wz)
+            car.boost = boost
+
+
+class SpawnListStateSetter(StateSetter):
+    """
+    Replays fixed spawns in order, one per reset, starting over after the last one. blue, orange and ball are arrays
+    with one row per spawn in the format of training/scenarios.py, e.g. read-only memory maps shared by processes.
+    """
+
+    def __init__(self, blue, orange, ball):
+        super().__init__()
+        self.blue, self.orange, self.ball = blue, orange, ball
+        self.next = 0
+
+    def rewind(self):
+        self.next = 0
+
+    def reset(self, state_wrapper: StateWrapper):
+        i = self.next
+        self.next = (i + 1) % len(self.ball)
+        apply_spawn(state_wrapper, self.blue[i].tolist(), self.orange[i].tolist(), self.ball[i].tolist())
+
+
+def apply_spawn(state_wrapper: StateWrapper, blue, orange, ball):
+    """
+    Places every car of a team at its team's (x, y, z, yaw, boost) row and the ball at its (x, y, z, vx, vy, vz) row.
+    """
+    for car in state_wrapper.cars:
+        # team_num = 0 = blue team
+        x, y, z, yaw, boost = blue if car.team_num == 0 else orange
+        car.set_pos(x, y, z)
+        car.set_rot(yaw=yaw)
+        car.boost = boost
+
+    state_wrapper.ball.set_pos(ball[0], ball[1], ball[2])
+    state_wrapper.ball.set_lin_vel(ball[3], ball[4], ball[5])
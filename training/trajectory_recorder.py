@@ -0,0 +1,336 @@
+"""
+Records training rollouts into memory-mapped shards so they can be inspected or reused after a run.
+
+Each env (agent) writes its own stream of .npy shards holding a structured array with one row per step:
+
+    obs         observation the action was taken from
+    action      action sent to the env
+    reward      reward returned by the env
+    components  unweighted reward components from BatchedCombinedReward(components_in_state=True), empty without
+    done        whether the episode ended at this step
+    state       the state reached after the action, in the float format GameState.decode reads from the plugin
+    player      index of the agent's player in the state's players
+
+Shards are preallocated with shard_rows rows and episodes never span two shards, so every episode is one contiguous
+slice of a shard, except episodes longer than a shard. Those are split into parts, each part but the last has
+complete set to False and each part but the first has continued set to True. index.jsonl is appended with one line
+per finished episode and shard. When shards are deleted, their lines are removed by rewriting the index, so it only
+grows with the shards on disk.
+"""
+import json
+import os
+import pathlib
+import queue
+import threading
+
+import numpy as np
+from rlgym.utils.gamestates import GameState
+from stable_baselines3.common.vec_env import VecEnvWrapper
+
+INDEX_FILE = "index.jsonl"
+
+
+def state_length(n_players):
+    return 3 + GameState.BOOST_PADS_LENGTH + GameState.BALL_STATE_LENGTH + n_players * GameState.PLAYER_INFO_LENGTH
+
+
+def _write_physics(physics, out):
+    out[0:3] = physics.position
+    out[3:7] = physics.quaternion
+    out[7:10] = physics.linear_velocity
+    out[10:13] = physics.angular_velocity
+
+
+def encode_state(state: GameState, out=None):
+    """
+    Inverse of GameState.decode, GameState(encode_state(state).tolist()) rebuilds the state. The tick count isn't
+    kept by GameState and is written as 0.
+    """
+    if out is None:
+        out = np.empty(state_length(len(state.players)), dtype=np.float32)
+    out[0:3] = (0, state.blue_score, state.orange_score)
+    start = 3
+    out[start:start + GameState.BOOST_PADS_LENGTH] = state.boost_pads
+    start += GameState.BOOST_PADS_LENGTH
+
+    for ball in (state.ball, state.inverted_ball):
+        out[start:start + 3] = ball.position
+        out[start + 3:start + 6] = ball.linear_velocity
+        out[start + 6:start + 9] = ball.angular_velocity
+        start += 9
+
+    for player in state.players:
+        out[start:start + 2] = (player.car_id, player.team_num)
+        _write_physics(player.car_data, out[start + 2:start + 15])
+        _write_physics(player.inverted_car_data, out[start + 15:start + 28])
+        out[start + 28:start + 39] = (player.match_goals, player.match_saves, player.match_shots,
+                                      player.match_demolishes, player.boost_pickups, player.is_demoed,
+                                      player.on_ground, player.ball_touched, player.has_jump, player.has_flip,
+                                      player.boost_amount)
+        start += GameState.PLAYER_INFO_LENGTH
+    return out
+
+
+class TrajectoryWriter:
+    """
+    Appends steps of every env to its shards, see the module docstring for the layout. With max_bytes set, the
+    oldest finished shards are deleted once the shards on disk grow past it.
+    """
+
+    def __init__(self, directory, n_envs, shard_rows=32768, max_bytes=None):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.n_envs = n_envs
+        self.shard_rows = shard_rows
+        self.max_bytes = max_bytes
+
+        self.dtype = None
+        self._index = open(self.directory / INDEX_FILE, "a")
+        self._shards = [None] * n_envs
+        self._shard_names = [None] * n_envs
+        self._shard_counts = [0] * n_envs
+        self._positions = [0] * n_envs
+        self._episode_starts = [0] * n_envs
+        self._continued = [False] * n_envs
+        self._finished_shards = []
+        self._finished_bytes = 0
+        self._step = None
+
+    def _make_dtype(self, obs, actions, components, states):
+        return np.dtype([
+            ("obs", np.float32, obs.shape[1:]),
+            ("action", np.float32, actions.shape[1:]),
+            ("reward", np.float32),
+            ("components", np.float32, components.shape[1:]),
+            ("done", np.bool_),
+            ("state", np.float32, states.shape[1:]),
+            ("player", np.int8),
+        ])
+
+    def _open_shard(self, env):
+        name = f"env{env:03d}_{self._shard_counts[env]:06d}.npy"
+        self._shard_counts[env] += 1
+        self._shard_names[env] = name
+        self._shards[env] = np.lib.format.open_memmap(self.directory / name, mode="w+", dtype=self.dtype,
+                                                      shape=(self.shard_rows,))
+
+    def _record(self, **record):
+        self._index.write(json.dumps(record) + "\n")
+        self._index.flush()
+
+    def _close_shard(self, env, name, shard, rows):
+        shard.flush()
+        self._record(type="shard", name=name, env=env, rows=rows)
+
+        self._finished_shards.append(name)
+        self._finished_bytes += os.path.getsize(self.directory / name)
+        deleted = []
+        while self.max_bytes is not None and self._finished_bytes > self.max_bytes and self._finished_shards:
+            oldest = self._finished_shards.pop(0)
+            self._finished_bytes -= os.path.getsize(self.directory / oldest)
+            deleted.append(oldest)
+        if deleted:
+            # The index stops listing the shards before they're removed, so it never points at a missing file
+            self._prune_index(set(deleted))
+            for oldest in deleted:
+                os.remove(self.directory / oldest)
+
+    def _prune_index(self, deleted):
+        """
+        Rewrites the index without the lines of the deleted shards, replacing the old one in a single rename.
+        """
+        self._index.close()
+        path = self.directory / INDEX_FILE
+        tmp_path = path.with_name(INDEX_FILE + ".tmp")
+        with open(path) as f, open(tmp_path, "w") as out:
+            for line in f:
+                record = json.loads(line)
+                if record.get("shard", record.get("name")) not in deleted:
+                    out.write(line)
+        os.replace(tmp_path, path)
+        self._index = open(path, "a")
+
+    def _next_shard(self, env):
+        """
+        Moves the env to a new shard, carrying over the rows of its unfinished episode so it stays contiguous.
+        """
+        old_shard, old_name = self._shards[env], self._shard_names[env]
+        start, position = self._episode_starts[env], self._positions[env]
+        if start == 0:
+            # The episode alone fills a shard, keep it as a part and continue it in the next shard
+            self._record(type="episode", shard=old_name, env=env, start=0, stop=position, complete=False,
+                         continued=self._continued[env])
+            self._continued[env] = True
+            start = position
+
+        self._open_shard(env)
+        carried = position - start
+        self._shards[env][:carried] = old_shard[start:position]
+        self._close_shard(env, old_name, old_shard, start)
+        self._episode_starts[env] = 0
+        self._positions[env] = carried
+
+    def write_step(self, obs, actions, rewards, dones, components, states, players):
+        """
+        Writes one row for every env, all arguments have the envs on their first axis.
+        """
+        if self.dtype is None:
+            self.dtype = self._make_dtype(obs, actions, components, states)
+            self._step = np.empty(self.n_envs, dtype=self.dtype)
+            for env in range(self.n_envs):
+                self._open_shard(env)
+
+        step = self._step
+        step["obs"] = obs
+        step["action"] = actions
+        step["reward"] = rewards
+        step["components"] = components
+        step["done"] = dones
+        step["state"] = states
+        step["player"] = players
+
+        for env in range(self.n_envs):
+            if self._positions[env] == self.shard_rows:
+                self._next_shard(env)
+            position = self._positions[env]
+            self._shards[env][position] = step[env]
+            self._positions[env] = position + 1
+            if dones[env]:
+                self._record(type="episode", shard=self._shard_names[env], env=env,
+                             start=self._episode_starts[env], stop=position + 1, complete=True,
+                             continued=self._continued[env])
+                self._episode_starts[env] = position + 1
+                self._continued[env] = False
+
+    def close(self):
+        for env in range(self.n_envs):
+            if self._shards[env] is None:
+                continue
+            if self._episode_starts[env] < self._positions[env]:
+                self._record(type="episode", shard=self._shard_names[env], env=env,
+                             start=self._episode_starts[env], stop=self._positions[env], complete=False,
+                             continued=self._continued[env])
+            self._close_shard(env, self._shard_names[env], self._shards[env], self._positions[env])
+            self._shards[env] = None
+        self._index.close()
+
+
+class TrajectoryRecorder(VecEnvWrapper):
+    """
+    VecEnv wrapper that records every step with a TrajectoryWriter on a background thread, so the env step only
+    queues references to the arrays it already returned. Wrap the env before VecNormalize to record raw rewards.
+    """
+
+    def __init__(self, venv, directory, shard_rows=32768, max_bytes=None, queue_size=256):
+        super().__init__(venv)
+        self.writer = TrajectoryWriter(directory, venv.num_envs, shard_rows, max_bytes)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._last_obs = None
+        self._actions = None
+        self._thread = threading.Thread(target=self._run, name="trajectory-recorder", daemon=True)
+        self._thread.start()
+
+    def reset(self):
+        obs = self.venv.reset()
+        self._last_obs = np.copy(obs)
+        return obs
+
+    def step_async(self, actions):
+        self._actions = np.copy(actions)
+        self.venv.step_async(actions)
+
+    def step_wait(self):
+        if self._error is not None:
+            raise RuntimeError("Trajectory recorder failed") from self._error
+        obs, rewards, dones, infos = self.venv.step_wait()
+        # Copies, SharedMemoryVecEnv reuses its arrays before the writer thread gets to them
+        self._queue.put((self._last_obs, self._actions, np.copy(rewards), np.copy(dones),
+                         [info.get("state") for info in infos]))
+        self._last_obs = np.copy(obs)
+        return obs, rewards, dones, infos
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self.venv.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                self.writer.write_step(*self._encode(*item))
+            except Exception as e:
+                self._error = e
+        self.writer.close()
+
+    @staticmethod
+    def _encode(obs, actions, rewards, dones, states):
+        """
+        Encodes the states of the step, agents of the same match share one state and one encoding. Like rlgym's Match,
+        the agents of a match are its players in order, so an agent's player is its position among the agents
+        sharing the state.
+        """
+        n = len(states)
+        encoded = [None] * n
+        components = [None] * n
+        players = np.zeros(n, dtype=np.int8)
+        for i, state in enumerate(states):
+            players[i] = players[i - 1] + 1 if i > 0 and state is states[i - 1] else 0
+            encoded[i] = encoded[i - 1] if players[i] > 0 else encode_state(state)
+            state_components = getattr(state, "reward_components", None)
+            components[i] = state_components[players[i]] if state_components is not None else np.zeros(0)
+        return (np.asarray(obs), np.asarray(actions).reshape(n, -1), np.asarray(rewards), np.asarray(dones),
+                np.asarray(components), np.asarray(encoded), players)
+
+
+class TrajectoryReader:
+    """
+    Reads what a TrajectoryWriter wrote. Episodes are returned as slices of read-only memory maps, no data is copied.
+    """
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self.episodes = []
+        self.shards = {}
+        # Indexes written before the index was pruned list the deleted shards with delete lines
+        deleted = set()
+        with open(self.directory / INDEX_FILE) as f:
+            for line in f:
+                record = json.loads(line)
+                if record["type"] == "episode":
+                    self.episodes.append(record)
+                elif record["type"] == "shard":
+                    self.shards[record["name"]] = record
+                elif record["type"] == "delete":
+                    deleted.add(record["name"])
+        self.episodes = [e for e in self.episodes if e["shard"] not in deleted]
+        self.shards = {name: s for name, s in self.shards.items() if name not in deleted}
+        self._maps = {}
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def _map(self, name):
+        shard = self._maps.get(name)
+        if shard is None:
+            shard = self._maps[name] = np.load(self.directory / name, mmap_mode="r")
+        return shard
+
+    def episode(self, i):
+        """
+        Structured array of the rows of episode i, fields are read with episode["obs"], episode["state"], etc.
+        """
+        record = self.episodes[i]
+        return self._map(record["shard"])[record["start"]:record["stop"]]
+
+    def iter_shards(self):
+        """
+        Yields the filled rows of every finished shard, for processing whole recordings in bulk.
+        """
+        for name, record in self.shards.items():
+            yield self._map(name)[:record["rows"]]
@@ -0,0 +1,72 @@
+"""
+Cache of policy weights that bot processes memory-map instead of each loading the checkpoint.
+
+The first process to load a checkpoint exports its policy network (the only step needing torch and
+stable_baselines3) into <cache directory>/<SHA-256 of the checkpoint>/, one uncompressed .npy per array. Every process
+then maps those files read-only with NumpyPolicy, so the weights are in memory once however many bots run, and a
+changed checkpoint gets a new directory. Concurrent first loads are safe: each exports into a directory of its own
+and renames it into place, the losers use the winner's.
+"""
+import hashlib
+import io
+import os
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+
+from training.numpy_policy import NumpyPolicy
+
+# Written last, a directory without it is incomplete
+COMPLETE_MARKER = "complete"
+
+
+def file_hash(path, chunk_size=2 ** 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _export(checkpoint_path, directory):
+    # Deferred, only the first load of a checkpoint needs torch
+    from training.export_policy import export_policy, load_checkpoint
+
+    exported = io.BytesIO()
+    export_policy(load_checkpoint(checkpoint_path), exported)
+    exported.seek(0)
+    with np.load(exported) as artifact:
+        for name in artifact.files:
+            np.save(directory / f"{name}.npy", artifact[name])
+    (directory / COMPLETE_MARKER).touch()
+
+
+def cached_weights(checkpoint_path, cache_directory):
+    """
+    Returns the cache directory holding the exported weights of the PPO checkpoint, exporting them on a miss.
+    """
+    cache_directory = pathlib.Path(cache_directory)
+    directory = cache_directory / file_hash(checkpoint_path)
+    if (directory / COMPLETE_MARKER).exists():
+        return directory
+
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    tmp_directory = pathlib.Path(tempfile.mkdtemp(dir=cache_directory, prefix=".export-"))
+    try:
+        _export(checkpoint_path, tmp_directory)
+        try:
+            os.rename(tmp_directory, directory)
+        except OSError:
+            # Another process finished first, or an incomplete directory was left behind by a crash
+            if not (directory / COMPLETE_MARKER).exists():
+                shutil.rmtree(directory, ignore_errors=True)
+                os.rename(tmp_directory, directory)
+    finally:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+    return directory
+
+
+def load_cached_policy(checkpoint_path, cache_directory):
+    return NumpyPolicy(cached_weights(checkpoint_path, cache_directory))